@@ -0,0 +1,100 @@
+""" Benchmark CSV Import
+
+Creates a synthetic classification export (one row per species per
+capture event with up to three images, labels and meta data) and measures
+the throughput and the peak memory of importing it with the csv importer.
+
+Example Usage:
+--------------
+python benchmarks/benchmark_csv_import.py \
+-csv_path /tmp/synthetic_export.csv \
+-n_rows 20000000
+"""
+import argparse
+import csv
+import os
+import random
+import resource
+import time
+
+from camera_trap_classifier.data.importer import DatasetImporter
+
+
+SPECIES = ['species_%s' % i for i in range(0, 50)]
+COUNTS = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11-50', '51+']
+
+
+def create_synthetic_csv(path, n_rows, multi_species_share=0.05, seed=123):
+    """ Write a csv with 'n_rows' rows, 'multi_species_share' of the
+        capture events have two rows (two species)
+    """
+    rnd = random.Random(seed)
+    header = ['capture_id', 'image1', 'image2', 'image3', 'species',
+              'count', 'standing', 'resting', 'site', 'camera', 'date']
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        i = 0
+        n_written = 0
+        while n_written < n_rows:
+            site = 'site_%s' % rnd.randint(0, 200)
+            camera = 'camera_%s' % rnd.randint(0, 5)
+            date = '2018-%02d-%02d' % (rnd.randint(1, 12), rnd.randint(1, 28))
+            n_images = rnd.randint(1, 3)
+            images = ['/images/%s/%s/%s/%s_%s.jpg' % (site, camera, date, i, j)
+                      for j in range(0, n_images)]
+            images += [''] * (3 - n_images)
+            n_species = 2 if rnd.random() < multi_species_share else 1
+            for _ in range(0, n_species):
+                row = ['capture_%s' % i] + images + [
+                    rnd.choice(SPECIES), rnd.choice(COUNTS),
+                    rnd.choice(['0', '1', '']), rnd.choice(['0', '1', '']),
+                    site, camera, date]
+                writer.writerow(row)
+                n_written += 1
+            i += 1
+
+
+def peak_memory_mb():
+    """ Peak resident memory of this process in MB (Linux: kB units) """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK CSV IMPORT')
+    parser.add_argument("-csv_path", type=str, required=True,
+                        help="path of the synthetic csv (re-used if it \
+                              exists)")
+    parser.add_argument("-n_rows", type=int, default=1000000,
+                        help="number of rows of the synthetic csv")
+    args = vars(parser.parse_args())
+
+    if not os.path.exists(args['csv_path']):
+        print("Creating synthetic csv with %s rows" % args['n_rows'])
+        create_synthetic_csv(args['csv_path'], args['n_rows'])
+
+    with open(args['csv_path'], 'r') as f:
+        n_rows = sum(1 for _ in f) - 1
+
+    params = {'path': args['csv_path'],
+              'capture_id_col': 'capture_id',
+              'image_path_col_list': ['image1', 'image2', 'image3'],
+              'attributes_col_list': ['species', 'count', 'standing',
+                                      'resting'],
+              'meta_col_list': ['site', 'camera', 'date']}
+
+    memory_before = peak_memory_mb()
+    start_time = time.time()
+    importer = DatasetImporter.create('csv', params)
+    data = importer.import_from_source()
+    elapsed = time.time() - start_time
+    memory_after = peak_memory_mb()
+
+    print("Imported %s rows into %s records in %.1f s - %.0f rows/s" %
+          (n_rows, len(data), elapsed, n_rows / elapsed))
+    print("Peak memory: %.0f MB (%.0f MB before import)" %
+          (memory_after, memory_before))
+
+
+if __name__ == '__main__':
+    main()
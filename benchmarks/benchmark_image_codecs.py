@@ -0,0 +1,83 @@
+""" Benchmark Image Codecs
+
+Measures how many images per second a single core can read, resize and
+encode with each image codec (see data/image_codecs.py).
+
+Example Usage:
+--------------
+python benchmarks/benchmark_image_codecs.py \
+-image_dir ./camera_trap_classifier/test/test_images \
+-smallest_side 300 \
+-image_save_quality 90 \
+-n_images 200
+"""
+import argparse
+import os
+import time
+
+from camera_trap_classifier.data.image_codecs import ImageCodec
+
+
+def find_images(image_dir, n_images, ext=('.jpg', '.jpeg', '.png')):
+    """ Find up to n_images images in image_dir """
+    image_paths = list()
+    for root, _, files in os.walk(image_dir):
+        for f in sorted(files):
+            if f.lower().endswith(ext):
+                image_paths.append(os.path.join(root, f))
+            if len(image_paths) >= n_images:
+                return image_paths
+    return image_paths
+
+
+def benchmark_codec(codec, image_paths, n_repeats):
+    """ Returns images/second and average output size in bytes """
+    # warm up (TF initialization, caches)
+    codec.read_and_encode(image_paths[0])
+    n_bytes = 0
+    start_time = time.time()
+    for _ in range(0, n_repeats):
+        for image_path in image_paths:
+            n_bytes += len(codec.read_and_encode(image_path))
+    elapsed = time.time() - start_time
+    n_total = n_repeats * len(image_paths)
+    return n_total / elapsed, n_bytes / n_total
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK IMAGE CODECS')
+    parser.add_argument("-image_dir", type=str, required=True,
+                        help="directory with images (incl. sub-dirs)")
+    parser.add_argument("-codecs", nargs='+', type=str,
+                        default=['tensorflow', 'pillow'],
+                        help="codecs to benchmark")
+    parser.add_argument("-smallest_side", type=int, default=500,
+                        help="smallest side of the resized images")
+    parser.add_argument("-image_save_quality", type=int, default=90,
+                        help="jpeg quality of the encoded images")
+    parser.add_argument("-n_images", type=int, default=200,
+                        help="max number of images to process")
+    parser.add_argument("-n_repeats", type=int, default=3,
+                        help="number of passes over the images")
+    args = vars(parser.parse_args())
+
+    image_paths = find_images(args['image_dir'], args['n_images'])
+    assert len(image_paths) > 0, \
+        "Found no images in %s" % args['image_dir']
+    print("Benchmarking %s images (smallest side %s, quality %s)" %
+          (len(image_paths), args['smallest_side'],
+           args['image_save_quality']))
+
+    for codec_type in args['codecs']:
+        codec = ImageCodec.create(
+            codec_type,
+            {'smallest_side': args['smallest_side'],
+             'image_save_quality': args['image_save_quality']})
+        images_per_second, avg_bytes = benchmark_codec(
+            codec, image_paths, args['n_repeats'])
+        print("Codec: %-12s images/second/core: %8.1f avg. size: %8.0f bytes"
+              % (codec_type, images_per_second, avg_bytes))
+
+
+if __name__ == '__main__':
+    main()
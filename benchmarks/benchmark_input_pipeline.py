@@ -0,0 +1,154 @@
+""" Benchmark the Input Pipeline
+
+Writes records with the jpeg images of 'image_dir' to 'n_files' TFRecord
+files and measures the batches per second of DatasetReader.get_iterator
+with preprocess_image and the default augmentation of config.yaml
+(is_training=True) for the fixed settings (24 files, n_cpus parallel
+calls, no prefetching of batches), the tf.data autotuned settings and the
+settings chosen by a calibration run (see data/pipeline_tuning.py).
+With -batch_augmentation the calibrated settings are also measured with
+flipping, color augmentation and standardization applied per batch
+(preprocess_batch) instead of per record.
+
+Run it on CPU only (CUDA_VISIBLE_DEVICES="") to measure the pipeline
+that feeds CPU training nodes.
+
+Example Usage:
+--------------
+python benchmarks/benchmark_input_pipeline.py \
+-image_dir ./camera_trap_classifier/test/test_images \
+-output_dir /tmp/input_pipeline \
+-n_records 2000 -n_files 8 -n_cpus 4
+"""
+import argparse
+import os
+import time
+
+import tensorflow as tf
+
+from camera_trap_classifier.config.config import ConfigLoader
+from camera_trap_classifier.data.tfr_encoder_decoder import (
+    DefaultTFRecordEncoderDecoder)
+from camera_trap_classifier.data.reader import DatasetReader
+from camera_trap_classifier.data.image import (
+    preprocess_image, preprocess_batch)
+from camera_trap_classifier.data.pipeline_tuning import (
+    fixed_settings, autotune_settings, calibrate_input_pipeline,
+    measure_batches_per_second)
+
+from benchmark_tfr_compression import find_images, create_records
+
+
+def write_files(serialized_records, output_dir, n_files):
+    """ Write the records round-robin to n_files files """
+    paths = [os.path.join(output_dir, 'benchmark_%03d.tfrecord' % i)
+             for i in range(0, n_files)]
+    writers = [tf.python_io.TFRecordWriter(path) for path in paths]
+    for i, serialized_record in enumerate(serialized_records):
+        writers[i % n_files].write(serialized_record)
+    for writer in writers:
+        writer.close()
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK INPUT PIPELINE')
+    parser.add_argument("-image_dir", type=str, required=True,
+                        help="directory with jpegs (incl. sub-dirs)")
+    parser.add_argument("-output_dir", type=str, required=True,
+                        help="directory to write the TFRecord files to")
+    parser.add_argument("-n_records", type=int, default=2000,
+                        help="number of records to write")
+    parser.add_argument("-n_files", type=int, default=8,
+                        help="number of TFRecord files")
+    parser.add_argument("-n_cpus", type=int, default=4,
+                        help="number of cpus of the fixed settings")
+    parser.add_argument("-batch_size", type=int, default=64,
+                        help="batch size")
+    parser.add_argument("-model", type=str, default='ResNet18',
+                        help="model whose image size is used")
+    parser.add_argument("-n_batches", type=int, default=30,
+                        help="number of batches to time")
+    parser.add_argument("-n_calibration_batches", type=int, default=10,
+                        help="number of batches to time per setting \
+                              during the calibration")
+    parser.add_argument("-batch_augmentation", default=False,
+                        action='store_true',
+                        help="also measure augmenting whole batches")
+    args = vars(parser.parse_args())
+
+    image_paths = find_images(args['image_dir'])
+    assert len(image_paths) > 0, "Found no jpegs in %s" % args['image_dir']
+    os.makedirs(args['output_dir'], exist_ok=True)
+
+    encoder = DefaultTFRecordEncoderDecoder()
+    serialized_records = [
+        encoder.encode_record(record) for record in
+        create_records(image_paths, args['n_records'])]
+    tfr_files = write_files(
+        serialized_records, args['output_dir'], args['n_files'])
+
+    cfg_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'camera_trap_classifier', 'config', 'config.yaml')
+    config = ConfigLoader(cfg_path)
+    image_processing = {
+        **config.cfg['models'][args['model']]['image_processing'],
+        **config.cfg['image_processing'],
+        'is_training': True,
+        'image_means': [0.5, 0.5, 0.5],
+        'image_stdevs': [0.25, 0.25, 0.25]}
+
+    data_reader = DatasetReader(encoder.decode_record)
+
+    def dataset_fn(settings, batch_augmentation=False):
+        if batch_augmentation:
+            pre_processing = {
+                'image_pre_processing_args': {
+                    **image_processing, 'batch_augmentation': True},
+                'batch_pre_processing_fun': preprocess_batch,
+                'batch_pre_processing_args': image_processing}
+        else:
+            pre_processing = {
+                'image_pre_processing_args': dict(image_processing)}
+        return data_reader.get_iterator(
+            tfr_files=tfr_files,
+            batch_size=args['batch_size'],
+            is_train=True,
+            n_repeats=None,
+            output_labels=['species'],
+            image_pre_processing_fun=preprocess_image,
+            buffer_size=4 * args['batch_size'],
+            **pre_processing,
+            **settings)
+
+    print("Benchmarking %s records in %s files - batch size %s - \
+augmentation %s" % (len(serialized_records), len(tfr_files),
+                    args['batch_size'], image_processing['color_augmentation']))
+
+    start_time = time.time()
+    calibrated, _ = calibrate_input_pipeline(
+        dataset_fn, n_cpus=args['n_cpus'], n_files=len(tfr_files),
+        n_batches=args['n_calibration_batches'])
+    print("Calibration took %.1f s" % (time.time() - start_time))
+
+    runs = [('fixed', fixed_settings(args['n_cpus']), False),
+            ('autotune', autotune_settings(len(tfr_files)), False),
+            ('calibrated', calibrated, False)]
+    if args['batch_augmentation']:
+        runs.append(('calibrated + batch augmentation', calibrated, True))
+
+    for name, settings, batch_augmentation in runs:
+        batches_per_second = measure_batches_per_second(
+            lambda x: dataset_fn(x, batch_augmentation), settings,
+            n_batches=args['n_batches'])
+        print("%-32s %7.2f batches/s %9.1f images/s - %s" %
+              (name, batches_per_second,
+               batches_per_second * args['batch_size'], settings))
+
+    for path in tfr_files:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
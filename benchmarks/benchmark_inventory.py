@@ -0,0 +1,123 @@
+""" Benchmark Dataset Inventory Stores
+
+Compares the memory usage and the run time of common inventory operations
+of a dict backed inventory and a ColumnarInventory backed inventory on
+synthetic records. With -output_dir the time to export and to re-import
+the inventory as json and as binary inventory file is compared as well.
+
+Example Usage:
+--------------
+python benchmarks/benchmark_inventory.py -n_records 1000000 \
+-output_dir /tmp/inventory_benchmark
+"""
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.columnar_inventory import ColumnarInventory
+
+
+SPECIES = ['species_%s' % i for i in range(0, 50)]
+COUNTS = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11-50', '51+']
+
+
+def create_records(n_records, seed=123):
+    """ Create synthetic records similar to camera trap inventories """
+    rnd = random.Random(seed)
+    records = dict()
+    for i in range(0, n_records):
+        site = 'site_%s' % rnd.randint(0, 200)
+        camera = 'camera_%s' % rnd.randint(0, 5)
+        n_labels = 2 if rnd.random() < 0.05 else 1
+        records['capture_%s' % i] = {
+            'labels': [{'species': rnd.choice(SPECIES),
+                        'count': rnd.choice(COUNTS),
+                        'standing': rnd.choice(['0', '1', '-1'])}
+                       for _ in range(0, n_labels)],
+            'images': ['/images/%s/%s/%s_%s.jpg' % (site, camera, i, j)
+                       for j in range(0, rnd.randint(1, 3))],
+            'meta_data': {'site': site, 'camera': camera}}
+    return records
+
+
+def measure(fun, *args):
+    """ Returns the result of fun(*args) and the elapsed time """
+    start_time = time.time()
+    result = fun(*args)
+    return result, time.time() - start_time
+
+
+def create_inventory(n_records, columnar):
+    """ Create an inventory and measure its memory usage """
+    tracemalloc.start()
+    records = create_records(n_records)
+    if columnar:
+        records = ColumnarInventory.from_dict(records, consume=True)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    dinv = DatasetInventoryMaster(columnar=columnar)
+    dinv.data_inventory = records
+    return dinv, size, peak
+
+
+def benchmark_formats(dinv, output_dir):
+    """ Export and re-import the inventory as json and binary file """
+    os.makedirs(output_dir, exist_ok=True)
+    for name, export, source_type in [
+            ('json', dinv.export_to_json, 'json'),
+            ('binary', dinv.export_to_binary, 'binary')]:
+        path = os.path.join(output_dir, 'inventory.%s' % name)
+        _, t_export = measure(export, path)
+        imported = DatasetInventoryMaster()
+        _, t_import = measure(
+            imported.create_from_source, source_type, {'path': path})
+        _, t_filter = measure(
+            imported.remove_records_with_label, ['species'], ['species_1'])
+        print("    format: %-6s size: %7.1f MB export: %6.2f s \
+import: %6.2f s import + filter: %6.2f s" %
+              (name, os.path.getsize(path) / 1e6, t_export, t_import,
+               t_import + t_filter))
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK INVENTORY')
+    parser.add_argument("-n_records", type=int, default=1000000,
+                        help="number of synthetic records")
+    parser.add_argument("-output_dir", type=str, default=None,
+                        help="directory to write inventory files to, \
+                              compares the json and binary formats")
+    args = vars(parser.parse_args())
+
+    for columnar in [False, True]:
+        dinv, size, peak = create_inventory(args['n_records'], columnar)
+        record_ids = random.Random(1).sample(
+            dinv.get_all_record_ids(), min(100000, args['n_records']))
+
+        _, t_stats = measure(dinv._calc_label_stats)
+        _, t_labels = measure(dinv._get_all_labels)
+        _, t_access = measure(
+            lambda: [dinv.data_inventory[x] for x in record_ids])
+        _, t_iterate = measure(
+            lambda: sum(len(r['images'])
+                        for r in dinv.data_inventory.values()))
+        _, t_remove = measure(
+            dinv.remove_records_with_label, ['species'], ['species_1'])
+
+        print("Store: %-8s memory: %7.1f MB (peak %7.1f MB)" %
+              ('columnar' if columnar else 'dict', size / 1e6, peak / 1e6))
+        print("    label stats: %6.2f s  all labels: %6.2f s  \
+access %s records: %6.2f s" %
+              (t_stats, t_labels, len(record_ids), t_access))
+        print("    iterate all records: %6.2f s  remove label: %6.2f s" %
+              (t_iterate, t_remove))
+        if args['output_dir'] is not None and columnar:
+            benchmark_formats(dinv, args['output_dir'])
+        del dinv
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+""" Benchmark Remapping Labels
+
+Measures the run time and the additional peak memory of remapping the
+species labels of a synthetic inventory, compared to copying the
+inventory with copy.deepcopy (what remap_labels used to do).
+
+Example Usage:
+--------------
+python benchmarks/benchmark_remap_labels.py -n_records 1000000
+"""
+import argparse
+import copy
+import time
+import tracemalloc
+
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.columnar_inventory import ColumnarInventory
+
+from benchmark_inventory import create_records, SPECIES
+
+
+def measure_peak(fun, *args):
+    """ Returns the elapsed time and the peak memory allocated while
+        running fun(*args) """
+    tracemalloc.start()
+    start_time = time.time()
+    fun(*args)
+    elapsed = time.time() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK REMAP LABELS')
+    parser.add_argument("-n_records", type=int, default=1000000,
+                        help="number of synthetic records")
+    args = vars(parser.parse_args())
+
+    # map half of the species to one class
+    label_map = {'species': {x: 'other' for x in SPECIES[0::2]}}
+
+    records = create_records(args['n_records'])
+    elapsed, peak = measure_peak(copy.deepcopy, records)
+    print("deepcopy (previous remap)    time: %6.2f s peak: %7.1f MB" %
+          (elapsed, peak / 1e6))
+
+    dinv = DatasetInventoryMaster()
+    dinv.data_inventory = records
+    elapsed, peak = measure_peak(dinv.remap_labels, label_map)
+    print("remap_labels dict            time: %6.2f s peak: %7.1f MB" %
+          (elapsed, peak / 1e6))
+    del dinv, records
+
+    dinv = DatasetInventoryMaster(columnar=True)
+    dinv.data_inventory = ColumnarInventory.from_dict(
+        create_records(args['n_records']), consume=True)
+    elapsed, peak = measure_peak(dinv.remap_labels, label_map)
+    print("remap_labels columnar        time: %6.2f s peak: %7.1f MB" %
+          (elapsed, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
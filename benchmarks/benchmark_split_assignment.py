@@ -0,0 +1,50 @@
+""" Benchmark Split Assignment
+
+Compares the run time of assigning ids to splits one by one (hashing each
+id with id_to_zero_one and looping over the cumulative split percentages)
+with the vectorized assignment of randomly_split_dataset and checks that
+both produce the same assignments.
+
+Example Usage:
+--------------
+python benchmarks/benchmark_split_assignment.py -n_ids 10000000
+"""
+import argparse
+import time
+
+from camera_trap_classifier.data.utils import (
+    randomly_split_dataset, id_to_zero_one, _assign_zero_one_to_split)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK SPLIT ASSIGNMENT')
+    parser.add_argument("-n_ids", type=int, default=10000000,
+                        help="number of ids to assign")
+    parser.add_argument("-split_names", nargs='+', type=str,
+                        default=['train', 'val', 'test'])
+    parser.add_argument("-split_percent", nargs='+', type=float,
+                        default=[0.9, 0.05, 0.05])
+    args = vars(parser.parse_args())
+
+    ids = ['capture_%s' % i for i in range(0, args['n_ids'])]
+
+    start_time = time.time()
+    expected = {x: _assign_zero_one_to_split(
+                    id_to_zero_one(x), args['split_percent'],
+                    args['split_names'])
+                for x in ids}
+    t_scalar = time.time() - start_time
+
+    start_time = time.time()
+    splits = randomly_split_dataset(
+        ids, args['split_names'], args['split_percent'])
+    t_vectorized = time.time() - start_time
+
+    assert splits == expected, "Split assignments differ"
+
+    print("Assigned %s ids - one by one: %6.2f s vectorized: %6.2f s \
+(%.1fx)" % (len(ids), t_scalar, t_vectorized, t_scalar / t_vectorized))
+
+
+if __name__ == '__main__':
+    main()
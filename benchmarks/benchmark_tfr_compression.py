@@ -0,0 +1,147 @@
+""" Benchmark TFRecord Compression
+
+Writes the same records (with the jpeg images of 'image_dir') to an
+uncompressed, a ZLIB and a GZIP compressed TFRecord file and reports the
+file size relative to the uncompressed file, the write time and the read
+throughput of each compression type.
+
+Jpegs are already compressed, hence the size reduction is mostly due to
+the other record data (ids, paths, labels, meta data). The read throughput
+indicates whether the smaller files pay off on bandwidth bound storage.
+
+Example Usage:
+--------------
+python benchmarks/benchmark_tfr_compression.py \
+-image_dir ./camera_trap_classifier/test/test_images \
+-output_dir /tmp/tfr_compression \
+-n_records 1000
+"""
+import argparse
+import os
+import time
+
+import tensorflow as tf
+
+from camera_trap_classifier.data.tfr_encoder_decoder import (
+    DefaultTFRecordEncoderDecoder)
+
+
+COMPRESSION_TYPES = {'NONE': None, 'ZLIB': 'ZLIB', 'GZIP': 'GZIP'}
+
+
+def find_images(image_dir, ext=('.jpg', '.jpeg')):
+    """ Find all jpegs in image_dir """
+    image_paths = list()
+    for root, _, files in os.walk(image_dir):
+        for f in sorted(files):
+            if f.lower().endswith(ext):
+                image_paths.append(os.path.join(root, f))
+    return image_paths
+
+
+def create_records(image_paths, n_records):
+    """ Create 'n_records' records by cycling through the images """
+    images = list()
+    for image_path in image_paths:
+        with open(image_path, 'rb') as f:
+            images.append(f.read())
+    records = list()
+    for i in range(0, n_records):
+        image_i = i % len(images)
+        records.append({
+            'id': 'record_%s' % i,
+            'n_images': 1,
+            'n_labels': 1,
+            'image_paths': [image_paths[image_i]],
+            'meta_data': '{"camera": "camera_%s"}' % (i % 10),
+            'labelstext': '#species:species_%s' % (i % 5),
+            'label/species': ['species_%s' % (i % 5)],
+            'label_num/species': [i % 5],
+            'images': [images[image_i]]})
+    return records
+
+
+def options_for(compression_type):
+    """ TFRecordOptions for a compression type """
+    if compression_type is None:
+        return None
+    return tf.python_io.TFRecordOptions(compression_type)
+
+
+def write_file(serialized_records, path, compression_type):
+    """ Write the records, returns the elapsed time """
+    start_time = time.time()
+    with tf.python_io.TFRecordWriter(
+            path, options=options_for(compression_type)) as writer:
+        for serialized_record in serialized_records:
+            writer.write(serialized_record)
+    return time.time() - start_time
+
+
+def read_file(path, compression_type, n_repeats):
+    """ Read all records, returns records/second and MB/second
+        (uncompressed) """
+    n_records = 0
+    n_bytes = 0
+    start_time = time.time()
+    for _ in range(0, n_repeats):
+        for record in tf.python_io.tf_record_iterator(
+                path, options=options_for(compression_type)):
+            n_records += 1
+            n_bytes += len(record)
+    elapsed = time.time() - start_time
+    return n_records / elapsed, n_bytes / 1e6 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK TFR COMPRESSION')
+    parser.add_argument("-image_dir", type=str, required=True,
+                        help="directory with jpegs (incl. sub-dirs)")
+    parser.add_argument("-output_dir", type=str, required=True,
+                        help="directory to write the TFRecord files to")
+    parser.add_argument("-compression_types", nargs='+', type=str,
+                        default=['NONE', 'ZLIB', 'GZIP'],
+                        choices=list(COMPRESSION_TYPES.keys()),
+                        help="compression types to benchmark")
+    parser.add_argument("-n_records", type=int, default=1000,
+                        help="number of records to write")
+    parser.add_argument("-n_repeats", type=int, default=3,
+                        help="number of passes over each file when reading")
+    args = vars(parser.parse_args())
+
+    image_paths = find_images(args['image_dir'])
+    assert len(image_paths) > 0, "Found no jpegs in %s" % args['image_dir']
+    os.makedirs(args['output_dir'], exist_ok=True)
+
+    encoder = DefaultTFRecordEncoderDecoder()
+    serialized_records = [
+        encoder.encode_record(record) for record in
+        create_records(image_paths, args['n_records'])]
+
+    print("Benchmarking %s records with %s distinct images" %
+          (len(serialized_records), len(image_paths)))
+
+    uncompressed_size = None
+    for name in args['compression_types']:
+        compression_type = COMPRESSION_TYPES[name]
+        path = os.path.join(args['output_dir'], 'benchmark_%s.tfrecord' %
+                            name.lower())
+        write_time = write_file(serialized_records, path, compression_type)
+        file_size = os.path.getsize(path)
+        if uncompressed_size is None and compression_type is None:
+            uncompressed_size = file_size
+        records_per_second, mb_per_second = read_file(
+            path, compression_type, args['n_repeats'])
+        if uncompressed_size is None:
+            size_ratio = float('nan')
+        else:
+            size_ratio = file_size / uncompressed_size
+        print("Compression: %-5s size: %8.2f MB ratio: %5.3f \
+write: %6.2f s read: %9.1f records/s %7.1f MB/s" %
+              (name, file_size / 1e6, size_ratio, write_time,
+               records_per_second, mb_per_second))
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
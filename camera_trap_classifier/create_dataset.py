@@ -11,23 +11,27 @@ python create_dataset.py -inventory ./test_big/cat_dog_dir_test.json \
 -overwrite
 
 """
+import os
 import argparse
 import logging
 
 from camera_trap_classifier.config.logging import setup_logging
 from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.label_filter import LabelFilter
+from camera_trap_classifier.data.binary_inventory import is_binary_inventory
 from camera_trap_classifier.data.writer import DatasetWriter
 from camera_trap_classifier.data.tfr_encoder_decoder import (
     DefaultTFRecordEncoderDecoder)
-from camera_trap_classifier.data.image import (
-    read_image_from_disk_resize_and_convert_to_jpeg)
+from camera_trap_classifier.data.image_codecs import ImageCodec
+from camera_trap_classifier.data.image_cache import ImageCache
 
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(prog='CREATE DATASET')
     parser.add_argument("-inventory", type=str, required=True,
-                        help="path to inventory json file")
+                        help="path to inventory json file or binary \
+                              inventory file (the format is detected)")
     parser.add_argument("-output_dir", type=str, required=True,
                         help="Directory to which TFRecord files are written")
     parser.add_argument(
@@ -72,6 +76,11 @@ def main():
                         help='keep only records with label value (a list) and \
                               corresponding keep_label_name',
                         required=False)
+    parser.add_argument("-columnar_inventory", default=False,
+                        action='store_true', required=False,
+                        help="store the inventory in a compact columnar \
+                              format, which requires much less memory for \
+                              large inventories")
     parser.add_argument("-remove_multi_label_records", default=True,
                         action='store_true', required=False,
                         help="whether to remove records with more than one \
@@ -81,6 +90,18 @@ def main():
                         help='Root path of all images - will be appended to\
                               the image paths stored in the dataset inventory',
                         required=False)
+    parser.add_argument("-check_images", default=False,
+                        action='store_true', required=False,
+                        help="whether to check all images (exist and have \
+                              an image header) with a pool of threads \
+                              before writing TFRecord files, missing and \
+                              unreadable images are removed from the \
+                              inventory and listed in \
+                              output_dir/image_check_report.json")
+    parser.add_argument("-check_images_n_threads", type=int, default=32,
+                        required=False,
+                        help="number of images to check in parallel \
+                              (default 32)")
     parser.add_argument("-image_save_side_smallest", type=int,
                         default=500,
                         required=False,
@@ -96,9 +117,47 @@ def main():
                         help="The image quality of the images saved to\
                               TFRecord files. Recommended is 75-90 for good\
                               quality-size trade-off.")
+    parser.add_argument("-image_codec", type=str,
+                        default='tensorflow',
+                        choices=['tensorflow', 'pillow'],
+                        required=False,
+                        help="The library used to read, resize and encode the\
+                              images. 'pillow' is considerably faster on CPUs\
+                              (decodes jpegs at reduced scale) but requires\
+                              Pillow to be installed (default tensorflow)")
+    parser.add_argument("-disable_jpeg_passthrough", default=False,
+                        action='store_true', required=False,
+                        help="whether to re-encode jpegs that need no \
+                              resizing instead of storing their original \
+                              bytes")
+    parser.add_argument("-image_cache_dir", type=str, default=None,
+                        required=False,
+                        help="Directory to cache processed images in, \
+                              re-running create_dataset with identical image \
+                              settings re-uses the cached images")
+    parser.add_argument("-image_cache_max_size_gb", type=float, default=None,
+                        required=False,
+                        help="Max size of the image cache in GB, least \
+                              recently used images are removed every 1000 \
+                              new images (per process) and after each split \
+                              (default no limit)")
+    parser.add_argument("-image_cache_hash_content", default=False,
+                        action='store_true', required=False,
+                        help="Identify cached images by a hash of their \
+                              content instead of path, modification time \
+                              and size (requires reading each image)")
     parser.add_argument("-overwrite", default=False,
                         action='store_true', required=False,
                         help="whether to overwrite existing tfr files")
+    parser.add_argument("-resume", default=False,
+                        action='store_true', required=False,
+                        help="whether to resume writing tfr files of an \
+                              interrupted run from their last checkpoint \
+                              (requires identical arguments)")
+    parser.add_argument("-checkpoint_every", type=int,
+                        default=100, required=False,
+                        help="number of records after which the progress of \
+                              a tfr file is checkpointed (default 100)")
     parser.add_argument("-write_tfr_in_parallel", default=False,
                         action='store_true', required=False,
                         help="whether to write tfrecords in parallel if more \
@@ -110,12 +169,34 @@ def main():
                               (only if 'write_tfr_in_parallel' is false)")
     parser.add_argument("-process_images_in_parallel_size", type=int,
                         default=320, required=False,
-                        help="if processing images in parallel - how many per \
-                              process, this can influene memory requirements")
+                        help="if processing images in parallel - how many \
+                              records are sent to the worker processes at \
+                              once (split equally among them), this can \
+                              influence memory requirements")
     parser.add_argument("-processes_images_in_parallel_n_processes", type=int,
                         default=4, required=False,
                         help="if processing images in parallel - how many \
                               processes to use (default 4)")
+    parser.add_argument("-max_records_in_flight", type=int,
+                        default=None, required=False,
+                        help="if processing images in parallel - the max \
+                              number of records being processed at the same \
+                              time, bounds the memory requirements \
+                              (default 2 * process_images_in_parallel_size)")
+    parser.add_argument("-image_read_threads", type=int,
+                        default=None, required=False,
+                        help="read the images ahead with that many threads \
+                              and pass their bytes to the image processing, \
+                              recommended for network file systems \
+                              (e.g. 32, default: images are read by the \
+                              image processing)")
+    parser.add_argument("-image_read_ahead", type=int,
+                        default=None, required=False,
+                        help="if reading images ahead - the max number of \
+                              records whose images are read ahead \
+                              (default max_records_in_flight if processing \
+                              images in parallel, else \
+                              4 * image_read_threads)")
     parser.add_argument("-max_records_per_file", type=int,
                         default=5000,
                         required=False,
@@ -123,6 +204,20 @@ def main():
                              Multiple files are generated if the size of\
                              the dataset exceeds this value. It is recommended\
                              to use large values (default 5000)")
+    parser.add_argument("-max_file_size_mb", type=float,
+                        default=None,
+                        required=False,
+                        help="The max size of a TFRecord file in MB. If \
+                             specified, records are split into files of \
+                             about that size instead of by \
+                             max_records_per_file, which balances the \
+                             work of reading the files (e.g. 150)")
+    parser.add_argument("-compression_type", type=str, default=None,
+                        choices=['GZIP', 'ZLIB'], required=False,
+                        help="Compress the TFRecord files, which reduces \
+                              their size (mostly of the non-image data) for \
+                              slow storage at the cost of CPU time for \
+                              reading them (default: no compression)")
 
     # Parse command line arguments
     args = vars(parser.parse_args())
@@ -141,12 +236,18 @@ def main():
 
     # Create Dataset Inventory
     params = {'path': args['inventory']}
-    dinv = DatasetInventoryMaster()
-    dinv.create_from_source('json', params)
+    dinv = DatasetInventoryMaster(columnar=args['columnar_inventory'])
+    if is_binary_inventory(args['inventory']):
+        dinv.create_from_source('binary', params)
+    else:
+        dinv.create_from_source('json', params)
+
+    # Filter records by labels, all filters are evaluated in one pass
+    label_filter = LabelFilter()
 
     # Remove multi-label subjects
     if args['remove_multi_label_records']:
-        dinv.remove_multi_label_records()
+        label_filter.remove_multi_label()
 
     # Remove specific labels
     if args['remove_label_name'] is not None:
@@ -154,9 +255,9 @@ def main():
             raise ValueError('if remove_label_name is specified\
                               remove_label_value needs to be specified')
 
-        dinv.remove_records_with_label(
-            label_name_list=args['remove_label_name'],
-            label_value_list=args['remove_label_value'])
+        for label_name, label_value in zip(args['remove_label_name'],
+                                           args['remove_label_value']):
+            label_filter.remove_label(label_name, label_value)
 
     # keep only specific labels
     if args['keep_label_name'] is not None:
@@ -164,12 +265,24 @@ def main():
             raise ValueError('if keep_label_name is specified\
                               keep_label_value needs to be specified')
 
-        dinv.keep_only_records_with_label(
-            label_name_list=args['keep_label_name'],
-            label_value_list=args['keep_label_value'])
+        for label_name, label_value in zip(args['keep_label_name'],
+                                           args['keep_label_value']):
+            label_filter.keep_label(label_name, label_value)
+
+    label_stats = dinv.apply_label_filter(label_filter)
+
+    # Remove missing and unreadable images
+    if args['check_images']:
+        report = dinv.remove_unreadable_images(
+            image_root_path=args['image_root_path'],
+            n_threads=args['check_images_n_threads'],
+            report_path=os.path.join(args['output_dir'],
+                                     'image_check_report.json'))
+        if report['n_records_removed'] > 0:
+            label_stats = None
 
     # Log Statistics
-    dinv.log_stats()
+    dinv.log_stats(label_stats=label_stats)
 
     # Determine if Meta-Column has been specified
     if args['split_by_meta'] is not None:
@@ -217,6 +330,28 @@ def main():
     # Write TFrecord files
     tfr_encoder_decoder = DefaultTFRecordEncoderDecoder()
     tfr_writer = DatasetWriter(tfr_encoder_decoder.encode_record)
+    image_codec = ImageCodec.create(
+        args['image_codec'],
+        {'smallest_side': args['image_save_side_smallest'],
+         'image_save_quality': args['image_save_quality'],
+         'jpeg_passthrough': not args['disable_jpeg_passthrough']})
+
+    if args['image_cache_dir'] is not None:
+        if args['image_cache_max_size_gb'] is None:
+            max_size_bytes = None
+        else:
+            max_size_bytes = int(args['image_cache_max_size_gb'] * 1e9)
+        image_cache = ImageCache(
+            args['image_cache_dir'],
+            max_size_bytes=max_size_bytes,
+            hash_content=args['image_cache_hash_content'])
+    else:
+        image_cache = None
+
+    if args['max_file_size_mb'] is not None:
+        max_bytes_per_file = int(args['max_file_size_mb'] * 1e6)
+    else:
+        max_bytes_per_file = None
 
     counter = 0
     n_splits = len(splitted.keys())
@@ -229,21 +364,31 @@ def main():
             args['output_dir'],
             file_prefix=split_name,
             image_root_path=args['image_root_path'],
-            image_pre_processing_fun=read_image_from_disk_resize_and_convert_to_jpeg,
-            image_pre_processing_args={"smallest_side":
-                                       args['image_save_side_smallest'],
-                                       "image_save_quality":
-                                       args['image_save_quality']},
+            image_codec=image_codec,
+            image_cache=image_cache,
             random_shuffle_before_save=True,
             overwrite_existing_files=args['overwrite'],
             max_records_per_file=args['max_records_per_file'],
+            max_bytes_per_file=max_bytes_per_file,
             write_tfr_in_parallel=args['write_tfr_in_parallel'],
             process_images_in_parallel=args['process_images_in_parallel'],
             process_images_in_parallel_size=args['process_images_in_parallel_size'],
-            processes_images_in_parallel_n_processes=args['processes_images_in_parallel_n_processes']
+            processes_images_in_parallel_n_processes=args['processes_images_in_parallel_n_processes'],
+            max_records_in_flight=args['max_records_in_flight'],
+            resume=args['resume'],
+            checkpoint_every=args['checkpoint_every'],
+            compression_type=args['compression_type'],
+            image_read_threads=args['image_read_threads'],
+            image_read_ahead=args['image_read_ahead']
             )
     logger.info("Finished writing TFRecords")
 
+    # Write per-stage timings (reading, decoding, writing images...)
+    tfr_writer.log_timing_report()
+    tfr_writer.write_timing_report(
+        json_path=os.path.join(args['output_dir'], 'timing_report.json'),
+        csv_path=os.path.join(args['output_dir'], 'timing_report.csv'))
+
 
 if __name__ == '__main__':
     main()
@@ -4,6 +4,7 @@ The following sources can be used:
 - dir: a directory that contains subdirectories with class specific images
 - csv: a csv file that contains links and labels to images
 - json: a native dataset inventory file
+- binary: a native binary dataset inventory file
 - panthera: a specific importer for Panthera style csvs
 
 Example Usage:
@@ -39,9 +40,19 @@ def json(args):
     return dinv
 
 
+def binary(args):
+    """ Import From Binary """
+    params = {'path': args['path']}
+    dinv = DatasetInventoryMaster()
+    dinv.create_from_source('binary', params)
+    return dinv
+
+
 def class_dir(args):
     """ Import From Class Dirs"""
-    params = {'path': args['path']}
+    params = {'path': args['path'],
+              'n_threads': args['n_threads'],
+              'cache_path': args['dir_cache_path']}
     dinv = DatasetInventoryMaster()
     dinv.create_from_source('image_dir', params)
     return dinv
@@ -65,6 +76,11 @@ def main():
         "-discard_missing", default=False,
         action='store_true', required=False,
         help="whether to discard records with any missing label entries")
+    parser.add_argument(
+        "-export_format", type=str, default='json',
+        choices=['json', 'binary'], required=False,
+        help="json or a compact binary inventory file that is read lazily \
+             (much faster for large inventories)")
 
     subparsers = parser.add_subparsers(help='sub-command help')
 
@@ -103,6 +119,17 @@ def main():
                                    (e.g. /my_data/dataset_inventory.json)")
     parser_json.set_defaults(func=json)
 
+    # create parser for binary input
+    parser_binary = subparsers.add_parser(
+        'binary', help='if input is a binary inventory file')
+    parser_binary.add_argument("-path", type=str, required=True)
+    parser_binary.add_argument(
+        "-export_path", type=str, required=True,
+        help="the full path to a file which will contain\
+             the dataset inventory \
+             (e.g. /my_data/dataset_inventory.json)")
+    parser_binary.set_defaults(func=binary)
+
     # create parser for json input
     parser_class_dirs = subparsers.add_parser(
         'dir',
@@ -113,6 +140,14 @@ def main():
         help="the full path to a json file which will contain\
              the dataset inventory \
              (e.g. /my_data/dataset_inventory.json)")
+    parser_class_dirs.add_argument(
+        "-n_threads", type=int, default=16,
+        help="number of directories to list in parallel (default 16)")
+    parser_class_dirs.add_argument(
+        "-dir_cache_path", type=str, default=None,
+        help="json file to cache the directory listings in, re-creating \
+             the inventory then lists only directories that changed \
+             (e.g. /my_data/image_dir_listing.json)")
     parser_class_dirs.set_defaults(func=class_dir)
 
     # create parser for panthera input
@@ -146,7 +181,10 @@ def main():
 
     dinv.log_stats()
 
-    dinv.export_to_json(json_path=args['export_path'])
+    if args['export_format'] == 'binary':
+        dinv.export_to_binary(binary_path=args['export_path'])
+    else:
+        dinv.export_to_json(json_path=args['export_path'])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+""" Binary Dataset Inventory Files
+
+A compact alternative to json inventory files that is read lazily: the
+file is memory-mapped and records are only decoded when they are accessed,
+filtering by labels only reads the label columns.
+
+The file stores the columns of a ColumnarInventory:
+
+- 8 bytes magic number
+- 8 bytes length of the header (little-endian unsigned int)
+- json header with the vocabularies of the label and meta data columns
+  and the dtype, offset and length of each array
+- the arrays, each aligned to 64 bytes (offsets are relative to the start
+  of the first array)
+
+Example:
+--------
+write_binary_inventory(data_inventory, '/my_data/inventory.bin')
+data_inventory = read_binary_inventory('/my_data/inventory.bin')
+"""
+import os
+import json
+import struct
+import logging
+
+import numpy as np
+
+from camera_trap_classifier.data.columnar_inventory import ColumnarInventory
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'CTCINV\x00\x01'
+VERSION = 1
+_ALIGNMENT = 64
+
+
+def _aligned(n_bytes):
+    """ Round up to the next multiple of the alignment """
+    return -(-n_bytes // _ALIGNMENT) * _ALIGNMENT
+
+
+def is_binary_inventory(path):
+    """ Check whether a file is a binary inventory file """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_binary_inventory(data_inventory, path):
+    """ Write an inventory to a binary file
+        Args:
+            data_inventory: dict or ColumnarInventory of records
+            path: path of the file
+    """
+    if not isinstance(data_inventory, ColumnarInventory):
+        data_inventory = ColumnarInventory(data_inventory)
+
+    arrays, vocabularies = data_inventory.to_arrays()
+
+    array_info = dict()
+    offset = 0
+    for name, values in arrays.items():
+        array_info[name] = {'dtype': values.dtype.str,
+                            'offset': offset,
+                            'length': len(values)}
+        offset = _aligned(offset + values.nbytes)
+
+    header = json.dumps({'version': VERSION,
+                         'n_records': len(data_inventory),
+                         'vocabularies': vocabularies,
+                         'arrays': array_info}).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    path_temp = path + '_temp'
+    with open(path_temp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, values in arrays.items():
+            f.seek(data_start + array_info[name]['offset'])
+            f.write(values.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(path_temp, path)
+
+    logger.info("Wrote %s records to binary inventory %s" %
+                (len(data_inventory), path))
+
+
+def read_binary_inventory(path):
+    """ Read a binary inventory file
+        Returns: ColumnarInventory backed by the memory-mapped file
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError("%s is not a binary inventory file" % path)
+        header_length = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    if header['version'] != VERSION:
+        raise ValueError("Binary inventory %s has version %s, expected %s" %
+                         (path, header['version'], VERSION))
+
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+
+    arrays = dict()
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        start = data_start + info['offset']
+        end = start + info['length'] * dtype.itemsize
+        arrays[name] = data[start:end].view(dtype)
+
+    data_inventory = ColumnarInventory.from_arrays(
+        arrays, header['vocabularies'])
+
+    logger.info("Read %s records from binary inventory %s" %
+                (len(data_inventory), path))
+
+    return data_inventory
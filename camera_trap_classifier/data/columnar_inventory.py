@@ -0,0 +1,378 @@
+""" Compact Columnar Store of Dataset Inventory Records
+
+A drop-in replacement for the dict that backs a DatasetInventory
+({record_id: {'labels': [...], 'images': [...], 'meta_data': {...}}}).
+Records are stored in columns instead of one dict per record:
+
+- label values and meta data values are integer-coded per label name /
+  meta data field, each distinct value is stored once
+- the observations (entries of 'labels') of all records are stored in one
+  integer column per label name, records refer to their observations by
+  offset and count
+- all image paths are stored in one utf-8 buffer with offsets
+
+Records are created on access, hence modifying a returned record does not
+change the store, records have to be re-assigned or modified with the
+methods of the store. Removed records only release their id, their data
+is freed when the store is copied (see 'compact').
+
+Example:
+--------
+inventory = ColumnarInventory.from_dict(data_dict)
+inventory['record_1']
+>> {'labels': [{'species': 'zebra'}], 'images': ['/images/1.jpg']}
+"""
+from array import array
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+# code of label names / meta data fields an entry does not have
+ABSENT = -1
+
+
+class _Vocabulary(object):
+    """ Maps values to integer codes and back """
+
+    __slots__ = ['values', 'codes']
+
+    def __init__(self):
+        self.values = list()
+        self.codes = dict()
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+class _Column(object):
+    """ Integer-coded column with a vocabulary """
+
+    __slots__ = ['codes', 'vocabulary']
+
+    def __init__(self, n_rows):
+        self.codes = array('i', [ABSENT]) * n_rows
+        self.vocabulary = _Vocabulary()
+
+
+def _to_array(typecode, values):
+    """ Copy a numpy array into an array of 'typecode' """
+    copied = array(typecode)
+    copied.frombytes(np.ascontiguousarray(values).tobytes())
+    return copied
+
+
+class ColumnarInventory(MutableMapping):
+    """ Columnar mapping of record ids to records """
+
+    def __init__(self, records=None):
+        # record id -> row, rows of removed records are not referenced
+        self._rows = dict()
+        # per row
+        self._ids = list()
+        self._obs_start = array('q')
+        self._obs_count = array('i')
+        self._image_start = array('q')
+        self._image_count = array('i')
+        self._has_meta = array('b')
+        self._meta_columns = dict()
+        # per observation
+        self._label_columns = dict()
+        self._n_obs = 0
+        # per image
+        self._image_offsets = array('q', [0])
+        self._image_buffer = bytearray()
+        # entries of records other than labels, images and meta_data
+        self._extra = dict()
+        if records is not None:
+            self.update(records)
+
+    @classmethod
+    def from_dict(cls, records, consume=False):
+        """ Create a store from a dict of records
+            consume: remove the records from 'records' while adding them,
+                which limits the peak memory usage
+        """
+        store = cls()
+        if not consume:
+            store.update(records)
+            return store
+        # in insertion order like update
+        for record_id in list(records.keys()):
+            store[record_id] = records[record_id]
+            del records[record_id]
+        return store
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __contains__(self, record_id):
+        return record_id in self._rows
+
+    def __delitem__(self, record_id):
+        row = self._rows.pop(record_id)
+        self._extra.pop(row, None)
+
+    def __getitem__(self, record_id):
+        return self._get_row(self._rows[record_id])
+
+    def _get_row(self, row):
+        """ Create the record of a row """
+        obs_start = self._obs_start[row]
+        labels = list()
+        for obs in range(obs_start, obs_start + self._obs_count[row]):
+            label = dict()
+            for label_name, column in self._label_columns.items():
+                code = column.codes[obs]
+                if code != ABSENT:
+                    label[label_name] = column.vocabulary.values[code]
+            labels.append(label)
+
+        image_start = self._image_start[row]
+        images = list()
+        for image in range(image_start, image_start + self._image_count[row]):
+            images.append(str(self._image_buffer[
+                self._image_offsets[image]:
+                self._image_offsets[image + 1]], 'utf-8'))
+
+        record = {'labels': labels, 'images': images}
+
+        if self._has_meta[row]:
+            meta_data = dict()
+            for field, column in self._meta_columns.items():
+                code = column.codes[row]
+                if code != ABSENT:
+                    meta_data[field] = column.vocabulary.values[code]
+            record['meta_data'] = meta_data
+
+        if row in self._extra:
+            record.update(self._extra[row])
+
+        return record
+
+    def __setitem__(self, record_id, record):
+        self._make_appendable()
+
+        # the previous row of an existing id is not referenced anymore
+        if record_id in self._rows:
+            del self[record_id]
+
+        row = len(self._ids)
+        self._ids.append(record_id)
+        self._rows[record_id] = row
+
+        # labels
+        labels = record['labels']
+        self._obs_start.append(self._n_obs)
+        self._obs_count.append(len(labels))
+        for label in labels:
+            for column in self._label_columns.values():
+                column.codes.append(ABSENT)
+            for label_name, label_value in label.items():
+                column = self._label_columns.get(label_name)
+                if column is None:
+                    column = _Column(self._n_obs + 1)
+                    self._label_columns[label_name] = column
+                column.codes[self._n_obs] = \
+                    column.vocabulary.encode(label_value)
+            self._n_obs += 1
+
+        # images
+        images = record['images']
+        self._image_start.append(len(self._image_offsets) - 1)
+        self._image_count.append(len(images))
+        for image in images:
+            self._image_buffer += image.encode('utf-8')
+            self._image_offsets.append(len(self._image_buffer))
+
+        # meta data
+        for column in self._meta_columns.values():
+            column.codes.append(ABSENT)
+        meta_data = record.get('meta_data')
+        self._has_meta.append(meta_data is not None)
+        if meta_data is not None:
+            for field, value in meta_data.items():
+                column = self._meta_columns.get(field)
+                if column is None:
+                    column = _Column(row + 1)
+                    self._meta_columns[field] = column
+                column.codes[row] = column.vocabulary.encode(value)
+
+        extra = {k: v for k, v in record.items()
+                 if k not in ('labels', 'images', 'meta_data')}
+        if len(extra) > 0:
+            self._extra[row] = extra
+
+    def _make_appendable(self):
+        """ Copy columns that were created from (read-only) numpy arrays
+            into arrays that rows can be appended to
+        """
+        if isinstance(self._obs_start, array):
+            return
+        self._obs_start = _to_array('q', self._obs_start)
+        self._obs_count = _to_array('i', self._obs_count)
+        self._image_start = _to_array('q', self._image_start)
+        self._image_count = _to_array('i', self._image_count)
+        self._has_meta = _to_array('b', self._has_meta)
+        self._image_offsets = _to_array('q', self._image_offsets)
+        self._image_buffer = bytearray(self._image_buffer)
+        for column in list(self._label_columns.values()) + \
+                list(self._meta_columns.values()):
+            column.codes = _to_array('i', column.codes)
+
+    def to_arrays(self):
+        """ Export the store as numpy arrays, e.g. to write it to a file
+            Returns:
+                arrays: dict {name: numpy array}
+                vocabularies: dict with the values of the 'label' and 'meta'
+                    columns and the 'extra' entries of records (by row)
+        """
+        store = self
+        if len(self._rows) < len(self._ids):
+            store = self.compact()
+        for record_id in store._ids:
+            assert '\0' not in record_id, \
+                "record id %s contains a null character" % record_id
+        arrays = {
+            'ids': np.frombuffer(
+                '\0'.join(store._ids).encode('utf-8'), dtype=np.uint8),
+            'obs_start': np.frombuffer(store._obs_start, dtype=np.int64),
+            'obs_count': np.frombuffer(store._obs_count, dtype=np.int32),
+            'image_start': np.frombuffer(store._image_start, dtype=np.int64),
+            'image_count': np.frombuffer(store._image_count, dtype=np.int32),
+            'has_meta': np.frombuffer(store._has_meta, dtype=np.int8),
+            'image_offsets': np.frombuffer(
+                store._image_offsets, dtype=np.int64),
+            'image_buffer': np.frombuffer(
+                bytes(store._image_buffer), dtype=np.uint8)}
+        vocabularies = {'label': dict(), 'meta': dict(),
+                        'extra': store._extra}
+        for kind, columns in (('label', store._label_columns),
+                              ('meta', store._meta_columns)):
+            for name, column in columns.items():
+                arrays[kind + '/' + name] = np.frombuffer(
+                    column.codes, dtype=np.int32)
+                vocabularies[kind][name] = column.vocabulary.values
+        return arrays, vocabularies
+
+    @classmethod
+    def from_arrays(cls, arrays, vocabularies):
+        """ Create a store from the output of 'to_arrays', the arrays are
+            used without copying them (e.g. memory-mapped arrays), they are
+            only copied when records are added
+        """
+        store = cls()
+        if len(arrays['obs_start']) > 0:
+            store._ids = str(arrays['ids'], 'utf-8').split('\0')
+        store._rows = dict(zip(store._ids, range(0, len(store._ids))))
+        store._obs_start = arrays['obs_start']
+        store._obs_count = arrays['obs_count']
+        store._image_start = arrays['image_start']
+        store._image_count = arrays['image_count']
+        store._has_meta = arrays['has_meta']
+        store._image_offsets = arrays['image_offsets']
+        store._image_buffer = arrays['image_buffer']
+        store._n_obs = int(np.sum(arrays['obs_count'], dtype=np.int64))
+        for kind, columns in (('label', store._label_columns),
+                              ('meta', store._meta_columns)):
+            for name, values in vocabularies[kind].items():
+                column = _Column(0)
+                column.codes = arrays[kind + '/' + name]
+                column.vocabulary.values = list(values)
+                column.vocabulary.codes = {
+                    value: code for code, value in enumerate(values)}
+                columns[name] = column
+        store._extra = {int(row): extra for row, extra in
+                        vocabularies['extra'].items()}
+        return store
+
+    def compact(self):
+        """ Return a copy without the data of removed records """
+        return ColumnarInventory(self)
+
+    def _alive_rows(self):
+        """ Boolean mask of all rows that are referenced by a record id """
+        alive = np.zeros(len(self._ids), dtype=bool)
+        alive[np.fromiter(self._rows.values(), dtype=np.int64,
+                          count=len(self._rows))] = True
+        return alive
+
+    def _alive_observations(self):
+        """ Boolean mask of all observations of referenced rows """
+        return np.repeat(self._alive_rows(),
+                         np.frombuffer(self._obs_count, dtype=np.int32))
+
+    def label_columns(self):
+        """ Integer codes of all observations of referenced records
+            Returns:
+                dict {label_name: (codes, values)}, codes is a numpy array
+                with one code per observation (ABSENT if the observation
+                has no such label), values maps codes to label values
+        """
+        alive_obs = self._alive_observations()
+        return {label_name: (np.frombuffer(column.codes, dtype=np.int32)
+                             [alive_obs].copy(),
+                             column.vocabulary.values)
+                for label_name, column in self._label_columns.items()}
+
+    def label_table(self):
+        """ Integer codes of all observations together with the records
+            they belong to
+            Returns:
+                record_ids: list of all record ids
+                obs_record: numpy array with the index (in record_ids) of the
+                    record of each observation
+                columns: like 'label_columns'
+        """
+        alive = self._alive_rows()
+        rows = np.flatnonzero(alive)
+        record_ids = [self._ids[row] for row in rows]
+        obs_count = np.frombuffer(self._obs_count, dtype=np.int32)[alive]
+        obs_record = np.repeat(np.arange(len(rows)), obs_count)
+        return record_ids, obs_record, self.label_columns()
+
+    def remap_labels(self, label_map_dict):
+        """ Remap label values in-place by remapping the vocabularies,
+            values that are mapped to the same value are merged
+            label_map_dict: {'species': {'Zebra': 'species'}}
+        """
+        for label_name, label_map in label_map_dict.items():
+            column = self._label_columns.get(label_name)
+            if column is None:
+                continue
+            vocabulary = _Vocabulary()
+            translate = np.array(
+                [vocabulary.encode(label_map.get(value, value))
+                 for value in column.vocabulary.values] + [ABSENT],
+                dtype=np.int32)
+            column.vocabulary = vocabulary
+            # ABSENT (-1) maps to the last element of translate
+            if isinstance(column.codes, array):
+                codes = np.frombuffer(column.codes, dtype=np.int32)
+                codes[:] = translate[codes]
+            else:
+                column.codes = translate[column.codes]
+
+    def label_counts(self, exclude_value=None):
+        """ Count the observations per label value
+            Returns: {'species': {'Zebra': 3, 'Elephant': 6}}
+        """
+        label_counts = dict()
+        for label_name, (codes, values) in self.label_columns().items():
+            codes = codes[codes != ABSENT]
+            if len(codes) == 0:
+                continue
+            counts = np.bincount(codes, minlength=len(values))
+            label_counts[label_name] = {
+                values[code]: int(count)
+                for code, count in enumerate(counts)
+                if count > 0 and values[code] != exclude_value}
+        return label_counts
@@ -0,0 +1,166 @@
+""" Parallel and Incremental Directory Scanning
+
+Lists all files in a directory tree with a pool of threads (listing
+directories is I/O bound and does not hold the GIL, which matters most on
+network file systems). Optionally, the listing of each directory is stored
+in a cache file together with the modification time of the directory. A
+directory's modification time changes whenever an entry is added, removed
+or renamed in it, hence on a rescan only directories that changed are
+listed again, the others only require a 'stat' call.
+
+Example:
+--------
+scanner = DirectoryScanner(n_threads=16,
+                           cache_path='/my_data/image_dir_listing.json')
+image_paths = scanner.list_files('/my_data/images/', ext=('.jpg', '.png'))
+"""
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+logger = logging.getLogger(__name__)
+
+
+# listings of directories modified less than that many seconds before they
+# were listed are not re-used, the listing could miss changes made within
+# the resolution of the modification time
+_MTIME_SAFETY_MARGIN = 2
+
+
+class DirectoryScanner(object):
+    """ List directory trees in parallel, re-using cached listings of
+        unchanged directories
+    """
+    def __init__(self, n_threads=16, cache_path=None, follow_symlinks=False):
+        """ Args:
+            n_threads: number of directories to list in parallel
+            cache_path: json file to store the directory listings in,
+                None to not cache listings
+            follow_symlinks: whether to list symlinks to directories as
+                sub-directories (like os.walk they are not followed by
+                default)
+        """
+        self.n_threads = n_threads
+        self.cache_path = cache_path
+        self.follow_symlinks = follow_symlinks
+        self.cache = dict()
+        if cache_path is not None:
+            self.cache = self._read_cache(cache_path)
+
+    @staticmethod
+    def _read_cache(cache_path):
+        """ Read the cached directory listings """
+        if not os.path.exists(cache_path):
+            return dict()
+        try:
+            with open(cache_path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning("Failed to read directory cache %s - error %s" %
+                           (cache_path, str(e)))
+            return dict()
+
+    def _write_cache(self):
+        """ Store the directory listings """
+        cache_temp = self.cache_path + '_temp'
+        with open(cache_temp, 'w') as f:
+            json.dump(self.cache, f)
+        os.replace(cache_temp, self.cache_path)
+
+    def _list_dir(self, dir_path):
+        """ List the files and sub-directories of a directory
+            Returns: listing dict, whether the listing was cached
+        """
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        cached = self.cache.get(dir_path)
+        if cached is not None and cached['mtime_ns'] == mtime_ns and \
+           cached['listed_at'] - (mtime_ns / 1e9) > _MTIME_SAFETY_MARGIN:
+            return cached, True
+
+        listed_at = time.time()
+        files = list()
+        dirs = list()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                    dirs.append(entry.name)
+                elif not entry.is_dir():
+                    files.append(entry.name)
+        files.sort()
+        dirs.sort()
+        listing = {'mtime_ns': mtime_ns, 'listed_at': listed_at,
+                   'files': files, 'dirs': dirs}
+        return listing, False
+
+    def scan(self, directory, max_depth=None):
+        """ List a directory tree
+            Args:
+                directory: root of the tree
+                max_depth: max depth of sub-directories to list (0 lists
+                    only 'directory'), None for no limit
+            Returns:
+                dict {dir_path: listing}, listing is a dict with sorted
+                lists of the 'files' and sub-'dirs' of a directory
+        """
+        directory = os.path.normpath(directory)
+        listings = dict()
+        n_cached = 0
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            pending = {
+                executor.submit(self._list_dir, directory): (directory, 0)}
+            while len(pending) > 0:
+                done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_path, depth = pending.pop(future)
+                    listing, is_cached = future.result()
+                    listings[dir_path] = listing
+                    n_cached += int(is_cached)
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    for sub_dir in listing['dirs']:
+                        sub_dir_path = os.path.join(dir_path, sub_dir)
+                        future = executor.submit(self._list_dir, sub_dir_path)
+                        pending[future] = (sub_dir_path, depth + 1)
+
+        logger.info("Scanned %s directories in %s - %s listed, %s unchanged" %
+                    (len(listings), directory, len(listings) - n_cached,
+                     n_cached))
+
+        if self.cache_path is not None:
+            # remove listings of directories in this tree that are gone
+            if max_depth is None:
+                prefix = os.path.join(directory, '')
+                self.cache = {
+                    k: v for k, v in self.cache.items()
+                    if not (k == directory or k.startswith(prefix))}
+            self.cache.update(listings)
+            self._write_cache()
+
+        return listings
+
+    def list_files(self, directory, ext=None, max_depth=None):
+        """ List all files in a directory tree
+            Args:
+                ext: tuple of file extensions (e.g. ('.jpg', '.png')),
+                    case-insensitive, None for all files
+            Returns:
+                sorted list of file paths, joined to 'directory' as given
+                (like the paths of os.walk)
+        """
+        listings = self.scan(directory, max_depth=max_depth)
+        root = os.path.normpath(directory)
+        file_paths = list()
+        for dir_path, listing in listings.items():
+            rel_path = os.path.relpath(dir_path, root)
+            if rel_path == os.curdir:
+                dir_path = directory
+            else:
+                dir_path = os.path.join(directory, rel_path)
+            for file_name in listing['files']:
+                if ext is None or file_name.lower().endswith(ext):
+                    file_paths.append(os.path.join(dir_path, file_name))
+        file_paths.sort()
+        return file_paths
@@ -8,6 +8,8 @@ from tensorflow.python.ops import control_flow_ops
 # CONSTANTS
 CB_DISTORTION_RANGE = 0.05
 CR_DISTORTION_RANGE = 0.05
+# DCT scaling ratios supported by the jpeg decoder (besides 1)
+JPEG_SCALE_RATIOS = [2, 4, 8]
 
 
 def read_image_from_disk_and_convert_to_jpeg(
@@ -107,17 +109,17 @@ def _mean_image_subtraction(image, means):
     image = _mean_image_subtraction(image, means)
     Note that the rank of `image` must be known.
     Args:
-    image: a tensor of size [height, width, C].
+    image: a tensor of size [height, width, C] or [batch, height, width, C].
     means: a C-vector of values to subtract from each channel.
     Returns:
     the centered image.
     Raises:
     ValueError: If the rank of `image` is unknown, if `image` has a rank other
-      than three or if the number of channels in `image` doesn't match the
-      number of values in `means`.
+      than three or four or if the number of channels in `image` doesn't
+      match the number of values in `means`.
     """
-    if image.get_shape().ndims != 3:
-        raise ValueError('Input must be of size [height, width, C>0]')
+    if image.get_shape().ndims not in (3, 4):
+        raise ValueError('Input must be of size [(batch), height, width, C>0]')
     num_channels = image.get_shape().as_list()[-1]
     if len(means) != num_channels:
         raise ValueError('len(means) must match the number of channels')
@@ -219,7 +221,8 @@ def preprocess_for_train(image,
                          zoom_factor,
                          crop_factor,
                          rotate_by_angle,
-                         randomly_flip_horizontally):
+                         randomly_flip_horizontally,
+                         batch_augmentation=False):
     """Preprocesses the given image for training.
     Note that the actual resizing scale is sampled from
     [`resize_size_min`, `resize_size_max`].
@@ -235,6 +238,9 @@ def preprocess_for_train(image,
                  0 is no cropping, 0.5 is up to 50% cropping along both image
                  dimensions
     rotate_by_angle: randomly rotate image by plus/minus [0, angle] (degree)
+    batch_augmentation: only crop / zoom / rotate and resize the image,
+                        flipping, color augmentation and standardization
+                        are applied to batches by preprocess_batch
     Returns:
     A preprocessed image.
     """
@@ -297,6 +303,9 @@ def preprocess_for_train(image,
     image.set_shape([output_height,  output_width, 3])
     image = tf.cast(image, tf.float32)
 
+    if batch_augmentation:
+        return image
+
     # randomly flip image
     if randomly_flip_horizontally:
         image = tf.image.random_flip_left_right(image)
@@ -337,13 +346,15 @@ def preprocess_for_train(image,
 
 def preprocess_for_eval(image, output_height,
                         output_width, image_means, image_stdevs,
-                        preserve_aspect_ratio):
+                        preserve_aspect_ratio, batch_augmentation=False):
     """Preprocesses the given image for evaluation.
     Args:
     image: A `Tensor` representing an image of arbitrary size.
     output_height: The height of the image after preprocessing.
     output_width: The width of the image after preprocessing.
     resize_side: The smallest side of the image for aspect-preserving resizing.
+    batch_augmentation: only resize the image, standardization is applied
+                        to batches by preprocess_batch
     Returns:
     A preprocessed image.
     """
@@ -363,6 +374,8 @@ def preprocess_for_eval(image, output_height,
     # standardize image
     image.set_shape([output_height, output_width, 3])
     image = tf.cast(image, tf.float32)
+    if batch_augmentation:
+        return image
     image = tf.divide(image, tf.cast(255.0, tf.float32))
     image = _image_standardize(image, image_means, image_stdevs)
 
@@ -373,22 +386,38 @@ def decode_image_bytes_1D(image_bytes_list,
                           output_height=None,
                           output_width=None,
                           image_choice_for_sets='random',
+                          decode_jpeg_scaled=False,
+                          is_training=False,
+                          zoom_factor=0,
+                          crop_factor=0,
+                          preserve_aspect_ratio=False,
                           **kwargs):
     """ Decode a 1D Tensor of 1-N raw image bytes
     Args:
     image_bytes_list: a 1-D tensor with raw bytes
     output_height: height in pixels of decoded images
-        (only used if image_choice_for_sets is not random)
+        (only used if image_choice_for_sets is not random or
+         decode_jpeg_scaled)
     output_width: height in pixels of decoded images
-        (only used if image_choice_for_sets is not random)
+        (only used if image_choice_for_sets is not random or
+         decode_jpeg_scaled)
+    decode_jpeg_scaled: decode jpegs at a reduced resolution that is still
+        larger than the output (see decode_jpeg_dct_scaled)
     """
 
     if image_choice_for_sets == 'random':
-        image = choose_random_image(image_bytes_list)
+        image = choose_random_image(
+            image_bytes_list, output_height, output_width,
+            decode_jpeg_scaled=decode_jpeg_scaled,
+            is_training=is_training,
+            zoom_factor=zoom_factor,
+            crop_factor=crop_factor,
+            preserve_aspect_ratio=preserve_aspect_ratio)
     elif image_choice_for_sets == 'grayscale_stacking':
         image = grayscale_stacking_and_blurring(
                     image_bytes_list,
-                    output_height, output_width)
+                    output_height, output_width,
+                    decode_jpeg_scaled=decode_jpeg_scaled)
     else:
         raise NotImplementedError("Image choice for set: %s not implemented" %
                                   image_choice_for_sets)
@@ -405,6 +434,7 @@ def preprocess_image(image, output_height, output_width,
                      color_augmentation=None,
                      preserve_aspect_ratio=False,
                      randomly_flip_horizontally=True,
+                     batch_augmentation=False,
                      **kwargs):
     """Preprocesses the given image.
     Args:
@@ -413,6 +443,9 @@ def preprocess_image(image, output_height, output_width,
     output_width: The width of the image after preprocessing.
     is_training: `True` if we're preprocessing the image for training and
       `False` otherwise.
+    batch_augmentation: `True` to only resize (and crop / zoom / rotate)
+      the image and to leave flipping, color augmentation and
+      standardization to preprocess_batch
     Returns:
     A preprocessed image.
     """
@@ -428,14 +461,58 @@ def preprocess_image(image, output_height, output_width,
                                     zoom_factor=zoom_factor,
                                     crop_factor=crop_factor,
                                     rotate_by_angle=rotate_by_angle,
-                                    randomly_flip_horizontally=randomly_flip_horizontally)
+                                    randomly_flip_horizontally=randomly_flip_horizontally,
+                                    batch_augmentation=batch_augmentation)
     else:
         return preprocess_for_eval(image=image,
                                    output_height=output_height,
                                    output_width=output_width,
                                    image_means=image_means,
                                    image_stdevs=image_stdevs,
-                                   preserve_aspect_ratio=preserve_aspect_ratio)
+                                   preserve_aspect_ratio=preserve_aspect_ratio,
+                                   batch_augmentation=batch_augmentation)
+
+
+def preprocess_batch(images, is_training,
+                     image_means=[0, 0, 0],
+                     image_stdevs=[1, 1, 1],
+                     color_augmentation=None,
+                     randomly_flip_horizontally=True,
+                     **kwargs):
+    """Flips, color-augments and standardizes a batch of images that were
+    pre-processed with preprocess_image(..., batch_augmentation=True).
+    The random flips, brightness, saturation, hue and contrast changes are
+    drawn per image but computed with one op per batch. The order of the
+    color distortions (see distort_color) is drawn once per batch.
+    Args:
+    images: A `Tensor` of shape [batch, height, width, 3] in [0, 255].
+    is_training: `True` to flip and color-augment the images, `False` to
+      only standardize them.
+    Returns:
+    A batch of preprocessed images.
+    """
+    images = tf.cast(images, tf.float32)
+
+    if is_training and randomly_flip_horizontally:
+        flip = tf.less(tf.random_uniform([tf.shape(images)[0]]), 0.5)
+        images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+
+    # Convert images to range 0 and 1
+    images = tf.divide(images, tf.cast(255.0, tf.float32))
+
+    if is_training and color_augmentation is not None:
+        if color_augmentation == 'full_fast':
+            images = distort_color_fast_batch(images)
+        else:
+            fast_mode = color_augmentation == 'little'
+            images = apply_with_random_selector(
+                images,
+                lambda x, ordering: distort_color_batch(
+                    x, ordering, fast_mode),
+                num_cases=4)
+
+    # standardize (means / stdevs broadcast over the batch)
+    return _image_standardize(images, image_means, image_stdevs)
 
 
 # https://github.com/tensorflow/tpu/blob/master/models/experimental/inception/
@@ -522,6 +599,103 @@ def distort_color_fast(image, scope=None):
     return image
 
 
+def _random_per_image(images, minval, maxval):
+    """ Random factors of shape [batch, 1, 1, 1] """
+    return tf.random_uniform(
+        [tf.shape(images)[0], 1, 1, 1], minval=minval, maxval=maxval)
+
+
+def _adjust_saturation_and_hue_batch(images, saturation_factors=None,
+                                     hue_deltas=None):
+    """ Scale the saturation and shift the hue of each image of a batch """
+    hsv = tf.image.rgb_to_hsv(images)
+    hue, saturation, value = tf.split(hsv, 3, axis=3)
+    if saturation_factors is not None:
+        saturation = tf.clip_by_value(saturation * saturation_factors,
+                                      0.0, 1.0)
+    if hue_deltas is not None:
+        hue = tf.floormod(hue + hue_deltas, 1.0)
+    return tf.image.hsv_to_rgb(tf.concat([hue, saturation, value], axis=3))
+
+
+def _adjust_contrast_batch(images, contrast_factors):
+    """ Scale the contrast of each image of a batch around its channel
+        means """
+    means = tf.reduce_mean(images, axis=[1, 2], keepdims=True)
+    return (images - means) * contrast_factors + means
+
+
+def distort_color_batch(images, color_ordering=0, fast_mode=True):
+    """Distort the colors of a batch of images like distort_color, with
+    random factors drawn per image.
+    Args:
+    images: 4-D Tensor [batch, height, width, 3] with values in [0, 1].
+    color_ordering: Python int, a type of distortion (valid values: 0-3).
+    fast_mode: Avoids slower ops (hue and contrast)
+    Returns:
+    4-D Tensor color-distorted images in [0, 1]
+    """
+    hue_delta = 0.05
+    upper_contrast = 1.3
+
+    def brightness(x):
+        return x + _random_per_image(x, -0.2, 0.2)
+
+    def saturation(x):
+        return _adjust_saturation_and_hue_batch(
+            x, saturation_factors=_random_per_image(x, 0.8, 1.2))
+
+    def hue(x):
+        return _adjust_saturation_and_hue_batch(
+            x, hue_deltas=_random_per_image(x, -hue_delta, hue_delta))
+
+    def contrast(x):
+        return _adjust_contrast_batch(
+            x, _random_per_image(x, 0.9, upper_contrast))
+
+    if fast_mode:
+        if color_ordering == 0:
+            ops = [brightness, saturation]
+        else:
+            ops = [saturation, brightness]
+    else:
+        orderings = [
+            [brightness, saturation, hue, contrast],
+            [saturation, brightness, contrast, hue],
+            [contrast, hue, brightness, saturation],
+            [hue, saturation, contrast, brightness]]
+        if color_ordering not in range(0, len(orderings)):
+            raise ValueError('color_ordering must be in [0, 3]')
+        ops = orderings[color_ordering]
+
+    for op in ops:
+        images = op(images)
+
+    return tf.clip_by_value(images, 0.0, 1.0)
+
+
+def distort_color_fast_batch(images):
+    """Distort brightness and chroma values of a batch of images like
+    distort_color_fast, with random factors drawn per image.
+    Args:
+    images: 4-D Tensor [batch, height, width, 3] with values in [0, 1].
+    Returns:
+    4-D Tensor color-distorted images in [0, 1]
+    """
+    br_delta = _random_per_image(images, -0.2, 0.2)
+    cb_factor = _random_per_image(
+        images, -CB_DISTORTION_RANGE, CB_DISTORTION_RANGE)
+    cr_factor = _random_per_image(
+        images, -CR_DISTORTION_RANGE, CR_DISTORTION_RANGE)
+
+    offsets = tf.concat([
+        1.402 * cr_factor + br_delta,
+        -0.344136 * cb_factor - 0.714136 * cr_factor + br_delta,
+        1.772 * cb_factor + br_delta], axis=3)
+
+    return tf.clip_by_value(images + offsets, 0., 1.)
+
+
 def apply_with_random_selector(x, func, num_cases):
   """Computes func(x, sel), with sel sampled from [0...num_cases-1].
   Args:
@@ -622,8 +796,111 @@ def _random_crop(image_list, crop_height, crop_width):
             ) for image in image_list]
 
 
-def choose_random_image(image_bytes_list):
-    """ Choose a random image """
+def _jpeg_scale_ratio(height, width, min_height, min_width):
+    """ Largest DCT scaling ratio (1, 2, 4 or 8) of a jpeg of size
+        height x width that decodes to at least min_height x min_width
+    """
+    ratio = tf.constant(1, dtype=tf.int32)
+    for candidate in JPEG_SCALE_RATIOS:
+        fits = tf.logical_and(
+            tf.greater_equal(height // candidate, min_height),
+            tf.greater_equal(width // candidate, min_width))
+        ratio = tf.where(fits, candidate, ratio)
+    return ratio
+
+
+def _aspect_ratio_crop_window(height, width, output_height, output_width):
+    """ Central crop window [y, x, h, w] of an image with the aspect ratio
+        of output_height x output_width (rounded up to not end up smaller
+        than the output after an aspect preserving resize)
+    """
+    height = tf.to_float(height)
+    width = tf.to_float(width)
+    crop_height = tf.minimum(
+        height, tf.ceil(width * output_height / output_width))
+    crop_width = tf.minimum(
+        width, tf.ceil(height * output_width / output_height))
+    offset_height = tf.floor((height - crop_height) / 2)
+    offset_width = tf.floor((width - crop_width) / 2)
+    return tf.to_int32(
+        tf.stack([offset_height, offset_width, crop_height, crop_width]))
+
+
+def decode_jpeg_dct_scaled(image_bytes, min_height, min_width, channels=0,
+                           crop_to_aspect_ratio=False):
+    """ Decode a jpeg at a reduced resolution (DCT scaling by 1/2, 1/4 or
+        1/8) such that the image (or the crop) is still at least
+        min_height x min_width, the cost of decoding scales with the
+        decoded size, other formats (e.g. png) are decoded at full size
+    Args:
+    image_bytes: a scalar string tensor of an image
+    min_height, min_width: minimal size of the decoded image
+    crop_to_aspect_ratio: `True` to decode only the central crop with the
+      aspect ratio of min_height x min_width
+    Returns:
+    A uint8 image tensor [height, width, channels]
+    """
+    def _decode_scaled():
+        shape = tf.image.extract_jpeg_shape(image_bytes)
+        height, width = shape[0], shape[1]
+
+        if crop_to_aspect_ratio:
+            crop_window = _aspect_ratio_crop_window(
+                height, width, min_height, min_width)
+            ratio = _jpeg_scale_ratio(
+                crop_window[2], crop_window[3], min_height, min_width)
+        else:
+            ratio = _jpeg_scale_ratio(height, width, min_height, min_width)
+
+        def _decode(decode_ratio):
+            if not crop_to_aspect_ratio:
+                return tf.image.decode_jpeg(
+                    image_bytes, channels=channels, ratio=decode_ratio)
+            if decode_ratio == 1:
+                return tf.image.decode_and_crop_jpeg(
+                    image_bytes, crop_window, channels=channels)
+            # crop the scaled image with the scaled crop window
+            image = tf.image.decode_jpeg(
+                image_bytes, channels=channels, ratio=decode_ratio)
+            window = crop_window // decode_ratio
+            return tf.image.crop_to_bounding_box(
+                image, window[0], window[1], window[2], window[3])
+
+        return tf.case(
+            [(tf.equal(ratio, r), lambda r=r: _decode(r))
+             for r in JPEG_SCALE_RATIOS],
+            default=lambda: _decode(1),
+            exclusive=True)
+
+    # extract_jpeg_shape fails for other formats, decode_jpeg decodes them
+    return tf.cond(
+        tf.image.is_jpeg(image_bytes),
+        _decode_scaled,
+        lambda: tf.image.decode_jpeg(image_bytes, channels=channels))
+
+
+def _min_decoded_size(output_height, output_width, is_training=False,
+                      zoom_factor=0, crop_factor=0):
+    """ Minimal size of a decoded image such that crops of the training
+        augmentation are not smaller than the output size """
+    scale = 1.0
+    if is_training:
+        scale = 1.0 / ((1.0 - zoom_factor) * (1.0 - crop_factor))
+    return (int(math.ceil(output_height * scale)),
+            int(math.ceil(output_width * scale)))
+
+
+def choose_random_image(image_bytes_list, output_height=None,
+                        output_width=None, decode_jpeg_scaled=False,
+                        is_training=False, zoom_factor=0, crop_factor=0,
+                        preserve_aspect_ratio=False):
+    """ Choose a random image
+    Args:
+    decode_jpeg_scaled: `True` to decode the image at the smallest DCT
+      scaling that is still larger than output_height x output_width (and
+      the crops of the training augmentation), for evaluation with
+      preserve_aspect_ratio only the central crop is decoded
+    """
     n_images = tf.shape(image_bytes_list)
 
     # select a random image of the record
@@ -631,14 +908,24 @@ def choose_random_image(image_bytes_list):
                              dtype=tf.int32)
 
     # decode image to tensor
-    image = tf.image.decode_jpeg(image_bytes_list[rand])
+    if not decode_jpeg_scaled or output_height is None or \
+       output_width is None:
+        return tf.image.decode_jpeg(image_bytes_list[rand])
+
+    min_height, min_width = _min_decoded_size(
+        output_height, output_width, is_training, zoom_factor, crop_factor)
+
+    image = decode_jpeg_dct_scaled(
+        image_bytes_list[rand], min_height, min_width,
+        crop_to_aspect_ratio=preserve_aspect_ratio and not is_training)
 
     return image
 
 
 def _decode_image_bytes_example(
         image_bytes,
-        output_height=None, output_width=None, n_colors=3):
+        output_height=None, output_width=None, n_colors=3,
+        decode_jpeg_scaled=False):
     """ Input is one TFRecord Exaample
         Example with three images:
             TensorShape([Dimension(1), Dimension(3)])
@@ -652,9 +939,16 @@ def _decode_image_bytes_example(
                     image_bytes, dtype=tf.uint8)
         images = tf.cast(images, tf.float32)
     else:
+        if decode_jpeg_scaled:
+            def decode(x):
+                return decode_jpeg_dct_scaled(
+                    x, output_height, output_width, channels=n_colors)
+        else:
+            def decode(x):
+                return tf.image.decode_jpeg(x, channels=n_colors)
         images = tf.map_fn(
                      lambda x: tf.image.resize_images(
-                                 tf.image.decode_jpeg(x, channels=n_colors),
+                                 decode(x),
                                  [output_height, output_width]),
                      image_bytes, dtype=tf.float32)
     return images
@@ -707,12 +1001,14 @@ def _blurr_imgs(img_batch):
 
 
 def grayscale_stacking_and_blurring(
-        image_bytes, output_height=None, output_width=None):
+        image_bytes, output_height=None, output_width=None,
+        decode_jpeg_scaled=False):
     """ Get and convert all images to grayscale """
 
     # Grayscale image batch tensor (4-D, NHWC)
     imgs = _decode_image_bytes_example(
-        image_bytes, output_height, output_width, n_colors=1)
+        image_bytes, output_height, output_width, n_colors=1,
+        decode_jpeg_scaled=decode_jpeg_scaled)
 
     # Apply Gaussian Blurring
     # Batch of 1-N blurred images
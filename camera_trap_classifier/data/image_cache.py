@@ -0,0 +1,163 @@
+""" On-Disk Cache of Processed Images
+
+Stores the output of an ImageCodec (resized and encoded images) keyed by
+the source image and the codec settings. This allows to re-create
+TFRecord files (e.g. with different splits or label filters) without
+re-processing images.
+
+The source image is identified either by its path, modification time and
+size or by a hash of its content ('hash_content'). The cache is bounded to
+'max_size_bytes' by removing the least recently used entries every
+'evict_every' new entries (per process) and at the end of each split, in
+between it exceeds the limit by at most 'evict_every' entries per process.
+"""
+import os
+import logging
+from hashlib import md5
+from collections import Counter
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache(object):
+    """ Content-addressed on-disk cache of processed images """
+
+    def __init__(self, cache_dir, max_size_bytes=None, hash_content=False,
+                 evict_every=1000):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.hash_content = hash_content
+        self.evict_every = evict_every
+        self.n_put_since_evict = 0
+        self.stats = Counter()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def pop_stats(self):
+        """ Return and reset hit / miss counts """
+        stats = self.stats
+        self.stats = Counter()
+        return stats
+
+    def source_key(self, path_to_image, image_codec, file_bytes=None):
+        """ Identify the source image by its path, modification time and
+            size (from the file system of 'image_codec', e.g. gs:// paths
+            with tf.gfile) or by its content if 'hash_content'
+        """
+        if self.hash_content:
+            return md5(file_bytes).hexdigest()
+        mtime_ns, size = image_codec.stat_file(path_to_image)
+        # remote paths are absolute
+        if '://' not in path_to_image:
+            path_to_image = os.path.abspath(path_to_image)
+        return '%s:%s:%s' % (path_to_image, mtime_ns, size)
+
+    def contains(self, path_to_image, image_codec):
+        """ Check whether the processed image is cached without reading
+            the source image (always False with 'hash_content')
+        """
+        if self.hash_content:
+            return False
+        entry_path = self._entry_path(
+            self.source_key(path_to_image, image_codec),
+            image_codec.cache_key())
+        return os.path.exists(entry_path)
+
+    def _entry_path(self, source_key, codec_key):
+        """ Path of a cache entry """
+        key = md5(('%s|%s' % (source_key, codec_key)).encode('utf-8'))
+        key = key.hexdigest()
+        return os.path.join(self.cache_dir, key[0:2], key + '.jpeg')
+
+    def get(self, source_key, codec_key):
+        """ Return the cached image or None """
+        entry_path = self._entry_path(source_key, codec_key)
+        try:
+            with open(entry_path, 'rb') as f:
+                image = f.read()
+        except FileNotFoundError:
+            self.stats['cache_miss'] += 1
+            return None
+        # mark entry as recently used
+        os.utime(entry_path)
+        self.stats['cache_hit'] += 1
+        return image
+
+    def put(self, source_key, codec_key, image):
+        """ Store an image in the cache """
+        entry_path = self._entry_path(source_key, codec_key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # write to a temporary file to never expose incomplete entries
+        entry_temp = '%s_%s_temp' % (entry_path, os.getpid())
+        with open(entry_temp, 'wb') as f:
+            f.write(image)
+        os.replace(entry_temp, entry_path)
+        self.n_put_since_evict += 1
+        if self.n_put_since_evict >= self.evict_every:
+            self.evict()
+
+    def get_or_create(self, path_to_image, image_codec, file_bytes=None):
+        """ Return the image processed by 'image_codec' from the cache
+            or process and cache it
+            file_bytes: raw bytes of the image if they were already read
+        """
+        codec_key = image_codec.cache_key()
+        if self.hash_content and file_bytes is None:
+            file_bytes = image_codec.read_file(path_to_image)
+        source_key = self.source_key(path_to_image, image_codec, file_bytes)
+        image = self.get(source_key, codec_key)
+        if image is not None:
+            return image
+        if file_bytes is None:
+            file_bytes = image_codec.read_file(path_to_image)
+        image = image_codec.encode(file_bytes)
+        self.put(source_key, codec_key, image)
+        return image
+
+    def size(self):
+        """ Total size of all cache entries in bytes """
+        return sum(size for _, _, size in self._list_entries())
+
+    def _list_entries(self):
+        """ List (path, last used, size) of all entries """
+        entries = list()
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            for file_entry in os.scandir(entry.path):
+                if not file_entry.name.endswith('.jpeg'):
+                    continue
+                # entries may be removed by other processes
+                try:
+                    stat = file_entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append(
+                    (file_entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def evict(self):
+        """ Remove least recently used entries until the cache is not
+            larger than 'max_size_bytes'
+        """
+        self.n_put_since_evict = 0
+        if self.max_size_bytes is None:
+            return
+        entries = self._list_entries()
+        total_size = sum(size for _, _, size in entries)
+        if total_size <= self.max_size_bytes:
+            return
+        entries.sort(key=lambda x: x[1])
+        n_removed = 0
+        for entry_path, _, size in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            n_removed += 1
+        logger.info("Removed %s entries from image cache %s - size now %s MB"
+                    % (n_removed, self.cache_dir,
+                       round(total_size / 1e6, 1)))
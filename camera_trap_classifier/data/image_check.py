@@ -0,0 +1,183 @@
+""" Check Images Before Writing TFRecord Files
+
+Finds missing and unreadable images of a dataset inventory with a pool of
+threads: each image is checked with a 'stat' call and by reading the first
+bytes of the file, which have to be the header of a supported image format
+(jpeg, png, gif or bmp). For jpegs the segments up to the frame header
+(Start-Of-Frame) are parsed, which finds files truncated within their
+header. This is much cheaper than decoding the images and finds most broken
+images (missing, empty, truncated or non-image files) before any worker
+process spends time on them.
+
+Example:
+--------
+checker = ImageChecker(n_threads=32, image_root_path='/my_data/images/')
+failed = checker.check_paths(['cats/cat1.jpg', 'dogs/dog1.jpg'])
+>> {'dogs/dog1.jpg': 'missing'}
+"""
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from camera_trap_classifier.data.image_codecs import read_jpeg_header
+
+
+logger = logging.getLogger(__name__)
+
+
+# file signatures of image formats that can be decoded
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'))
+
+_HEADER_LENGTH = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+# max number of bytes read to find the frame header of a jpeg (behind exif
+# and other application segments of up to 64 KB each)
+_JPEG_HEADER_LENGTH = 256 * 1024
+
+
+def full_image_path(image_path, image_root_path=None):
+    """ Path of an image of an inventory record """
+    if image_root_path is None:
+        return image_path
+    return os.path.join(image_root_path, image_path.lstrip(os.sep))
+
+
+def _image_format(header):
+    """ Image format of the first bytes of a file or None """
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def probe_image(image_path):
+    """ Check whether an image exists and has a known image header
+        Returns: None if the image is ok, else the reason
+    """
+    try:
+        size = os.stat(image_path).st_size
+    except FileNotFoundError:
+        return 'missing'
+    except OSError as e:
+        return 'stat failed: %s' % str(e)
+
+    if size == 0:
+        return 'empty'
+
+    try:
+        with open(image_path, 'rb') as f:
+            header = f.read(_HEADER_LENGTH)
+            image_format = _image_format(header)
+            if image_format == 'jpeg':
+                header += f.read(_JPEG_HEADER_LENGTH - len(header))
+    except OSError as e:
+        return 'read failed: %s' % str(e)
+
+    if image_format is None:
+        return 'unknown image format'
+
+    if image_format == 'jpeg' and read_jpeg_header(header) is None:
+        return 'invalid jpeg header'
+
+    return None
+
+
+class ImageChecker(object):
+    """ Check images with a pool of threads """
+
+    def __init__(self, n_threads=32, image_root_path=None, batch_size=10000):
+        """ Args:
+            n_threads: number of images to check in parallel
+            image_root_path: root path of the image paths (see
+                full_image_path)
+            batch_size: number of images submitted to the threads at once
+        """
+        self.n_threads = n_threads
+        self.image_root_path = image_root_path
+        self.batch_size = batch_size
+
+    def _probe(self, image_path):
+        return probe_image(full_image_path(image_path, self.image_root_path))
+
+    def check_paths(self, image_paths):
+        """ Check images
+            Args:
+                image_paths: list of image paths
+            Returns:
+                dict {image_path: reason} of all images that failed
+        """
+        failed = dict()
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for start in range(0, len(image_paths), self.batch_size):
+                batch = image_paths[start:start + self.batch_size]
+                for image_path, reason in zip(
+                        batch, executor.map(self._probe, batch)):
+                    if reason is not None:
+                        failed[image_path] = reason
+        return failed
+
+    def prune_inventory(self, data_inventory, report_path=None):
+        """ Remove failed images from the records of an inventory and
+            remove records without any remaining image
+            Args:
+                data_inventory: dict or ColumnarInventory of records,
+                    modified in place
+                report_path: json file to write a report with the failed
+                    images and removed records to, None for no report
+            Returns:
+                report dict
+        """
+        image_paths = list({image_path
+                            for record in data_inventory.values()
+                            for image_path in record['images']})
+
+        logger.info("Checking %s images with %s threads" %
+                    (len(image_paths), self.n_threads))
+
+        failed = self.check_paths(image_paths)
+
+        records_to_modify = dict()
+        removed_records = list()
+        if len(failed) > 0:
+            for record_id, record in data_inventory.items():
+                images = [x for x in record['images'] if x not in failed]
+                if len(images) == 0:
+                    removed_records.append(record_id)
+                elif len(images) < len(record['images']):
+                    records_to_modify[record_id] = {**record,
+                                                    'images': images}
+
+        for record_id, record in records_to_modify.items():
+            data_inventory[record_id] = record
+        for record_id in removed_records:
+            data_inventory.pop(record_id, None)
+
+        reasons = dict()
+        for reason in failed.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+
+        logger.info("Image check: %s / %s images failed %s - removed %s \
+records without images, removed images from %s records" %
+                    (len(failed), len(image_paths), reasons,
+                     len(removed_records), len(records_to_modify)))
+
+        report = {'n_images_checked': len(image_paths),
+                  'n_images_failed': len(failed),
+                  'failed_by_reason': reasons,
+                  'n_records_removed': len(removed_records),
+                  'n_records_modified': len(records_to_modify),
+                  'failed_images': failed,
+                  'removed_records': removed_records}
+
+        if report_path is not None:
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            logger.info("Image check report saved to %s" % report_path)
+
+        return report
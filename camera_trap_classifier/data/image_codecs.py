@@ -0,0 +1,279 @@
+""" Image Codecs to read, resize and encode images for TFRecord files
+
+A codec reads an image from disk, resizes it such that the smallest side
+has 'smallest_side' pixels (aspect preserving, optional) and encodes it as
+jpeg with 'image_save_quality'. Jpegs that need no resizing are passed
+through unchanged (see 'jpeg_passthrough').
+
+Example:
+--------
+codec = ImageCodec.create('pillow', {'smallest_side': 500,
+                                     'image_save_quality': 90})
+jpeg_bytes = codec.read_and_encode('/my_images/cat.jpg')
+"""
+import os
+import logging
+from io import BytesIO
+from collections import Counter, namedtuple
+
+import tensorflow as tf
+
+from camera_trap_classifier.data.image import _aspect_preserving_resize
+from camera_trap_classifier.data.stage_timer import StageTimer
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def enable_eager_execution():
+    """ Enable eager execution if it is not already enabled
+        (required to run TF image operations outside of a graph)
+    """
+    if not tf.executing_eagerly():
+        tf.enable_eager_execution()
+
+
+JpegHeader = namedtuple(
+    'JpegHeader', ['height', 'width', 'n_components', 'sof_marker'])
+
+# Start-Of-Frame markers (all except DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                     0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Baseline, extended and progressive huffman coded jpegs
+_JPEG_HUFFMAN_SOF_MARKERS = {0xC0, 0xC1, 0xC2}
+
+
+def read_jpeg_header(file_bytes):
+    """ Read the dimensions of a jpeg from its Start-Of-Frame segment
+        without decoding the image
+        Returns: JpegHeader or None if 'file_bytes' is not a valid jpeg
+    """
+    if file_bytes[:2] != b'\xff\xd8':
+        return None
+    n_bytes = len(file_bytes)
+    i = 2
+    while i + 4 <= n_bytes:
+        if file_bytes[i] != 0xFF:
+            return None
+        marker = file_bytes[i + 1]
+        # fill bytes
+        if marker == 0xFF:
+            i += 1
+            continue
+        # markers without a segment (TEM, RSTn)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        # end of image or start of scan before any frame header
+        if marker in (0xD9, 0xDA):
+            return None
+        segment_length = int.from_bytes(file_bytes[i + 2:i + 4], 'big')
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 10 > n_bytes:
+                return None
+            height = int.from_bytes(file_bytes[i + 5:i + 7], 'big')
+            width = int.from_bytes(file_bytes[i + 7:i + 9], 'big')
+            n_components = file_bytes[i + 9]
+            return JpegHeader(height, width, n_components, marker)
+        i += 2 + segment_length
+    return None
+
+
+def smallest_size_at_least(height, width, smallest_side):
+    """ Computes the aspect preserving size with the smallest side equal
+        to 'smallest_side' (analogous to image._smallest_size_at_least)
+        Returns: new_height, new_width
+    """
+    if height > width:
+        scale = smallest_side / width
+    else:
+        scale = smallest_side / height
+    new_height = int(round(height * scale))
+    new_width = int(round(width * scale))
+    return new_height, new_width
+
+
+class ImageCodec(object):
+    """ Read, resize and encode images """
+
+    subclasses = {}
+
+    @classmethod
+    def register_subclass(cls, codec_type):
+        def decorator(subclass):
+            cls.subclasses[codec_type] = subclass
+            return subclass
+
+        return decorator
+
+    @classmethod
+    def create(cls, codec_type, params):
+        if codec_type not in cls.subclasses:
+            raise ValueError('Bad codec type {}'.format(codec_type))
+
+        return cls.subclasses[codec_type](**params)
+
+    def __init__(self, smallest_side=None, image_save_quality=75,
+                 jpeg_passthrough=True):
+        """ Args:
+            smallest_side: resize images such that the smallest side has
+                that many pixels, None to not resize
+            image_save_quality: jpeg quality of re-encoded images
+            jpeg_passthrough: whether to return the original bytes of
+                (grayscale / rgb) jpegs whose smallest side is at most
+                'smallest_side' instead of re-encoding them
+        """
+        self.smallest_side = smallest_side
+        self.image_save_quality = image_save_quality
+        self.jpeg_passthrough = jpeg_passthrough
+        self.stats = Counter()
+        self.timings = StageTimer()
+
+    def pop_stats(self):
+        """ Return and reset the counts of processed images """
+        stats = self.stats
+        self.stats = Counter()
+        return stats
+
+    def pop_timings(self):
+        """ Return and reset the durations of reading, decoding, resizing
+            and encoding images (StageTimer)
+        """
+        return self.timings.pop()
+
+    def cache_key(self):
+        """ Identify the codec and its settings, e.g. for caching """
+        return '%s:%s:%s:%s' % (type(self).__name__, self.smallest_side,
+                                self.image_save_quality,
+                                self.jpeg_passthrough)
+
+    def read_file(self, path_to_image):
+        """ Read the raw bytes of a file """
+        with self.timings.time('read'):
+            return self._read_file(path_to_image)
+
+    def _read_file(self, path_to_image):
+        with open(path_to_image, 'rb') as f:
+            file_bytes = f.read()
+        return file_bytes
+
+    def stat_file(self, path_to_image):
+        """ Modification time (ns) and size of a file """
+        stat = os.stat(path_to_image)
+        return stat.st_mtime_ns, stat.st_size
+
+    def read_and_encode(self, path_to_image):
+        """ Read an image from disk and return the encoded jpeg bytes """
+        file_bytes = self.read_file(path_to_image)
+        return self.encode(file_bytes)
+
+    def encode(self, file_bytes):
+        """ Decode, resize and encode the raw bytes of an image """
+        if self.jpeg_passthrough and self._is_passthrough(file_bytes):
+            self.stats['jpeg_passthrough'] += 1
+            return file_bytes
+        self.stats['re_encoded'] += 1
+        return self._encode(file_bytes)
+
+    def _is_passthrough(self, file_bytes):
+        """ Check if the raw bytes can be stored without re-encoding """
+        header = read_jpeg_header(file_bytes)
+        if header is None:
+            return False
+        if header.sof_marker not in _JPEG_HUFFMAN_SOF_MARKERS:
+            return False
+        if header.n_components not in (1, 3):
+            return False
+        if self.smallest_side is None:
+            return True
+        return min(header.height, header.width) <= self.smallest_side
+
+    def _encode(self, file_bytes):
+        """ Decode, resize and encode the raw bytes of an image """
+        raise NotImplementedError(
+            "%s must implement _encode" % type(self).__name__)
+
+
+@ImageCodec.register_subclass('tensorflow')
+class TensorFlowImageCodec(ImageCodec):
+    """ Process images with (eager) TensorFlow operations """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        enable_eager_execution()
+
+    def _read_file(self, path_to_image):
+        """ Read the raw bytes of a file (supports all tf.gfile paths) """
+        with tf.gfile.GFile(path_to_image, 'rb') as f:
+            file_bytes = f.read()
+        return file_bytes
+
+    def stat_file(self, path_to_image):
+        """ Modification time (ns) and size of a file (supports all tf.gfile
+            paths) """
+        stat = tf.gfile.Stat(path_to_image)
+        return stat.mtime_nsec, stat.length
+
+    def _encode(self, file_bytes):
+        with self.timings.time('decode'):
+            image = tf.image.decode_image(file_bytes)
+        if self.smallest_side is not None:
+            with self.timings.time('resize'):
+                image = _aspect_preserving_resize(image, self.smallest_side)
+                image = tf.cast(image, dtype=tf.uint8)
+        with self.timings.time('encode'):
+            jpeg = tf.image.encode_jpeg(
+                image, quality=self.image_save_quality).numpy()
+        return jpeg
+
+
+@ImageCodec.register_subclass('pillow')
+class PillowImageCodec(ImageCodec):
+    """ Process images with Pillow (libjpeg / libjpeg-turbo)
+
+        Jpegs are decoded in draft mode: libjpeg decodes them directly at a
+        reduced scale (1/2, 1/4 or 1/8) that is still at least as large as
+        the target size, which is much faster than a full decode if
+        'smallest_side' is much smaller than the source image.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if Image is None:
+            raise ImportError(
+                "The pillow image codec requires Pillow, install it with: \
+                 pip install Pillow")
+
+    def _encode(self, file_bytes):
+        with self.timings.time('decode'):
+            image = Image.open(BytesIO(file_bytes))
+
+            if self.smallest_side is not None:
+                width, height = image.size
+                new_height, new_width = smallest_size_at_least(
+                    height, width, self.smallest_side)
+                if image.format == 'JPEG':
+                    image.draft('RGB', (new_width, new_height))
+
+            # images are decoded lazily
+            image.load()
+
+        with self.timings.time('resize'):
+            # jpegs support only grayscale and rgb images
+            if image.mode not in ('L', 'RGB'):
+                image = image.convert('RGB')
+
+            if self.smallest_side is not None:
+                image = image.resize((new_width, new_height), Image.BILINEAR)
+
+        with self.timings.time('encode'):
+            output = BytesIO()
+            image.save(output, format='JPEG',
+                       quality=self.image_save_quality)
+        return output.getvalue()
@@ -0,0 +1,80 @@
+""" Prefetch Raw Image Bytes with a Pool of I/O Threads
+
+Reading images from network file systems is dominated by latency. Reading
+them in the processes that decode and resize them stalls these processes
+while they wait for the file system. The ImagePrefetcher reads the raw
+bytes of the images of upcoming records with a pool of threads (reading
+files does not hold the GIL), such that the number of concurrent reads is
+independent of the number of processes decoding images.
+
+Example:
+--------
+prefetcher = ImagePrefetcher(read_file, n_threads=32, read_ahead=256)
+for tag, record_id, record_data in prefetcher.prefetch(tagged_records):
+    # record_data['image_bytes'] contains the raw bytes of each image
+    # in record_data['image_paths'] (or the exception raised reading it)
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from camera_trap_classifier.data.stage_timer import StageTimer
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePrefetcher(object):
+    """ Read the images of records ahead with a pool of threads """
+
+    def __init__(self, read_file, n_threads=16, read_ahead=256,
+                 timings=None):
+        """ Args:
+            read_file: function that returns the raw bytes of an image
+                path of a record (or None if it does not need to be read)
+            n_threads: number of images that are read at the same time
+            read_ahead: max number of records whose images are read or
+                held in memory ahead of the record that is consumed
+            timings: StageTimer to record the time spent waiting for
+                images that were not read yet ('read_wait')
+        """
+        self.read_file = read_file
+        self.n_threads = n_threads
+        self.read_ahead = max(read_ahead, 1)
+        self.timings = timings if timings is not None else StageTimer()
+
+    def _read_images(self, image_paths):
+        """ Read all images of a record, failed reads return the exception
+        """
+        image_bytes = list()
+        for image_path in image_paths:
+            try:
+                image_bytes.append(self.read_file(image_path))
+            except Exception as e:
+                image_bytes.append(e)
+        return image_bytes
+
+    def prefetch(self, tagged_records):
+        """ Read the images of a stream of records
+            Args:
+                tagged_records: iterable of (tag, record_id, record_data)
+            Yields:
+                (tag, record_id, record_data) in the same order, with the
+                raw bytes of the images in record_data['image_bytes']
+        """
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for tag, record_id, record_data in tagged_records:
+                future = executor.submit(
+                    self._read_images, record_data['image_paths'])
+                in_flight.append((tag, record_id, record_data, future))
+                if len(in_flight) >= self.read_ahead:
+                    yield self._complete(in_flight.popleft())
+            while len(in_flight) > 0:
+                yield self._complete(in_flight.popleft())
+
+    def _complete(self, in_flight_record):
+        tag, record_id, record_data, future = in_flight_record
+        with self.timings.time('read_wait'):
+            image_bytes = future.result()
+        return tag, record_id, {**record_data, 'image_bytes': image_bytes}
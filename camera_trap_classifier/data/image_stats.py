@@ -0,0 +1,174 @@
+""" Per-Channel Image Statistics of a Dataset
+
+Computes the means and standard deviations of each color channel of all
+(pre-processed) images of a dataset in bounded memory: the moments (number
+of pixels, mean, sum of squared deviations) of each batch are computed in
+the tf.data pipeline and merged with the parallel algorithm of Chan et al.
+(https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance), so
+only one batch of images is held in memory at once.
+
+The statistics are cached in a json file together with a key of the
+TFRecord files and the pre-processing settings, such that reruns on the
+same data skip the computation.
+
+Example:
+--------
+moments = compute_image_stats(dataset)
+moments.means, moments.stdevs
+>> [0.41, 0.42, 0.38], [0.25, 0.24, 0.25]
+"""
+import os
+import json
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+
+logger = logging.getLogger(__name__)
+
+
+class RunningMoments(object):
+    """ Mean and variance of each channel, merged over batches """
+
+    def __init__(self, n_channels=3):
+        self.count = 0
+        self.mean = np.zeros(n_channels, dtype=np.float64)
+        self.m2 = np.zeros(n_channels, dtype=np.float64)
+
+    def update(self, count, mean, m2):
+        """ Merge the moments of a batch
+            Args:
+                count: number of values (pixels) per channel
+                mean: mean of each channel
+                m2: sum of squared deviations from the mean of each channel
+        """
+        count = int(count)
+        if count == 0:
+            return
+        mean = np.asarray(mean, dtype=np.float64)
+        m2 = np.asarray(m2, dtype=np.float64)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def update_from_images(self, images):
+        """ Merge the moments of a numpy array of images [..., channels] """
+        values = np.asarray(images, dtype=np.float64).reshape(
+            -1, self.mean.shape[0])
+        mean = values.mean(axis=0)
+        self.update(values.shape[0], mean,
+                    ((values - mean) ** 2).sum(axis=0))
+
+    def merge(self, other):
+        """ Merge the moments of another RunningMoments """
+        self.update(other.count, other.mean, other.m2)
+
+    @property
+    def means(self):
+        return [float(x) for x in self.mean]
+
+    @property
+    def stdevs(self):
+        """ Population standard deviations (like np.std) """
+        if self.count == 0:
+            return [0.0] * self.mean.shape[0]
+        return [float(x) for x in np.sqrt(self.m2 / self.count)]
+
+
+def batch_moments(images):
+    """ Moments of each channel of a batch of images [batch, H, W, C]
+        Returns: (number of pixels, means, sums of squared deviations)
+    """
+    images = tf.cast(images, tf.float64)
+    n_channels = images.get_shape().as_list()[-1]
+    values = tf.reshape(images, [-1, n_channels])
+    count = tf.shape(values, out_type=tf.int64)[0]
+    mean = tf.reduce_mean(values, axis=0)
+    m2 = tf.reduce_sum(tf.square(values - mean), axis=0)
+    return count, mean, m2
+
+
+def compute_image_stats(dataset, num_parallel_calls=4, log_every_n=50):
+    """ Compute the channel means and stdevs of all images of a dataset
+        Args:
+            dataset: tf.data.Dataset of (features, labels) batches with the
+                images in features['images'], iterated once
+            num_parallel_calls: number of batches whose moments are
+                computed in parallel
+        Returns:
+            RunningMoments
+    """
+    dataset = dataset.map(
+        lambda features, labels: batch_moments(features['images']),
+        num_parallel_calls=num_parallel_calls)
+    dataset = dataset.prefetch(buffer_size=num_parallel_calls)
+    next_moments = dataset.make_one_shot_iterator().get_next()
+
+    moments = None
+    n_batches = 0
+    with tf.Session() as sess:
+        while True:
+            try:
+                count, mean, m2 = sess.run(next_moments)
+            except tf.errors.OutOfRangeError:
+                break
+            if moments is None:
+                moments = RunningMoments(n_channels=mean.shape[0])
+            moments.update(count, mean, m2)
+            n_batches += 1
+            if (n_batches % log_every_n) == 0:
+                logger.info("Image stats: processed %s batches - means %s \
+stdevs %s" % (n_batches, moments.means, moments.stdevs))
+
+    if moments is None:
+        raise ValueError("No images found to calculate image stats")
+
+    return moments
+
+
+def image_stats_cache_key(tfr_files, **settings):
+    """ Key of the image stats of TFRecord files (paths and sizes) and the
+        pre-processing settings that influence the stats """
+    return {'tfr_files': [[x, os.path.getsize(x)] for x in sorted(tfr_files)],
+            **{k: settings[k] for k in sorted(settings.keys())}}
+
+
+def read_cached_image_stats(path, key):
+    """ Read cached image stats, returns None if there are none for 'key'
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        logger.warning("Failed to read cached image stats from %s" % path)
+        return None
+    if cached.get('key') != json.loads(json.dumps(key)):
+        logger.info("Cached image stats in %s are for other files or \
+settings - recalculating" % path)
+        return None
+    return cached
+
+
+def write_cached_image_stats(path, key, moments):
+    """ Write image stats to a json file (atomically), failures (e.g. read
+        only TFRecord directories) are logged """
+    stats = {'key': key,
+             'image_means': moments.means,
+             'image_stdevs': moments.stdevs,
+             'n_pixels': moments.count}
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Failed to cache image stats in %s: %s" %
+                       (path, str(e)))
+        return None
+    logger.info("Cached image stats in %s" % path)
+    return stats
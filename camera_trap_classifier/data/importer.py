@@ -3,8 +3,12 @@ import os
 import json
 import csv
 import logging
+from operator import itemgetter
+from sys import intern
 
 from camera_trap_classifier.data.utils import clean_input_path
+from camera_trap_classifier.data.dir_scanner import DirectoryScanner
+from camera_trap_classifier.data.binary_inventory import read_binary_inventory
 
 
 logger = logging.getLogger(__name__)
@@ -138,46 +142,53 @@ class DatasetImporter(object):
         return True
 
     def _remove_invalid_entries(self, data_dict):
-        """ Check Each Record and Clean if possible """
+        """ Check Each Record and Remove Invalid Records (in-place, to not
+            hold two copies of large inventories in memory)
+        """
+        invalid_record_ids = [
+            record_id for record_id, record_values in data_dict.items()
+            if not self._is_record_ok(record_id, record_values)]
 
-        valid_data_dict = dict()
-        required_record_entrys = ('labels', 'images')
+        for record_id in invalid_record_ids:
+            del data_dict[record_id]
 
-        for record_id, record_values in data_dict.items():
-            # Remove if any record entry is not a dictionary
-            if not isinstance(record_values, dict):
-                logger.debug("Record %s has invalid data and is removed" %
-                             record_id)
-                continue
-            # check existence of required entrys
-            if not all([x in record_values for x in required_record_entrys]):
-                logger.debug("Record %s has not all required record entrys' \
-                             and is removed" % record_id)
-                continue
+        return data_dict
 
-            # check labels
-            if not self._is_labels_ok(record_values['labels']):
-                logger.debug("Record %s has invalid labels entry\
-                             and is removed" % record_id)
-                continue
+    def _is_record_ok(self, record_id, record_values):
+        """ Check a Record """
+        required_record_entrys = ('labels', 'images')
 
-            # check images
-            if not self._is_images_ok(record_values['images']):
-                logger.debug("Record %s has invalid images entry \
-                             and is removed" % record_id)
-                continue
+        # Remove if any record entry is not a dictionary
+        if not isinstance(record_values, dict):
+            logger.debug("Record %s has invalid data and is removed" %
+                         record_id)
+            return False
+        # check existence of required entrys
+        if not all([x in record_values for x in required_record_entrys]):
+            logger.debug("Record %s has not all required record entrys' \
+                         and is removed" % record_id)
+            return False
 
-            # check meta_data entry
-            if 'meta_data' in record_values:
-                if not self._is_ok_metadata(record_values['meta_data']):
-                    logger.debug("Record %s has invalid meta_data entry \
-                                 and is removed" % record_id)
-                    continue
+        # check labels
+        if not self._is_labels_ok(record_values['labels']):
+            logger.debug("Record %s has invalid labels entry\
+                         and is removed" % record_id)
+            return False
 
-            # add valid entries
-            valid_data_dict[record_id] = record_values
+        # check images
+        if not self._is_images_ok(record_values['images']):
+            logger.debug("Record %s has invalid images entry \
+                         and is removed" % record_id)
+            return False
+
+        # check meta_data entry
+        if 'meta_data' in record_values:
+            if not self._is_ok_metadata(record_values['meta_data']):
+                logger.debug("Record %s has invalid meta_data entry \
+                             and is removed" % record_id)
+                return False
 
-        return valid_data_dict
+        return True
 
 
 @DatasetImporter.register_subclass('csv')
@@ -234,18 +245,19 @@ class FromCSV(DatasetImporter):
         data_dict_clean = super()._remove_invalid_entries(data_dict)
         return data_dict_clean
 
-    def _convert_missing(self, label):
-        """ Conver missing values to default value """
-        if label == '':
-            return super().missing_value
-        else:
-            return label
-
     def _read_csv(self, path_to_csv):
-        """ Read CSV File """
+        """ Read CSV File
+
+            Rows are streamed from the csv reader and the fields are
+            extracted with precomputed column getters. Label and meta data
+            values are interned since they repeat across many rows, and
+            rows with an already seen capture id are consolidated in-place
+            by adding their labels to the existing record.
+        """
         assert os.path.exists(path_to_csv), \
             "Path: %s does not exist" % path_to_csv
         data_dict = dict()
+        missing_value = self.missing_value
         try:
             with open(path_to_csv, 'r') as f:
                 csv_reader = csv.reader(f, delimiter=',')
@@ -258,61 +270,59 @@ class FromCSV(DatasetImporter):
                 # map columns to position
                 col_mapper = {x: header.index(x) for x in
                               self.cols_in_csv}
-                for i, row in enumerate(csv_reader):
-                    # extract fields from csv
-                    attrs = {attr: row[ind] for attr, ind in
-                             col_mapper.items()}
-
-                    # build a new record
-                    new_record = {}
-
+                get_capture_id = itemgetter(col_mapper[self.capture_id_col])
+                get_labels = _tuple_getter(
+                    [col_mapper[x] for x in self.attributes_col_list])
+                get_images = _tuple_getter(
+                    [col_mapper[x] for x in self.image_path_col_list])
+                get_meta = _tuple_getter(
+                    [col_mapper[x] for x in self.meta_col_list])
+                label_names = self.attributes_col_list
+                meta_names = self.meta_col_list
+
+                for row in csv_reader:
                     # get labels
-                    labels = {k: self._convert_missing(str(v))
-                              for k, v in attrs.items() if k in
-                              set(self.attributes_col_list)}
+                    labels = {
+                        name: intern(value) if value != '' else missing_value
+                        for name, value in zip(label_names, get_labels(row))}
 
-                    new_record['labels'] = [labels]
+                    capture_id = get_capture_id(row)
+
+                    # consolidate records
+                    record = data_dict.get(capture_id)
+                    if record is not None:
+                        record['labels'].append(labels)
+                        continue
 
                     # get images
-                    images = [attrs[im] for im in self.image_path_col_list]
-                    images = [x for x in images if x is not '']
+                    images = [x for x in get_images(row) if x != '']
 
-                    new_record['images'] = images
+                    record = {'labels': [labels], 'images': images}
 
                     # get meta data
-                    if len(self.meta_col_list) > 0:
-                        meta = {k: str(v) for k, v in attrs.items() if k in
-                                set(self.meta_col_list)}
-
-                        new_record['meta_data'] = meta
-
-                    capture_id = attrs[self.capture_id_col]
-
-                    # consolidate records
-                    if capture_id in data_dict:
-                        consolidated_record = self._consolidate_records(
-                            first=data_dict[capture_id],
-                            second=new_record
-                        )
+                    if len(meta_names) > 0:
+                        record['meta_data'] = {
+                            name: intern(value) for name, value in
+                            zip(meta_names, get_meta(row))}
 
-                        data_dict[capture_id] = consolidated_record
-                    else:
-                        data_dict[capture_id] = new_record
+                    data_dict[capture_id] = record
 
         except Exception as e:
             logger.error('Failed to read csv:\n' + str(e))
 
         return data_dict
 
-    def _consolidate_records(self, first, second):
-        """ Consolidate records with identical capture event id """
-        images = first['images']
-        labels = first['labels'] + second['labels']
-        if 'meta_data' in first:
-            return {'images': images, 'labels': labels,
-                    'meta_data': first['meta_data']}
-        else:
-            return {'images': images, 'labels': labels}
+
+def _tuple_getter(indices):
+    """ Return a function that extracts the fields at 'indices' of a row
+        as a tuple (like itemgetter, but also for zero or one index)
+    """
+    if len(indices) == 1:
+        index = indices[0]
+        return lambda row: (row[index], )
+    if len(indices) == 0:
+        return lambda row: ()
+    return itemgetter(*indices)
 
 
 @DatasetImporter.register_subclass('json')
@@ -345,12 +355,40 @@ class FromJson(DatasetImporter):
         return data_dict
 
 
+@DatasetImporter.register_subclass('binary')
+class FromBinary(DatasetImporter):
+    """ Read Data From a Binary Inventory File
+
+        The file is memory-mapped and records are decoded on access.
+        Binary inventory files are written from imported (and thus checked)
+        inventories, hence the records are not checked again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def import_from_source(self):
+        """ Read Binary File """
+        assert os.path.exists(self.path), \
+            "Path: %s does not exist" % self.path
+        return read_binary_inventory(self.path)
+
+
 @DatasetImporter.register_subclass('image_dir')
 class FromImageDirs(DatasetImporter):
     """ Read Data From Json """
 
-    def __init__(self, path):
+    def __init__(self, path, n_threads=16, cache_path=None):
+        """ Args:
+            path: directory with one sub-directory of images per class
+            n_threads: number of directories to list in parallel
+            cache_path: json file to cache directory listings in, a
+                re-import lists only directories that changed
+        """
         self.path = path
+        self.scanner = DirectoryScanner(
+            n_threads=n_threads, cache_path=cache_path,
+            follow_symlinks=True)
 
     def import_from_source(self):
         """ Create inventory from path which contains class-specific
@@ -364,13 +402,9 @@ class FromImageDirs(DatasetImporter):
         data_dict_clean = super()._remove_invalid_entries(data_dict)
         return data_dict_clean
 
-    def _check_image_path(self, root_path):
+    def _check_image_path(self, root_path, listings):
         """ Check Root Path for Class Dirs """
-        # List all files in directory
-        file_list = os.listdir(root_path)
-
-        class_dir_list = \
-            [x for x in file_list if os.path.isdir(os.path.join(root_path, x))]
+        class_dir_list = listings[os.path.normpath(root_path)]['dirs']
 
         assert len(class_dir_list) > 0, \
             "Found no directories in %s" % root_path
@@ -384,12 +418,17 @@ class FromImageDirs(DatasetImporter):
     def _create_dict_from_image_folders(self, root_path):
         """ create dictionary from image paths """
 
-        class_dir_list = self._check_image_path(root_path)
+        # list the root path and all class directories in parallel
+        listings = self.scanner.scan(root_path, max_depth=1)
+
+        class_dir_list = self._check_image_path(root_path, listings)
 
         # Process each image and create data dictionary
         all_images_data = dict()
         for class_dir in class_dir_list:
-            for image_name in os.listdir(root_path + class_dir):
+            class_dir_path = os.path.join(os.path.normpath(root_path),
+                                          class_dir)
+            for image_name in listings[class_dir_path]['files']:
                 splitted_file_name = image_name.split(".")
                 if len(splitted_file_name) > 2:
                     logger.info("File %s has more than one . \
@@ -2,13 +2,18 @@
 import random
 import json
 import logging
-import copy
+from collections.abc import Mapping
 
 
 from camera_trap_classifier.data.utils import (
     randomly_split_dataset, map_label_list_to_numeric_dict,
     export_dict_to_json, _balanced_sampling)
 from camera_trap_classifier.data.importer import DatasetImporter
+from camera_trap_classifier.data.columnar_inventory import ColumnarInventory
+from camera_trap_classifier.data.label_filter import LabelFilter
+from camera_trap_classifier.data.binary_inventory import (
+    write_binary_inventory)
+from camera_trap_classifier.data.image_check import ImageChecker
 
 
 logger = logging.getLogger(__name__)
@@ -38,11 +43,21 @@ class DatasetInventory(object):
         """ Remove specific record """
         self.data_inventory.pop(id_to_remove, None)
 
+    def _new_data_inventory(self):
+        """ Create an empty inventory of the same type """
+        if isinstance(self.data_inventory, ColumnarInventory):
+            return ColumnarInventory()
+        return dict()
+
     def _get_all_labels(self):
         """ Extract all labels
             Returns: {'species': ('elephant', 'zebra'),
                       'count': ('1', '2')}
         """
+        if isinstance(self.data_inventory, ColumnarInventory):
+            label_counts = self.data_inventory.label_counts(
+                exclude_value=type(self).missing_label_value)
+            return {k: set(v.keys()) for k, v in label_counts.items()}
         all_labels = dict()
         for k, v in self.data_inventory.items():
             for label_entry in v['labels']:
@@ -59,6 +74,8 @@ class DatasetInventory(object):
             Returns: {'species': {'Zebra': 3, 'Elephant': 6},
                       'counts': {'1': 5, '2': 10}}
         """
+        if isinstance(self.data_inventory, ColumnarInventory):
+            return self.data_inventory.label_counts()
         # Calculate and log statistics about labels
         label_stats = dict()
         for _id, data in self.data_inventory.items():
@@ -72,9 +89,13 @@ class DatasetInventory(object):
                     label_stats[label_name][label_val] += 1
         return label_stats
 
-    def log_stats(self, debug_only=False):
-        """ Logs Statistics about Data Inventory """
-        label_stats = self._calc_label_stats()
+    def log_stats(self, debug_only=False, label_stats=None):
+        """ Logs Statistics about Data Inventory
+            label_stats: pre-computed label stats (e.g. from
+                apply_label_filter), None to calculate them
+        """
+        if label_stats is None:
+            label_stats = self._calc_label_stats()
         # Log Stats
         for label_type, labels in label_stats.items():
             label_list = list()
@@ -102,25 +123,43 @@ class DatasetInventory(object):
     def export_to_json(self, json_path):
         """ Export Inventory to Json File """
 
-        if self.data_inventory is not None:
+        if isinstance(self.data_inventory, dict):
             with open(json_path, 'w') as fp:
                 json.dump(self.data_inventory, fp)
 
+            logger.info("Data Inventory saved to %s" % json_path)
+        elif self.data_inventory is not None:
+            # write record by record to not create a dict of all records
+            with open(json_path, 'w') as fp:
+                fp.write('{')
+                for i, (record_id, record) in enumerate(
+                        self.data_inventory.items()):
+                    if i > 0:
+                        fp.write(', ')
+                    fp.write('%s: %s' % (json.dumps(record_id),
+                                         json.dumps(record)))
+                fp.write('}')
+
             logger.info("Data Inventory saved to %s" % json_path)
         else:
             logger.warning("Cant export data inventory to json - no\
                             inventory created yet")
 
+    def export_to_binary(self, binary_path):
+        """ Export Inventory to a Binary Inventory File """
+        if self.data_inventory is None:
+            logger.warning("Cant export data inventory to binary - no\
+                            inventory created yet")
+            return
+        write_binary_inventory(self.data_inventory, binary_path)
+
     def export_to_tfrecord(self, tfr_writer, tfr_path,
                            **kwargs):
         """ Export Dataset to TFRecod """
 
-        # create tfrecord dictionary
-        tfrecord_dict = dict()
-        for _id, record_values in self.data_inventory.items():
-            tfr_record = self._convert_record_to_tfr_format(
-                _id, record_values)
-            tfrecord_dict[_id] = tfr_record
+        # records are converted to the tfr format when the writer
+        # accesses them
+        tfrecord_dict = _TFRecordView(self)
 
         # Write to disk
         tfr_writer.encode_to_tfr(tfrecord_dict, tfr_path, **kwargs)
@@ -185,6 +224,24 @@ class DatasetInventory(object):
         export_dict_to_json(self.labels_numeric_map, path)
 
 
+class _TFRecordView(Mapping):
+    """ Read-only view of an inventory that converts each record to the tfr
+        format on access, which avoids creating a full copy of the inventory
+    """
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def __getitem__(self, record_id):
+        record = self.inventory.data_inventory[record_id]
+        return self.inventory._convert_record_to_tfr_format(record_id, record)
+
+    def __iter__(self):
+        return iter(self.inventory.data_inventory)
+
+    def __len__(self):
+        return len(self.inventory.data_inventory)
+
+
 class DatasetInventorySplit(DatasetInventory):
     """ Datset Dictionary Split - Does not allow further
         manipulations
@@ -199,10 +256,16 @@ class DatasetInventoryMaster(DatasetInventory):
     """ Creates Datset Dictionary from a source and allows to
         manipulate labels and create splits
     """
-    def __init__(self, labels_numeric_map=None):
+    def __init__(self, labels_numeric_map=None, columnar=False):
+        """ Args:
+            columnar: store the records in a compact ColumnarInventory
+                instead of a dict, this requires much less memory for
+                large inventories
+        """
         self.data_inventory = None
         self.labels = None
         self.labels_numeric_map = labels_numeric_map
+        self.columnar = columnar
 
     def _map_labels_to_numeric(self):
         """ Map all labels to numerics """
@@ -226,26 +289,43 @@ class DatasetInventoryMaster(DatasetInventory):
         """ Create Dataset Inventory from a specific Source """
         importer = DatasetImporter().create(type, params)
         self.data_inventory = importer.import_from_source()
+        if self.columnar and \
+           not isinstance(self.data_inventory, ColumnarInventory):
+            self.data_inventory = ColumnarInventory.from_dict(
+                self.data_inventory, consume=True)
         # self.label_handler = LabelHandler(self.data_inventory)
         # self.label_handler.remove_not_all_label_attributes()
 
+    def apply_label_filter(self, label_filter):
+        """ Remove records according to a LabelFilter
+            Returns: label stats of the remaining records
+        """
+        ids_to_remove, label_stats = label_filter.apply(self.data_inventory)
+        for id_to_remove in ids_to_remove:
+            self.remove_record(id_to_remove)
+        return label_stats
+
     def remove_multi_label_records(self):
         """ Remove records with multiple labels / observations """
-        to_remove = list()
-        for record_id, data in self.data_inventory.items():
-            if len(data['labels']) > 1:
-                to_remove.append(record_id)
-        logger.info("Removing %s records with multiple labels" %
-                    len(to_remove))
-        for record_id in to_remove:
-            self.remove_record(record_id)
+        self.apply_label_filter(LabelFilter().remove_multi_label())
+
+    def remove_unreadable_images(self, image_root_path=None, n_threads=32,
+                                 report_path=None):
+        """ Remove missing and unreadable images (see ImageChecker) and
+            records without any remaining image
+            Returns: report dict
+        """
+        checker = ImageChecker(n_threads=n_threads,
+                               image_root_path=image_root_path)
+        return checker.prune_inventory(self.data_inventory,
+                                       report_path=report_path)
 
     def randomly_remove_samples_to_percent(self, p_keep):
         """ Randomly sample a percentage of all records """
         if not p_keep <= 1:
             raise ValueError("p has to be between 0 and 1")
 
-        new_data_inv = dict()
+        new_data_inv = self._new_data_inventory()
         all_ids = list(self.data_inventory.keys())
         n_total = len(all_ids)
         n_choices = int(n_total * p_keep)
@@ -266,28 +346,10 @@ class DatasetInventoryMaster(DatasetInventory):
                     isinstance(label_value_list, list)]), \
             "label_name_list and label_value_list must be lists"
 
+        label_filter = LabelFilter()
         for label_name, label_value in zip(label_name_list, label_value_list):
-            self._remove_records_with_label(label_name, label_value)
-
-    def _remove_records_with_label(self, label_name, label_value):
-        """ Remove all records with 'label_value' for 'label_name'
-            Example: label_name: 'species' label_value: 'Zebra'
-        """
-        ids_to_remove = list()
-
-        for record_id, record_value in self.data_inventory.items():
-            labels_list = record_value['labels']
-            for label in labels_list:
-                for l_name, l_val_list in label.items():
-                    if (label_name == l_name):
-                        if label_value in l_val_list:
-                            ids_to_remove.append(record_id)
-
-        logger.info("Removing %s records from label %s with value %s" %
-                    (len(ids_to_remove), label_name, label_value))
-
-        for id_to_remove in ids_to_remove:
-            self.remove_record(id_to_remove)
+            label_filter.remove_label(label_name, label_value)
+        self.apply_label_filter(label_filter)
 
     def keep_only_records_with_label(self, label_name_list, label_value_list):
         """ Keep only records with (at least one) of the specified
@@ -297,45 +359,15 @@ class DatasetInventoryMaster(DatasetInventory):
                     isinstance(label_value_list, list)]), \
             "label_name_list and label_value_list must be lists"
 
-        to_keep = set()
+        label_filter = LabelFilter()
         for label_name, label_value in zip(label_name_list, label_value_list):
-            to_keep = to_keep.union(
-                self._keep_only_record_with_label(label_name, label_value))
-
-        logger.info("Keeping %s records" % len(to_keep))
-
-        to_remove = self.data_inventory.keys() - to_keep
-        for id_to_remove in to_remove:
-            self.remove_record(id_to_remove)
-
-    def _keep_only_record_with_label(self, label_name, label_value):
-        """ Keep only records with the label_value of the label_name
-        """
-        ids_to_keep = set()
-        for record_id, record_value in self.data_inventory.items():
-            labels_list = record_value['labels']
-            for label in labels_list:
-                for l_name, l_val in label.items():
-                    if (label_name == l_name):
-                        if label_value == l_val:
-                            ids_to_keep.add(record_id)
-        return ids_to_keep
+            label_filter.keep_label(label_name, label_value)
+        self.apply_label_filter(label_filter)
 
     def _remove_records_with_any_missing_label(self):
         """ Remove any records with the default missing value of -1 """
-        ids_to_remove = set()
-        for record_id, record_value in self.data_inventory.items():
-            labels_list = record_value['labels']
-            for label in labels_list:
-                for l_vals in label.values():
-                    if l_vals == type(self).missing_label_value:
-                        ids_to_remove.add(record_id)
-
-        logger.info("Removing %s records with missing labels" %
-                    len(ids_to_remove))
-
-        for id_to_remove in ids_to_remove:
-            self.remove_record(id_to_remove)
+        self.apply_label_filter(LabelFilter().remove_missing_label(
+            type(self).missing_label_value))
 
     def split_inventory_by_random_splits_with_balanced_sample(
             self,
@@ -454,7 +486,7 @@ class DatasetInventoryMaster(DatasetInventory):
         splitted_inventories = dict()
 
         for split, record_list in split_to_record.items():
-            split_dict = dict()
+            split_dict = self._new_data_inventory()
             for record_id in record_list:
                 split_dict[record_id] = self.data_inventory[record_id]
             logger.debug("Creating dataset split %s with %s records" %
@@ -467,25 +499,22 @@ class DatasetInventoryMaster(DatasetInventory):
         return splitted_inventories
 
     def remap_labels(self, label_map_dict):
-        """ Remap labels according to mapping dictionary
+        """ Remap labels (in-place) according to mapping dictionary
 
             label_map_dict (dict):
                 {'species': {'Zebra': 'species', 'Elephant': 'species',
                              'blank': 'blank'},
                  'counts': {'1': '1-5'}}
         """
-        new_inventory = copy.deepcopy(self.data_inventory)
+        if isinstance(self.data_inventory, ColumnarInventory):
+            self.data_inventory.remap_labels(label_map_dict)
+            return
+
         # Loop over records
-        for record_id, record_value in self.data_inventory.items():
+        for record_value in self.data_inventory.values():
             # loop over list of label entries [{species:}, {species:}]
-            for i, labels in enumerate(record_value['labels']):
-                # Loop over label names
-                for label_name, label_value_list in labels.items():
-                    if label_name in label_map_dict:
-                        # loop over label name entries
-                        for j, label_value in enumerate(label_value_list):
-                            if label_value in label_map_dict[label_name]:
-                                new_label = label_map_dict[label_name][label_value]
-                                new_inventory[record_id]['labels'][i][label_name][j][new_label]
-
-        self.data_inventory = new_inventory
+            for labels in record_value['labels']:
+                for label_name, label_map in label_map_dict.items():
+                    label_value = labels.get(label_name)
+                    if label_value in label_map:
+                        labels[label_name] = label_map[label_value]
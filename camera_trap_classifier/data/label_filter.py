@@ -0,0 +1,206 @@
+""" Batched Filtering of Dataset Inventory Records by Labels
+
+Collects predicates on the labels of records (e.g. remove all records with
+species 'zebra', keep only records with counts '1') and evaluates all of
+them in one pass over integer-coded label columns: each label name is one
+column with one integer code per observation (entry of 'labels'). The label
+statistics of the remaining records are computed from the same columns.
+
+Label values are matched exactly.
+
+Example:
+--------
+label_filter = LabelFilter()
+label_filter.remove_multi_label()
+label_filter.remove_label('species', 'blank')
+label_filter.keep_label('species', 'zebra')
+label_filter.keep_label('species', 'elephant')
+ids_to_remove, label_stats = label_filter.apply(data_inventory)
+"""
+import logging
+from array import array
+
+import numpy as np
+
+from camera_trap_classifier.data.columnar_inventory import (
+    ColumnarInventory, ABSENT)
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_label_table(data_inventory):
+    """ Integer-code the labels of all observations of an inventory
+        Args:
+            data_inventory: dict or ColumnarInventory of records
+        Returns:
+            record_ids: list of all record ids
+            obs_record: numpy array with the index (in record_ids) of the
+                record of each observation
+            columns: dict {label_name: (codes, values)}, codes is a numpy
+                array with one code per observation (ABSENT if the
+                observation has no such label), values maps codes to
+                label values
+    """
+    if isinstance(data_inventory, ColumnarInventory):
+        return data_inventory.label_table()
+
+    record_ids = list()
+    obs_record = array('q')
+    codes = dict()
+    vocabularies = dict()
+    n_obs = 0
+    for i, (record_id, record) in enumerate(data_inventory.items()):
+        record_ids.append(record_id)
+        for label in record['labels']:
+            obs_record.append(i)
+            for label_name, label_value in label.items():
+                if label_name not in codes:
+                    codes[label_name] = array('i', [ABSENT]) * n_obs
+                    vocabularies[label_name] = dict()
+                label_codes = codes[label_name]
+                # pad the column up to the current observation
+                if len(label_codes) < n_obs:
+                    label_codes.extend([ABSENT] * (n_obs - len(label_codes)))
+                vocabulary = vocabularies[label_name]
+                code = vocabulary.get(label_value)
+                if code is None:
+                    code = len(vocabulary)
+                    vocabulary[label_value] = code
+                label_codes.append(code)
+            n_obs += 1
+
+    columns = dict()
+    for label_name, label_codes in codes.items():
+        if len(label_codes) < n_obs:
+            label_codes.extend([ABSENT] * (n_obs - len(label_codes)))
+        columns[label_name] = (
+            np.frombuffer(label_codes, dtype=np.int32).copy(),
+            list(vocabularies[label_name].keys()))
+    obs_record = np.frombuffer(obs_record, dtype=np.int64).copy()
+    return record_ids, obs_record, columns
+
+
+def _label_stats(columns, obs_mask):
+    """ Count the label values of the observations in 'obs_mask'
+        Returns: {'species': {'Zebra': 3, 'Elephant': 6}}
+    """
+    label_stats = dict()
+    for label_name, (codes, values) in columns.items():
+        codes = codes[obs_mask]
+        codes = codes[codes != ABSENT]
+        if len(codes) == 0:
+            continue
+        counts = np.bincount(codes, minlength=len(values))
+        label_stats[label_name] = {
+            values[code]: int(count) for code, count in enumerate(counts)
+            if count > 0}
+    return label_stats
+
+
+class LabelFilter(object):
+    """ Collect label predicates and evaluate them in one pass """
+
+    def __init__(self):
+        self._remove_multi_label = False
+        self._remove_labels = list()
+        self._keep_labels = list()
+        self._missing_values = list()
+
+    def remove_multi_label(self):
+        """ Remove records with multiple labels / observations """
+        self._remove_multi_label = True
+        return self
+
+    def remove_label(self, label_name, label_value):
+        """ Remove records with an observation with 'label_value' for
+            'label_name'
+        """
+        self._remove_labels.append((label_name, label_value))
+        return self
+
+    def keep_label(self, label_name, label_value):
+        """ Keep only records with an observation with 'label_value' for
+            'label_name', a record is kept if it matches any of the
+            keep predicates
+        """
+        self._keep_labels.append((label_name, label_value))
+        return self
+
+    def remove_missing_label(self, missing_value):
+        """ Remove records with 'missing_value' for any label name """
+        self._missing_values.append(missing_value)
+        return self
+
+    @staticmethod
+    def _match_label(columns, obs_record, n_records,
+                     label_name, label_value=None, any_name=False):
+        """ Records with an observation with 'label_value' for
+            'label_name' (for any label name if 'any_name')
+            Returns: boolean numpy array with one entry per record
+        """
+        obs_match = np.zeros(len(obs_record), dtype=bool)
+        if any_name:
+            candidates = columns.keys()
+        else:
+            candidates = [label_name] if label_name in columns else []
+        for name in candidates:
+            codes, values = columns[name]
+            try:
+                code = values.index(label_value)
+            except ValueError:
+                continue
+            obs_match |= (codes == code)
+        record_match = np.zeros(n_records, dtype=bool)
+        record_match[obs_record[obs_match]] = True
+        return record_match
+
+    def apply(self, data_inventory):
+        """ Evaluate all predicates
+            Args:
+                data_inventory: dict or ColumnarInventory of records
+            Returns:
+                ids_to_remove: list of record ids to remove
+                label_stats: label stats of the remaining records
+                    {'species': {'Zebra': 3, 'Elephant': 6}}
+        """
+        record_ids, obs_record, columns = create_label_table(data_inventory)
+        n_records = len(record_ids)
+        remove = np.zeros(n_records, dtype=bool)
+
+        if self._remove_multi_label:
+            multi_label = np.bincount(obs_record, minlength=n_records) > 1
+            logger.info("Removing %s records with multiple labels" %
+                        int(multi_label.sum()))
+            remove |= multi_label
+
+        for label_name, label_value in self._remove_labels:
+            match = self._match_label(
+                columns, obs_record, n_records, label_name, label_value)
+            logger.info("Removing %s records from label %s with value %s" %
+                        (int(match.sum()), label_name, label_value))
+            remove |= match
+
+        for missing_value in self._missing_values:
+            match = self._match_label(
+                columns, obs_record, n_records, None, missing_value,
+                any_name=True)
+            logger.info("Removing %s records with missing labels" %
+                        int(match.sum()))
+            remove |= match
+
+        if len(self._keep_labels) > 0:
+            keep = np.zeros(n_records, dtype=bool)
+            for label_name, label_value in self._keep_labels:
+                keep |= self._match_label(
+                    columns, obs_record, n_records, label_name, label_value)
+            logger.info("Keeping %s records" % int(keep.sum()))
+            remove |= ~keep
+
+        ids_to_remove = [record_ids[i] for i in np.flatnonzero(remove)]
+        label_stats = _label_stats(columns, ~remove[obs_record])
+
+        logger.info("Label filter removes %s of %s records" %
+                    (len(ids_to_remove), n_records))
+
+        return ids_to_remove, label_stats
@@ -0,0 +1,150 @@
+""" Tune the Settings of the tf.data Input Pipeline
+
+The throughput of DatasetReader.get_iterator depends on the number of
+TFRecord files read in parallel ('cycle_length'), the number of records
+decoded and pre-processed in parallel ('num_parallel_calls') and the
+number of batches prepared ahead of the model ('prefetch_batches').
+
+Good values depend on the machine, the storage and the pre-processing.
+They can either be left to tf.data (AUTOTUNE) or be chosen with a short
+calibration run that measures the batches per second of a few candidate
+settings: one setting after the other is varied while the others are
+kept at the best values found so far.
+
+Example:
+--------
+def dataset_fn(settings):
+    return data_reader.get_iterator(..., **settings)
+
+settings, results = calibrate_input_pipeline(
+    dataset_fn, n_cpus=8, n_files=len(tfr_files))
+>> {'cycle_length': 8, 'num_parallel_calls': 16, 'prefetch_batches': 2}
+"""
+import time
+import logging
+import multiprocessing
+
+import tensorflow as tf
+
+
+logger = logging.getLogger(__name__)
+
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+TUNED_SETTINGS = ['num_parallel_calls', 'cycle_length', 'prefetch_batches']
+
+
+def fixed_settings(n_cpus, cycle_length=24):
+    """ Settings of the pipeline without tuning """
+    return {'num_parallel_calls': n_cpus,
+            'cycle_length': cycle_length,
+            'prefetch_batches': None}
+
+
+def autotune_settings(n_files):
+    """ Let tf.data tune the parallelism of the map and the prefetch
+        buffer, parallel_interleave does not support AUTOTUNE - all
+        files up to the number of cpus are read in parallel
+    """
+    return {'num_parallel_calls': AUTOTUNE,
+            'cycle_length': max(1, min(n_files, multiprocessing.cpu_count())),
+            'prefetch_batches': AUTOTUNE}
+
+
+def candidate_settings(n_cpus, n_files):
+    """ Candidate values of each setting that are calibrated """
+    def _unique(values):
+        return sorted({max(1, x) for x in values})
+    return {
+        'num_parallel_calls': _unique([n_cpus // 2, n_cpus, 2 * n_cpus]),
+        'cycle_length': _unique([min(n_files, x) for x in
+                                 [n_cpus // 2, n_cpus, 2 * n_cpus]]),
+        'prefetch_batches': [1, 2, 4]}
+
+
+def measure_batches_per_second(dataset_fn, settings, n_batches=20,
+                               n_warmup_batches=5):
+    """ Batches per second of the dataset created with 'settings'
+        Args:
+            dataset_fn: function that returns a tf.data.Dataset for a dict
+                of settings
+            n_batches: number of batches to time
+            n_warmup_batches: number of batches to read before timing (to
+                fill the shuffle and prefetch buffers)
+    """
+    with tf.Graph().as_default():
+        dataset = dataset_fn(settings)
+        iterator = dataset.make_initializable_iterator()
+        next_batch = iterator.get_next()
+        with tf.Session() as sess:
+            sess.run(tf.tables_initializer())
+            sess.run(iterator.initializer)
+            for _ in range(0, n_warmup_batches):
+                sess.run(next_batch)
+            start_time = time.time()
+            for _ in range(0, n_batches):
+                sess.run(next_batch)
+            elapsed = time.time() - start_time
+    return n_batches / max(elapsed, 1e-9)
+
+
+def calibrate(measure, candidates, initial_settings):
+    """ Choose the settings with the highest throughput by varying one
+        setting after the other
+        Args:
+            measure: function that returns the throughput of settings
+            candidates: dict {setting: list of values}
+            initial_settings: dict of settings to start from
+        Returns:
+            (best settings, list of (settings, throughput) of all runs)
+    """
+    best = dict(initial_settings)
+    results = list()
+    measured = dict()
+
+    def _measure(settings):
+        key = tuple(sorted(settings.items()))
+        if key not in measured:
+            measured[key] = measure(settings)
+            results.append((dict(settings), measured[key]))
+            logger.info("Input pipeline %s: %.2f batches/s" %
+                        (settings, measured[key]))
+        return measured[key]
+
+    best_throughput = _measure(best)
+    for setting in TUNED_SETTINGS:
+        for value in candidates.get(setting, []):
+            trial = {**best, setting: value}
+            throughput = _measure(trial)
+            if throughput > best_throughput:
+                best, best_throughput = trial, throughput
+    return best, results
+
+
+def calibrate_input_pipeline(dataset_fn, n_cpus, n_files, n_batches=20,
+                             n_warmup_batches=5):
+    """ Calibrate the settings of an input pipeline
+        Args:
+            dataset_fn: function that returns a tf.data.Dataset for a dict
+                of settings (see TUNED_SETTINGS)
+            n_cpus: number of cpus available for the pipeline
+            n_files: number of TFRecord files that are read
+        Returns:
+            (best settings, list of (settings, batches per second))
+    """
+    candidates = candidate_settings(n_cpus, n_files)
+    initial_settings = {
+        'num_parallel_calls': n_cpus,
+        'cycle_length': max(1, min(n_files, n_cpus)),
+        'prefetch_batches': 1}
+
+    def _measure(settings):
+        return measure_batches_per_second(
+            dataset_fn, settings, n_batches=n_batches,
+            n_warmup_batches=n_warmup_batches)
+
+    logger.info("Calibrating input pipeline with candidates %s" % candidates)
+    best, results = calibrate(_measure, candidates, initial_settings)
+    logger.info("Chose input pipeline settings %s" % best)
+    return best, results
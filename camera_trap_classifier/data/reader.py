@@ -1,9 +1,13 @@
 """ Class To Read TFRecord Files
     https://www.tensorflow.org/performance/datasets_performance
 """
-import tensorflow as tf
+import struct
 import logging
 
+import tensorflow as tf
+
+from camera_trap_classifier.data.tfr_index import read_tfr_index
+
 
 logger = logging.getLogger(__name__)
 
@@ -16,12 +20,42 @@ class DatasetReader(object):
                      output_labels,
                      label_to_numeric_mapping=None,
                      buffer_size=10192, num_parallel_calls=4,
-                     drop_batch_remainder=True, **kwargs):
-        """ Create Iterator from TFRecord """
+                     drop_batch_remainder=True, compression_type=None,
+                     cycle_length=24, prefetch_batches=None,
+                     batch_pre_processing_fun=None,
+                     batch_pre_processing_args=None,
+                     cache=None, sample_rate=None,
+                     **kwargs):
+        """ Create Iterator from TFRecord
+            compression_type: compression of the TFRecord files (None,
+                'ZLIB', 'GZIP')
+            num_parallel_calls: number of records decoded in parallel
+                (or tf.data.experimental.AUTOTUNE)
+            cycle_length: number of TFRecord files read in parallel
+            prefetch_batches: number of batches to prepare ahead (or
+                tf.data.experimental.AUTOTUNE), if None records are
+                prefetched before shuffling instead (see pipeline_tuning.py)
+            batch_pre_processing_fun: function applied to the batched
+                images with 'batch_pre_processing_args' (e.g.
+                preprocess_batch), records are then decoded and batched
+                with a fused map_and_batch
+            cache: cache the decoded records before batching - '' to cache
+                in memory or a path prefix to cache in files, the images
+                are cached as uint8 (pre-process them with
+                batch_augmentation=True and standardize them with
+                batch_pre_processing_fun), only for is_train=False
+            sample_rate: fraction of randomly chosen records to keep
+                (before decoding them), None to keep all
+        """
 
         assert type(output_labels) is list, "label_list must be of " + \
             " type list is of type %s" % type(output_labels)
 
+        if cache is not None and is_train:
+            err_msg = "Caching records is only possible if is_train=False"
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+
         logger.debug("Creating tf.Dataset")
 
         # Create Hash Map to map str labels to numerics if specified
@@ -37,11 +71,17 @@ class DatasetReader(object):
 
         dataset = dataset.apply(
             tf.data.experimental.parallel_interleave(
-                lambda filename: tf.data.TFRecordDataset(filename),
+                lambda filename: tf.data.TFRecordDataset(
+                    filename, compression_type=compression_type),
                 sloppy=is_train,
-                cycle_length=24))
+                cycle_length=cycle_length))
 
-        dataset = dataset.prefetch(buffer_size=batch_size)
+        if sample_rate is not None:
+            dataset = dataset.filter(
+                lambda x: tf.less(tf.random_uniform([]), sample_rate))
+
+        if prefetch_batches is None:
+            dataset = dataset.prefetch(buffer_size=batch_size)
 
         # shuffle records only for training
         if is_train:
@@ -50,25 +90,69 @@ class DatasetReader(object):
                     buffer_size=buffer_size,
                     count=n_repeats))
 
-        dataset = dataset.map(
-            lambda x: self.tfr_decoder(
-                serialized_example=x,
+        def _decode(serialized_example):
+            return self.tfr_decoder(
+                serialized_example=serialized_example,
                 output_labels=output_labels,
                 label_lookup_dict=class_to_index_mappings,
-                **kwargs), num_parallel_calls=num_parallel_calls)
+                **kwargs)
+
+        if batch_pre_processing_args is None:
+            batch_pre_processing_args = dict()
+
+        def _pre_process_batch(features, labels):
+            images = batch_pre_processing_fun(
+                features['images'], **batch_pre_processing_args)
+            return {**features, 'images': images}, labels
+
+        if batch_pre_processing_fun is None or cache is not None:
+            dataset = dataset.map(
+                _decode, num_parallel_calls=num_parallel_calls)
+
+            # silently ignore errors -- this occured extremely rarely due to
+            # issues with color augmentation operations for some images
+            dataset = dataset.apply(tf.data.experimental.ignore_errors())
+
+            # the first pass over the data fills the cache, subsequent
+            # passes (of the repeated dataset) read from it
+            if cache is not None:
+                dataset = dataset.map(
+                    self._images_to_uint8,
+                    num_parallel_calls=num_parallel_calls)
+                dataset = dataset.cache(cache)
+
+            dataset = dataset.batch(batch_size=batch_size,
+                                    drop_remainder=drop_batch_remainder)
+
+            if batch_pre_processing_fun is not None:
+                dataset = dataset.map(_pre_process_batch)
+        else:
+            dataset = dataset.apply(
+                tf.data.experimental.map_and_batch(
+                    _decode, batch_size=batch_size,
+                    num_parallel_calls=num_parallel_calls,
+                    drop_remainder=drop_batch_remainder))
 
-        # silently ignore errors -- this occured extremely rarely due to issues
-        # with color augmentation operations for some images
-        dataset = dataset.apply(tf.data.experimental.ignore_errors())
+            dataset = dataset.map(_pre_process_batch)
 
-        dataset = dataset.batch(batch_size=batch_size,
-                                drop_remainder=drop_batch_remainder)
+            # errors can't be ignored per record after batching, batches
+            # with errors are dropped
+            dataset = dataset.apply(tf.data.experimental.ignore_errors())
 
         if not is_train:
             dataset = dataset.repeat(n_repeats)
 
+        if prefetch_batches is not None:
+            dataset = dataset.prefetch(buffer_size=prefetch_batches)
+
         return dataset
 
+    @staticmethod
+    def _images_to_uint8(features, labels):
+        """ Round images in [0, 255] to uint8 (4x smaller to cache) """
+        images = tf.saturate_cast(tf.round(features['images']), tf.uint8)
+        return {**features, 'images': images}, labels
+
     def _create_hash_table_from_dict(self, mapping, missing_val=-1, name=None):
         """ Create a hash table from a dictionary """
         keys, values = zip(*mapping.items())
@@ -122,3 +206,87 @@ class DatasetReader(object):
             return class_to_index_mappings
         else:
             return None
+
+
+class RandomAccessReader(object):
+    """ Read single records by id from indexed TFRecord files
+
+        The byte offsets in the index files (see tfr_index.py) are used to
+        seek to the requested records, hence only their bytes are read.
+        Files without a valid index and compressed files are ignored.
+
+        Example:
+        --------
+        with RandomAccessReader(tfr_files) as reader:
+            serialized_record = reader.read('record_id_1')
+    """
+    def __init__(self, tfr_files):
+        if not isinstance(tfr_files, list):
+            tfr_files = [tfr_files]
+        self.locations = dict()
+        self.file_handles = dict()
+        for tfr_file in tfr_files:
+            index = read_tfr_index(tfr_file)
+            if index is None:
+                logger.warning("File %s has no valid index - ignoring it" %
+                               tfr_file)
+                continue
+            if index.get('compression_type') is not None:
+                logger.warning("File %s is compressed - ignoring it" %
+                               tfr_file)
+                continue
+            for record_id, offset in zip(
+                    index['record_ids'], index['offsets']):
+                self.locations[record_id] = (tfr_file, offset)
+        logger.debug("Indexed %s records in %s files" %
+                     (len(self.locations), len(tfr_files)))
+
+    def __contains__(self, record_id):
+        return record_id in self.locations
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record_ids(self):
+        """ Ids of all records that can be read """
+        return self.locations.keys()
+
+    def _get_file_handle(self, tfr_file):
+        if tfr_file not in self.file_handles:
+            self.file_handles[tfr_file] = tf.gfile.GFile(tfr_file, 'rb')
+        return self.file_handles[tfr_file]
+
+    def read(self, record_id):
+        """ Read the serialized record with id 'record_id' """
+        if record_id not in self.locations:
+            raise KeyError("Record %s not found in any index" % record_id)
+        tfr_file, offset = self.locations[record_id]
+        f = self._get_file_handle(tfr_file)
+        f.seek(offset)
+        # header: uint64 length and uint32 crc of the length
+        header = f.read(12)
+        length = struct.unpack('<Q', header[0:8])[0]
+        return f.read(length)
+
+    def read_many(self, record_ids):
+        """ Read serialized records in the order of 'record_ids', the
+            records are read in the order of their positions on disk
+        """
+        ordered = sorted(range(0, len(record_ids)),
+                         key=lambda i: self.locations[record_ids[i]])
+        serialized_records = [None] * len(record_ids)
+        for i in ordered:
+            serialized_records[i] = self.read(record_ids[i])
+        return serialized_records
+
+    def close(self):
+        """ Close all files """
+        for f in self.file_handles.values():
+            f.close()
+        self.file_handles = dict()
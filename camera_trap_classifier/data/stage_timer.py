@@ -0,0 +1,155 @@
+""" Timing Statistics of Processing Stages
+
+Collects the number of calls, the total / min / max duration and a
+histogram of the durations per stage (e.g. 'read', 'decode', 'write').
+The histogram has logarithmic buckets: bucket i counts durations below
+2^i microseconds (and at least 2^(i-1)). Timers can be merged, e.g. to
+combine the timings of worker processes, and be written to json and csv
+reports.
+
+Example:
+--------
+timer = StageTimer()
+with timer.time('read'):
+    file_bytes = f.read()
+timer.summary()
+>> {'read': {'count': 1, 'total_s': 0.002, 'mean_ms': 2.0, ...}}
+"""
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+N_BUCKETS = 36
+
+SUMMARY_FIELDS = ['count', 'total_s', 'mean_ms', 'min_ms', 'p50_ms',
+                  'p90_ms', 'p99_ms', 'max_ms']
+
+
+def _bucket(seconds):
+    """ Histogram bucket of a duration """
+    micros = int(seconds * 1e6)
+    return min(micros.bit_length(), N_BUCKETS - 1)
+
+
+def bucket_upper_ms(bucket):
+    """ Upper bound of a histogram bucket in milliseconds """
+    return (2 ** bucket) / 1e3
+
+
+class StageTimer(object):
+    """ Collect durations of processing stages (thread-safe) """
+
+    def __init__(self):
+        self.stages = dict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can't be pickled (e.g. to send timers to worker processes)
+        return {'stages': self.stages}
+
+    def __setstate__(self, state):
+        self.stages = state['stages']
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage):
+        """ Time the enclosed block as 'stage' """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start_time)
+
+    def add(self, stage, seconds):
+        """ Add a duration of a stage """
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = {'count': 0, 'total': 0.0, 'min': seconds,
+                         'max': seconds, 'histogram': [0] * N_BUCKETS}
+                self.stages[stage] = stats
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['min'] = min(stats['min'], seconds)
+            stats['max'] = max(stats['max'], seconds)
+            stats['histogram'][_bucket(seconds)] += 1
+
+    def merge(self, other):
+        """ Add the durations of another StageTimer """
+        with self._lock:
+            for stage, other_stats in other.stages.items():
+                stats = self.stages.get(stage)
+                if stats is None:
+                    self.stages[stage] = {
+                        **other_stats,
+                        'histogram': list(other_stats['histogram'])}
+                    continue
+                stats['count'] += other_stats['count']
+                stats['total'] += other_stats['total']
+                stats['min'] = min(stats['min'], other_stats['min'])
+                stats['max'] = max(stats['max'], other_stats['max'])
+                stats['histogram'] = [
+                    a + b for a, b in zip(stats['histogram'],
+                                          other_stats['histogram'])]
+
+    def pop(self):
+        """ Return a timer with all durations and reset this timer """
+        with self._lock:
+            popped = StageTimer()
+            popped.stages = self.stages
+            self.stages = dict()
+        return popped
+
+    @staticmethod
+    def _percentile_ms(stats, percentile):
+        """ Approximate percentile (upper bound of its histogram bucket) """
+        threshold = stats['count'] * percentile
+        cumulative = 0
+        for bucket, count in enumerate(stats['histogram']):
+            cumulative += count
+            if cumulative >= threshold:
+                return min(bucket_upper_ms(bucket), stats['max'] * 1e3)
+        return stats['max'] * 1e3
+
+    def summary(self):
+        """ Summary statistics per stage
+            Returns: dict {stage: {'count', 'total_s', 'mean_ms', 'min_ms',
+                                   'p50_ms', 'p90_ms', 'p99_ms', 'max_ms',
+                                   'histogram'}}, the histogram maps the
+                     upper bound of each non-empty bucket (in ms) to the
+                     number of durations in it
+        """
+        summary = dict()
+        for stage, stats in sorted(self.stages.items()):
+            summary[stage] = {
+                'count': stats['count'],
+                'total_s': round(stats['total'], 6),
+                'mean_ms': round(stats['total'] / stats['count'] * 1e3, 6),
+                'min_ms': round(stats['min'] * 1e3, 6),
+                'p50_ms': round(self._percentile_ms(stats, 0.5), 6),
+                'p90_ms': round(self._percentile_ms(stats, 0.9), 6),
+                'p99_ms': round(self._percentile_ms(stats, 0.99), 6),
+                'max_ms': round(stats['max'] * 1e3, 6),
+                'histogram': {
+                    '%g' % bucket_upper_ms(bucket): count
+                    for bucket, count in enumerate(stats['histogram'])
+                    if count > 0}}
+        return summary
+
+    def write_json(self, path, **report):
+        """ Write the summary (and additional 'report' entries) to a json
+            file
+        """
+        with open(path, 'w') as f:
+            json.dump({**report, 'stages': self.summary()}, f, indent=2)
+
+    def write_csv(self, path):
+        """ Write the summary (without histograms) to a csv file """
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage'] + SUMMARY_FIELDS)
+            for stage, stats in self.summary().items():
+                writer.writerow([stage] + [stats[x] for x in SUMMARY_FIELDS])
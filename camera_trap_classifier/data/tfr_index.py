@@ -0,0 +1,126 @@
+""" Sidecar Index Files of TFRecord Files
+
+Each TFRecord file written by the DatasetWriter gets an index file
+'<file>.tfrecord.index.json' with the number of records, the ids and byte
+offsets of all records, the number of images and the counts of all label
+values. This allows to count records (and labels) without reading the
+TFRecord files. The counts are stored in a header line which is read
+without the ids and offsets in the second line.
+
+An index is stale and ignored if its recorded file size does not match
+the size of the TFRecord file, e.g. if the file was re-written without
+an index. Functions using the index fall back to reading the TFRecord
+file in that case.
+
+Index files are read and written with tf.gfile, hence they support the same
+paths as the TFRecord files (e.g. gs://).
+"""
+import json
+import logging
+
+import tensorflow as tf
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_VERSION = 2
+
+
+def tfr_index_path(tfr_path):
+    """ Path of the index of a TFRecord file """
+    return tfr_path + '.index.json'
+
+
+def write_tfr_index(tfr_path, record_ids, offsets, n_images, label_counts,
+                    compression_type=None):
+    """ Write the index of a (completely written) TFRecord file
+        Args:
+            record_ids: list of record ids in the order of the file
+            offsets: list of byte offsets of the records (in the
+                uncompressed records if 'compression_type' is set)
+            n_images: number of images in all records
+            label_counts: dict {label_name: {label_value: n_records}}
+            compression_type: compression of the file (None, 'ZLIB',
+                'GZIP')
+    """
+    header = {
+        'version': INDEX_VERSION,
+        'compression_type': compression_type,
+        'file_size': tf.gfile.Stat(tfr_path).length,
+        'n_records': len(record_ids),
+        'n_images': n_images,
+        'label_counts': label_counts}
+    records = {'record_ids': record_ids, 'offsets': offsets}
+    index_path = tfr_index_path(tfr_path)
+    index_temp = index_path + '_temp'
+    with tf.gfile.GFile(index_temp, 'w') as f:
+        f.write(json.dumps(header) + '\n')
+        f.write(json.dumps(records) + '\n')
+    tf.gfile.Rename(index_temp, index_path, overwrite=True)
+
+
+def read_tfr_index(tfr_path, with_records=True):
+    """ Read the index of a TFRecord file, returns None if there is no
+        index or if it is stale
+        with_records: whether to read the ids and offsets of the records,
+            else only the counts are read
+    """
+    index_path = tfr_index_path(tfr_path)
+    if not tf.gfile.Exists(index_path):
+        return None
+    try:
+        with tf.gfile.GFile(index_path, 'r') as f:
+            index = json.loads(f.readline())
+            if with_records:
+                index.update(json.loads(f.readline()))
+    except Exception as e:
+        logger.warning("Failed to read index %s - error %s" %
+                       (index_path, str(e)))
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    if not tf.gfile.Exists(tfr_path) or \
+       tf.gfile.Stat(tfr_path).length != index['file_size']:
+        logger.debug("Ignoring stale index %s" % index_path)
+        return None
+    return index
+
+
+def n_records_from_tfr_index(tfr_paths):
+    """ Count records using the index files
+        Returns:
+            number of records in all indexed files, list of files without
+            a (valid) index
+    """
+    n_records = 0
+    not_indexed = list()
+    for tfr_path in tfr_paths:
+        index = read_tfr_index(tfr_path, with_records=False)
+        if index is None:
+            not_indexed.append(tfr_path)
+        else:
+            n_records += index['n_records']
+    if len(not_indexed) > 0:
+        logger.debug("Found no valid index for %s / %s files" %
+                     (len(not_indexed), len(tfr_paths)))
+    return n_records, not_indexed
+
+
+def label_counts_from_tfr_index(tfr_paths):
+    """ Sum the label counts of all files
+        Returns:
+            dict {label_name: {label_value: n_records}} or None if not
+            all files have a valid index
+    """
+    label_counts = dict()
+    for tfr_path in tfr_paths:
+        index = read_tfr_index(tfr_path, with_records=False)
+        if index is None:
+            return None
+        for label_name, counts in index['label_counts'].items():
+            total_counts = label_counts.setdefault(label_name, dict())
+            for label_value, count in counts.items():
+                total_counts[label_value] = \
+                    total_counts.get(label_value, 0) + count
+    return label_counts
@@ -9,11 +9,16 @@ from hashlib import md5
 import random
 import time
 from multiprocessing import Pool
+from functools import partial
 import logging
 
 import tensorflow as tf
 import numpy as np
 
+from camera_trap_classifier.data.tfr_index import n_records_from_tfr_index
+from camera_trap_classifier.data.reader import RandomAccessReader
+from camera_trap_classifier.data.dir_scanner import DirectoryScanner
+
 
 logger = logging.getLogger(__name__)
 
@@ -85,10 +90,10 @@ def _balanced_sampling(id_to_label, random_seed=123):
     class_assignment = {x: list() for x in label_stats.keys()}
     remaining_record_ids = set()
 
-    # Randomly Shuffle Ids
+    # Randomly Shuffle Ids (with a local generator to not change the state
+    # of the global one, the order is the same as with random.seed())
     all_ids = list(id_to_label.keys())
-    random.seed(random_seed)
-    random.shuffle(all_ids)
+    random.Random(random_seed).shuffle(all_ids)
 
     for record_id in all_ids:
         label = id_to_label[record_id]
@@ -137,38 +142,46 @@ def randomly_split_dataset(
             "balanced_sampling_id_to_label must be a dict if \
              balanced_sampling_min is specified"
 
-    # assign each record id a split value between 0 and 1
-    # derived from a hash function to ensure consistency
-    # based on the capture_id
-    split_vals = {x: id_to_zero_one(x) for x in split_ids}
-
-    # assign each id into different splits based on split value
-    split_assignments = list()
-
-    split_props_cum = [sum(split_percent[0:(i+1)]) for i in
-                       range(0, len(split_percent))]
-
-    for record_id in split_ids:
-        split_val = split_vals[record_id]
-        for sn, sp in zip(split_names, split_props_cum):
-            if split_val <= sp:
-                split_assignments.append(sn)
-                break
-
     # Balanced sampling to the minority class
     if balanced_sampling_min:
         remaining_record_ids = _balanced_sampling(balanced_sampling_id_to_label)
-    else:
-        remaining_record_ids = split_ids
+        split_ids = [x for x in split_ids if x in remaining_record_ids]
+
+    # assign each id into different splits based on a split value between
+    # 0 and 1 derived from a hash function to ensure consistency
+    # based on the capture_id
+    split_index = assign_ids_to_splits(split_ids, split_percent)
 
     # create final dictionary with split assignment per record id
-    final_split_assignments = dict()
+    return {record_id: split_names[i]
+            for record_id, i in zip(split_ids, split_index.tolist())}
 
-    for record_id, sp in zip(split_ids, split_assignments):
-        if record_id in remaining_record_ids:
-            final_split_assignments[record_id] = sp
 
-    return final_split_assignments
+def ids_to_zero_one(ids):
+    """ Deterministically assign strings to values 0-1, identical to
+        id_to_zero_one for each id
+        Returns: numpy array of floats
+    """
+    digests = np.frombuffer(
+        b''.join([md5(str(x).encode('ascii')).digest() for x in ids]),
+        dtype=np.uint8).reshape(-1, 16)
+    # the first 3 bytes of the md5 digest are the first 6 chars of the
+    # hex digest
+    hashed = digests[:, :3].astype(np.int64)
+    hashed = (hashed[:, 0] << 16) | (hashed[:, 1] << 8) | hashed[:, 2]
+    return hashed / 0xFFFFFF
+
+
+def assign_ids_to_splits(ids, split_percent):
+    """ Assign ids to splits according to their hash values
+        Returns: numpy array with the index of the split of each id
+    """
+    split_props_cum = np.array(
+        [sum(split_percent[0:(i+1)]) for i in range(0, len(split_percent))],
+        dtype=np.float64)
+    # index of the first split with a cumulative percentage >= value
+    return np.searchsorted(split_props_cum, ids_to_zero_one(ids),
+                           side='left')
 
 
 def slice_generator(sequence_length, n_blocks):
@@ -304,29 +317,52 @@ def rename_files_cats_dogs(path):
         os.rename(os.path.join(path, file), os.path.join(path,  new_file_name))
 
 
-def n_records_in_tfr(tfr_path):
+def n_records_in_tfr(tfr_path, compression_type=None):
+    """ Number of records in all tfr files, reads only files without
+        a valid index file
+    """
     if not isinstance(tfr_path, list):
         tfr_path = [tfr_path]
-    total = 0
-    for path in tfr_path:
-        total += sum(1 for _ in tf.python_io.tf_record_iterator(path))
+    if compression_type is not None:
+        options = tf.python_io.TFRecordOptions(compression_type)
+    else:
+        options = None
+    total, not_indexed = n_records_from_tfr_index(tfr_path)
+    for path in not_indexed:
+        total += sum(1 for _ in tf.python_io.tf_record_iterator(
+            path, options=options))
     return total
 
 
 def n_records_in_tfr_dataset(tfr_path,
                              n_parallel_file_reads=50,
-                             batch_size=5000):
-    """ Read the number of records in all tfr files using the Dataset API
+                             batch_size=5000,
+                             compression_type=None):
+    """ Read the number of records in all tfr files using the Dataset API,
+        reads only files without a valid index file
         Input:
             tfr_path: list of tfr paths
             n_parallel_file_reads: int - number of files to read in parallel
             batch_size: int - number of elements to read from each file
+            compression_type: compression of the files (None, 'ZLIB',
+                'GZIP')
         Output:
             int with number of records over all files
     """
     if not isinstance(tfr_path, list):
         tfr_path = [tfr_path]
 
+    n_indexed, not_indexed = n_records_from_tfr_index(tfr_path)
+    if len(not_indexed) == 0:
+        return n_indexed
+    return n_indexed + _n_records_in_tfr_dataset_scan(
+        not_indexed, n_parallel_file_reads, batch_size, compression_type)
+
+
+def _n_records_in_tfr_dataset_scan(tfr_path, n_parallel_file_reads,
+                                   batch_size, compression_type):
+    """ Read the number of records in all tfr files using the Dataset API
+    """
     # Use max one process per file
     n_tfr_files = len(tfr_path)
     num_parallel_reads = min(n_parallel_file_reads, n_tfr_files)
@@ -338,7 +374,8 @@ def n_records_in_tfr_dataset(tfr_path,
     dataset = tf.data.Dataset.from_tensor_slices(tfr_path)
     dataset = dataset.apply(
         tf.data.experimental.parallel_interleave(
-            lambda filename: tf.data.TFRecordDataset(filename),
+            lambda filename: tf.data.TFRecordDataset(
+                filename, compression_type=compression_type),
             cycle_length=num_parallel_reads))
     dataset = dataset.apply(tf.data.experimental.enumerate_dataset(start=0))
     dataset = dataset.apply(
@@ -352,6 +389,7 @@ def n_records_in_tfr_dataset(tfr_path,
     # Loop once over the whole dataset
     with tf.Session() as sess:
         n_batches = 0
+        counter = [-1]
         while True:
             try:
                 t_start_batch = time.time()
@@ -365,26 +403,50 @@ def n_records_in_tfr_dataset(tfr_path,
                     counter[-1]))
                 logger.debug("Current speed: {:2.2f} s/batch".format(
                     t_now-t_start_batch))
-    logger.debug("Finished -- Counted {} records".format(counter[-1]))
-    return counter[-1]
+    # the counter is the 0-based index of the last record
+    n_records = counter[-1] + 1
+    logger.debug("Finished -- Counted {} records".format(n_records))
+    return n_records
 
 
-def n_records_in_tfr_parallel(tfr_path, n_processes=4):
+def n_records_in_tfr_parallel(tfr_path, n_processes=4,
+                              compression_type=None):
     """ Read the number of records in all tfr files in parallel """
     if not isinstance(tfr_path, list):
         tfr_path = [tfr_path]
-    if len(tfr_path) > 0:
+    n_indexed, not_indexed = n_records_from_tfr_index(tfr_path)
+    if len(not_indexed) > 0:
         pool = Pool(processes=n_processes)
-        counts = list(pool.imap_unordered(n_records_in_tfr, tfr_path))
+        counts = list(pool.imap_unordered(
+            partial(n_records_in_tfr, compression_type=compression_type),
+            not_indexed))
         pool.close()
         pool.join()
-        return sum(counts)
+        return n_indexed + sum(counts)
     else:
-        return n_records_in_tfr(tfr_path)
+        return n_indexed
 
 
-def check_tfrecord_contents(path_to_tfr):
-    record_iterator = tf.python_io.tf_record_iterator(path_to_tfr)
+def check_tfrecord_contents(path_to_tfr, record_id=None,
+                            compression_type=None):
+    """ Print the last record of a tfr file or the record with id
+        'record_id' (read directly using the index of the file, only for
+        uncompressed files)
+        compression_type: compression of the file (None, 'ZLIB', 'GZIP')
+    """
+    if record_id is not None:
+        with RandomAccessReader(path_to_tfr) as reader:
+            record = reader.read(record_id)
+        example = tf.train.SequenceExample()
+        example.ParseFromString(record)
+        print(example)
+        return
+    if compression_type is not None:
+        options = tf.python_io.TFRecordOptions(compression_type)
+    else:
+        options = None
+    record_iterator = tf.python_io.tf_record_iterator(
+        path_to_tfr, options=options)
     for record in record_iterator:
         example = tf.train.Example()
         example.ParseFromString(record)
@@ -534,15 +596,18 @@ def get_file_name_from_path(file_path):
     return file_path.split(os.path.sep)[-1]
 
 
-def list_pictures(directory, ext=('jpg', 'jpeg', 'bmp', 'png', 'ppm')):
+def list_pictures(directory, ext=('jpg', 'jpeg', 'bmp', 'png', 'ppm'),
+                  n_threads=16, cache_path=None):
     """Lists all pictures in a directory, including all subdirectories.
     # Arguments
         directory: string, absolute path to the directory
         ext: tuple of strings or single string, extensions of the pictures
+        n_threads: number of directories to list in parallel
+        cache_path: json file to cache directory listings in, a re-scan
+            lists only directories that changed (see dir_scanner.py)
     # Returns
-        a list of paths
+        a sorted list of paths
     """
     ext = tuple('.%s' % e for e in ((ext,) if isinstance(ext, str) else ext))
-    return [os.path.join(root, f)
-            for root, _, files in os.walk(directory) for f in files
-            if f.lower().endswith(ext)]
+    scanner = DirectoryScanner(n_threads=n_threads, cache_path=cache_path)
+    return scanner.list_files(directory, ext=ext)
@@ -5,24 +5,319 @@ import math
 import time
 import logging
 import textwrap
-from multiprocessing import Process, Manager
+import json
+import re
+from itertools import islice
+from collections import deque, Counter
+from collections.abc import Mapping
+from multiprocessing import Process, Pool
 
 import tensorflow as tf
 
-from camera_trap_classifier.data.image import (
-    read_image_from_disk_and_convert_to_jpeg)
+from camera_trap_classifier.data.image_codecs import (
+    ImageCodec, enable_eager_execution)
 from camera_trap_classifier.data.utils import (
     slice_generator, estimate_remaining_time)
+from camera_trap_classifier.data.tfr_index import (
+    write_tfr_index, tfr_index_path)
+from camera_trap_classifier.data.image_check import full_image_path
+from camera_trap_classifier.data.image_prefetch import ImagePrefetcher
+from camera_trap_classifier.data.stage_timer import StageTimer
 
-tf.enable_eager_execution()
 
 logger = logging.getLogger(__name__)
 
 
+# DatasetWriter instance used by the worker processes of the image
+# processing pool, set once per worker by _init_pool_worker
+_pool_writer = None
+
+
+def _write_json_atomic(data, path):
+    """ Write 'data' to a json file without ever exposing a partial file """
+    path_temp = path + '_temp'
+    with open(path_temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(path_temp, path)
+
+
+def _tfr_options(compression_type):
+    """ TFRecordOptions for a compression type (None, 'ZLIB', 'GZIP') """
+    if compression_type is None:
+        return None
+    return tf.python_io.TFRecordOptions(compression_type)
+
+
+def _init_pool_worker(writer):
+    """ Store the writer in the worker process, the stats and timings
+        inherited from the parent process are discarded such that only the
+        work of this worker is reported back
+    """
+    global _pool_writer
+    writer._pop_image_stats()
+    writer.timings = StageTimer()
+    if writer.image_codec is not None:
+        writer.image_codec.pop_timings()
+    _pool_writer = writer
+
+
+def _serialize_record_batch_in_worker(record_batch):
+    """ Serialize a list of records in a worker process, returns the
+        serialized records with their infos, the image stats and the
+        timings of the worker
+    """
+    serialized_records = _pool_writer._serialize_record_batch(record_batch)
+    return (serialized_records, _pool_writer._pop_image_stats(),
+            _pool_writer._pop_timings())
+
+
+class _TFRecordFile(object):
+    """ Write serialized records to a temporary file which replaces
+        'output_file' once all records have been written
+
+        Every 'checkpoint_every' records the file is flushed and a line is
+        appended to a progress manifest next to it. Each line contains the
+        ids and byte offsets of the records written and the ids of the
+        records failed since the previous checkpoint. With 'resume' the
+        records of an interrupted run are recovered from the temporary file
+        and the manifest, records written after the last checkpoint are
+        discarded.
+
+        Once closed, an index with the ids and offsets of the records,
+        the number of images and the label counts is stored next to the
+        file (see tfr_index.py). For compressed files ('compression_type')
+        the offsets refer to the uncompressed records.
+
+        'n_records' is the number of records to write to the file, None if
+        it is not known in advance (files written with max_bytes_per_file)
+    """
+    def __init__(self, output_file, n_records, log_every=1000,
+                 checkpoint_every=100, resume=False, compression_type=None,
+                 timings=None):
+        self.output_file = output_file
+        self.output_temp = output_file + '_temp'
+        self.progress_file = self.progress_path(output_file)
+        self.n_records = n_records
+        self.log_every = log_every
+        self.checkpoint_every = checkpoint_every
+        self.compression_type = compression_type
+        self.options = _tfr_options(compression_type)
+        self.record_ids = list()
+        self.offsets = list()
+        self.failed = list()
+        self.n_bytes = 0
+        self.n_images = 0
+        self.label_counts = dict()
+        self.start_time = time.time()
+        self.timings = timings if timings is not None else StageTimer()
+
+        progress = None
+        if resume:
+            progress = self.read_progress(output_file, compression_type)
+
+        if progress is not None:
+            logger.info("Resume Writing %s - found %s written and %s failed \
+                         records" % (output_file,
+                                     len(progress['record_ids']),
+                                     len(progress['failed'])))
+            self._recover(progress)
+        else:
+            logger.info("Start Writing %s" % output_file)
+            self.writer = tf.python_io.TFRecordWriter(
+                self.output_temp, options=self.options)
+            self._start_progress()
+
+        self.n_processed_at_start = self.n_processed
+
+    @property
+    def n_written(self):
+        return len(self.record_ids)
+
+    @property
+    def n_processed(self):
+        return len(self.record_ids) + len(self.failed)
+
+    @staticmethod
+    def progress_path(output_file):
+        """ Path of the progress manifest of 'output_file' """
+        return output_file + '_progress.jsonl'
+
+    @classmethod
+    def read_progress(cls, output_file, compression_type=None):
+        """ Read the progress manifest of an interrupted write, returns None
+            if there is no usable manifest or no checkpoint
+        """
+        progress_file = cls.progress_path(output_file)
+        output_temp = output_file + '_temp'
+        if not (os.path.exists(progress_file) and
+                os.path.exists(output_temp)):
+            return None
+        try:
+            with open(progress_file, 'r') as f:
+                header = json.loads(f.readline())
+                checkpoints = list()
+                for line in f:
+                    # the last line is incomplete if the run was interrupted
+                    # while appending it
+                    try:
+                        checkpoints.append(json.loads(line))
+                    except ValueError:
+                        break
+        except Exception as e:
+            logger.warning("Failed to read progress file %s - error %s" %
+                           (progress_file, str(e)))
+            return None
+        if len(checkpoints) == 0:
+            return None
+        # combine the records of all checkpoints
+        progress = {**header, **checkpoints[-1]}
+        for key in ['record_ids', 'offsets', 'failed']:
+            progress[key] = [x for checkpoint in checkpoints
+                             for x in checkpoint[key]]
+        if progress.get('compression_type') != compression_type:
+            logger.warning("File %s was written with compression %s" %
+                           (output_temp, progress.get('compression_type')))
+            return None
+        if os.path.getsize(output_temp) < progress['file_size']:
+            logger.warning("File %s is smaller than recorded in %s" %
+                           (output_temp, progress_file))
+            return None
+        return progress
+
+    @classmethod
+    def read_processed_record_ids(cls, output_file, compression_type=None):
+        """ Ids of records written or failed in an interrupted write """
+        progress = cls.read_progress(output_file, compression_type)
+        if progress is None:
+            return set()
+        return set(progress['record_ids']).union(progress['failed'])
+
+    def _recover(self, progress):
+        """ Copy the checkpointed records of an interrupted write to a new
+            temporary file
+        """
+        output_recover = self.output_temp + '_recover'
+        os.replace(self.output_temp, output_recover)
+        self.writer = tf.python_io.TFRecordWriter(
+            self.output_temp, options=self.options)
+        n_to_recover = len(progress['record_ids'])
+        records = tf.python_io.tf_record_iterator(
+            output_recover, options=self.options)
+        for record_id, serialized_record in zip(
+                progress['record_ids'], records):
+            self._write(record_id, serialized_record)
+        os.remove(output_recover)
+        if self.n_written != n_to_recover:
+            logger.warning("Recovered only %s / %s records of %s" %
+                           (self.n_written, n_to_recover, self.output_file))
+        self.failed = list(progress['failed'])
+        self.n_images = progress['n_images']
+        self.label_counts = progress['label_counts']
+        self._start_progress()
+        self._checkpoint()
+
+    def _write(self, record_id, serialized_record):
+        """ Write a serialized record and record its position """
+        self.writer.write(serialized_record)
+        self.record_ids.append(record_id)
+        self.offsets.append(self.n_bytes)
+        # each record has a 12 bytes header and a 4 bytes footer
+        self.n_bytes += len(serialized_record) + 16
+
+    def _start_progress(self):
+        """ Start a new progress manifest without any checkpoints """
+        header = {'output_file': self.output_file,
+                  'compression_type': self.compression_type}
+        with open(self.progress_file, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+        self.n_written_at_checkpoint = 0
+        self.n_failed_at_checkpoint = 0
+
+    def _checkpoint(self):
+        """ Flush the file and append the records written and failed since
+            the last checkpoint to the progress manifest
+        """
+        self.writer.flush()
+        progress = {
+            'file_size': os.path.getsize(self.output_temp),
+            'n_bytes': self.n_bytes,
+            'record_ids': self.record_ids[self.n_written_at_checkpoint:],
+            'offsets': self.offsets[self.n_written_at_checkpoint:],
+            'failed': self.failed[self.n_failed_at_checkpoint:],
+            'n_images': self.n_images,
+            'label_counts': self.label_counts}
+        with open(self.progress_file, 'a') as f:
+            f.write(json.dumps(progress) + '\n')
+        self.n_written_at_checkpoint = len(self.record_ids)
+        self.n_failed_at_checkpoint = len(self.failed)
+
+    def _count(self, record_info):
+        """ Count the images and labels of a record """
+        self.n_images += record_info['n_images']
+        for label_name, label_values in record_info['labels'].items():
+            counts = self.label_counts.setdefault(label_name, dict())
+            for label_value in set(label_values):
+                counts[label_value] = counts.get(label_value, 0) + 1
+
+    def write(self, record_id, serialized_record, record_info=None):
+        """ Write a serialized record, None marks a failed record
+            'record_info' is a dict with the number of images and the
+            labels of the record (see DatasetWriter._serialize_record)
+        """
+        if (self.n_processed % self.log_every) == 0:
+            if self.n_records is None:
+                msg = "Wrote %s records - file: %s" % \
+                      (self.n_written, self.output_file)
+            else:
+                est_t = estimate_remaining_time(
+                    self.start_time,
+                    self.n_records - self.n_processed_at_start,
+                    self.n_processed - self.n_processed_at_start)
+                msg = "Wrote %s / %s records - \
+                       estimated time remaining: %s - file: %s" % \
+                      (self.n_written, self.n_records, est_t, self.output_file)
+            logger.debug(textwrap.shorten(msg, width=99))
+
+        if serialized_record is None:
+            logger.debug("Discarding record %s - no image avail" %
+                         record_id)
+            self.failed.append(record_id)
+        else:
+            with self.timings.time('write'):
+                self._write(record_id, serialized_record)
+            if record_info is not None:
+                self._count(record_info)
+
+        if (self.n_processed % self.checkpoint_every) == 0:
+            with self.timings.time('checkpoint'):
+                self._checkpoint()
+
+    def close(self):
+        """ Close the file and rename it to its final name """
+        self.writer.close()
+        os.replace(self.output_temp, self.output_file)
+        write_tfr_index(self.output_file, self.record_ids, self.offsets,
+                        self.n_images, self.label_counts,
+                        compression_type=self.compression_type)
+        if os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
+        if self.n_records is None:
+            logger.info("Finished Writing Records to %s - Wrote %s" %
+                        (self.output_file, self.n_written))
+        else:
+            logger.info(
+                "Finished Writing Records to %s - Wrote %s/%s" %
+                (self.output_file, self.n_written, self.n_records))
+
+
 class DatasetWriter(object):
     def __init__(self, tfr_encoder):
         self.tfr_encoder = tfr_encoder
         self.files = dict()
+        self.image_stats = Counter()
+        # durations of the processing stages of all encode_to_tfr calls
+        self.timings = StageTimer()
+        self.wall_time = 0.0
 
     def encode_to_tfr(
          self, tfrecord_dict,
@@ -31,18 +326,64 @@ class DatasetWriter(object):
          image_root_path=None,
          image_pre_processing_fun=None,
          image_pre_processing_args=None,
+         image_codec=None,
+         image_cache=None,
          random_shuffle_before_save=True,
          overwrite_existing_files=True,
          max_records_per_file=None,
+         max_bytes_per_file=None,
          write_tfr_in_parallel=False,
          process_images_in_parallel=False,
          process_images_in_parallel_size=100,
-         processes_images_in_parallel_n_processes=4):
-        """ Export TFRecord Dict to a TFRecord file """
-
+         processes_images_in_parallel_n_processes=4,
+         max_records_in_flight=None,
+         resume=False,
+         checkpoint_every=100,
+         compression_type=None,
+         image_read_threads=None,
+         image_read_ahead=None):
+        """ Export TFRecord Dict to a TFRecord file
+
+            image_codec: an ImageCodec to read and process the images,
+                is ignored if 'image_pre_processing_fun' is specified,
+                defaults to the tensorflow codec without resizing
+            image_cache: an ImageCache to look up images processed by
+                'image_codec' before processing them
+            tfrecord_dict: a mapping of record ids to records, records are
+                only accessed when they are processed, hence it can create
+                them on the fly
+            max_records_in_flight: max number of records being processed
+                at the same time if 'process_images_in_parallel' is set,
+                defaults to 2 * process_images_in_parallel_size
+            resume: continue writing files of an interrupted run from their
+                last checkpoint instead of re-writing them
+            checkpoint_every: number of records after which the progress
+                of a file is checkpointed
+            max_bytes_per_file: split the records into files of about that
+                many bytes instead of 'max_records_per_file' records, a
+                new file is started as soon as the current one reaches
+                that size (files are named '<file_prefix>_001.tfrecord',
+                ...)
+            compression_type: None, 'ZLIB' or 'GZIP' - compress the files,
+                which makes them smaller for slow (network) storage at
+                the cost of CPU time when reading them, compressed files
+                have to be read with the same 'compression_type'
+            image_read_threads: read the raw bytes of images ahead with
+                that many threads (in the main process) and send them to
+                the image processing, which decouples the I/O concurrency
+                from the number of processes, e.g. for network file
+                systems; None to read images where they are processed
+            image_read_ahead: max number of records whose images are read
+                ahead, defaults to max_records_in_flight if images are
+                processed in parallel, else 4 * image_read_threads
+        """
+
+        self.start_time = time.time()
         self.tfrecord_dict = tfrecord_dict
         self.image_pre_processing_fun = image_pre_processing_fun
         self.image_pre_processing_args = image_pre_processing_args
+        self.image_codec = image_codec
+        self.image_cache = image_cache
         self.random_shuffle_before_save = random_shuffle_before_save
         self.file_prefix = file_prefix
         self.image_root_path = image_root_path
@@ -52,10 +393,37 @@ class DatasetWriter(object):
         self.process_images_in_parallel_size = process_images_in_parallel_size
         self.processes_images_in_parallel_n_processes = \
             processes_images_in_parallel_n_processes
+        if max_records_in_flight is None:
+            max_records_in_flight = 2 * process_images_in_parallel_size
+        self.max_records_in_flight = max_records_in_flight
+        self.resume = resume
+        self.checkpoint_every = checkpoint_every
+        self.compression_type = compression_type
+        self.image_read_threads = image_read_threads
+        if image_read_ahead is None and image_read_threads is not None:
+            if process_images_in_parallel:
+                image_read_ahead = max_records_in_flight
+            else:
+                image_read_ahead = 4 * image_read_threads
+        self.image_read_ahead = image_read_ahead
+
+        # image_pre_processing_fun is expected to use (eager) TF operations
+        if self.image_pre_processing_fun is not None:
+            enable_eager_execution()
+        elif self.image_codec is None:
+            self.image_codec = ImageCodec.create('tensorflow', {})
+
+        # image_pre_processing_fun reads the images by itself
+        if self.image_read_threads is not None and \
+           self.image_pre_processing_fun is not None:
+            logger.warning("image_read_threads is not supported with \
+                            image_pre_processing_fun - images are read \
+                            by image_pre_processing_fun")
+            self.image_read_threads = None
 
         logger.info("Starting to Encode Data to TFRecords")
 
-        if not isinstance(tfrecord_dict, dict):
+        if not isinstance(tfrecord_dict, Mapping):
             logger.error("tfrecord_dict must be a dictionary")
             raise ValueError("tfrecord_dict must be a dictionary")
 
@@ -63,11 +431,37 @@ class DatasetWriter(object):
         # equally each time
         record_ids = list(tfrecord_dict.keys())
         record_ids.sort()
-        n_records = len(tfrecord_dict.keys())
+        n_records = len(record_ids)
 
         logger.info("Start Writing Records to TFRecord-File - Total %s" %
                     n_records)
 
+        if max_bytes_per_file is not None:
+            if self.write_tfr_in_parallel:
+                logger.warning(
+                    "write_tfr_in_parallel is not supported with \
+                     max_bytes_per_file - writing files sequentially")
+                self.write_tfr_in_parallel = False
+            first_shard = self._shard_path(output_dir, 0)
+            # the files of an interrupted run are incomplete
+            interrupted = self.resume and os.path.exists(
+                self._shards_progress_path(output_dir))
+            if os.path.exists(first_shard) and not overwrite_existing_files \
+                    and not interrupted:
+                logger.info("File: %s exists - not gonna overwrite" %
+                            first_shard)
+                self.files[self.file_prefix] = \
+                    self._find_shards(output_dir)
+                return
+            self._run_with_pool(
+                self._write_to_files_by_size,
+                output_dir, record_ids, max_bytes_per_file)
+            self._log_image_stats()
+            self._collect_timings()
+            if self.image_cache is not None:
+                self.image_cache.evict()
+            return
+
         # Generate output file names
         if max_records_per_file is None:
             n_files = 1
@@ -79,13 +473,10 @@ class DatasetWriter(object):
             file_name = '%s_%03d-of-%03d.tfrecord' % (file_prefix, i+1, n_files)
             output_paths.append(os.path.join(*[output_dir, file_name]))
 
-        # processes list if parallel processing is enabled
-        if self.write_tfr_in_parallel:
-            processes_list = list()
-
         slices = slice_generator(n_records, n_files)
 
-        # Write each file
+        # Determine the files to write
+        files_to_write = list()
         for f_id, (start_i, end_i) in enumerate(slices):
             output_file = output_paths[f_id]
             # generate record slices for each file
@@ -97,31 +488,158 @@ class DatasetWriter(object):
             if file_exists and not overwrite_existing_files:
                 logger.info("File: %s exists - not gonna overwrite" %
                             output_file)
-                self.files[file_prefix].append(output_file)
             else:
-                if self.write_tfr_in_parallel:
-                    pr = Process(target=self._write_to_file,
-                                 args=(output_file, file_record_ids))
-                    pr.start()
-                    processes_list.append(pr)
-                else:
-                    if self.process_images_in_parallel:
-                        self._write_to_file_parallel(output_file,
-                                                     file_record_ids)
-                    else:
-                        self._write_to_file(output_file, file_record_ids)
+                files_to_write.append((output_file, file_record_ids))
             self.files[self.file_prefix].append(output_file)
-        # start all processes
+
+        # Write each file
         if self.write_tfr_in_parallel:
+            processes_list = list()
+            for output_file, file_record_ids in files_to_write:
+                pr = Process(target=self._write_to_file,
+                             args=(output_file, file_record_ids))
+                pr.start()
+                processes_list.append(pr)
             for p in processes_list:
                 p.join()
 
-    def _serialize_record_batch(self, record_batch, outlist):
-        """ Serialize a list of records """
-        for record_data in record_batch:
-            serialized_record = self._serialize_record(record_data)
-            if serialized_record is not None:
-                outlist.append(serialized_record)
+        elif self.process_images_in_parallel:
+            self._run_with_pool(self._write_to_files_parallel, files_to_write)
+        else:
+            for output_file, file_record_ids in files_to_write:
+                self._write_to_file(output_file, file_record_ids)
+
+        # stats of separate processes are logged by each process
+        if not self.write_tfr_in_parallel:
+            self._log_image_stats()
+        self._collect_timings()
+
+        if self.image_cache is not None:
+            self.image_cache.evict()
+
+    def _run_with_pool(self, write_fun, *args):
+        """ Call write_fun(*args, pool) with one pool of worker processes
+            for all files of this call, or with pool=None if images are
+            not processed in parallel
+        """
+        if not self.process_images_in_parallel:
+            return write_fun(*args, None)
+        pool = Pool(
+            processes=self.processes_images_in_parallel_n_processes,
+            initializer=_init_pool_worker,
+            initargs=(self, ))
+        try:
+            return write_fun(*args, pool)
+        finally:
+            # all results have been collected at this point
+            pool.terminate()
+            pool.join()
+
+    def _pop_image_stats(self):
+        """ Return and reset the image stats of the image codec and cache """
+        stats = Counter()
+        if self.image_codec is not None:
+            stats.update(self.image_codec.pop_stats())
+        if self.image_cache is not None:
+            stats.update(self.image_cache.pop_stats())
+        return stats
+
+    def _pop_timings(self):
+        """ Return and reset the timings of this writer and its codec """
+        timings = self.timings.pop()
+        if self.image_codec is not None:
+            timings.merge(self.image_codec.pop_timings())
+        return timings
+
+    def _collect_timings(self):
+        """ Add the timings of the codec and the wall time of the current
+            encode_to_tfr call to the timings of this writer
+        """
+        self.timings = self._pop_timings()
+        self.wall_time += time.time() - self.start_time
+
+    def timing_report(self):
+        """ Report of the durations of all processing stages
+            Returns: dict with the wall time, the number of written records
+                and images and the stage summaries (see StageTimer),
+                with parallel processing the stage durations of all
+                processes are summed up
+        """
+        summary = self.timings.summary()
+        n_records = summary.get('write', {}).get('count', 0)
+        return {'wall_time_s': round(self.wall_time, 3),
+                'n_records_written': n_records,
+                'records_per_s': round(n_records / max(self.wall_time, 1e-9),
+                                       3),
+                'stages': summary}
+
+    def log_timing_report(self):
+        """ Log the durations of all processing stages """
+        report = self.timing_report()
+        logger.info("Wrote %s records in %.1f s - %.1f records/s" %
+                    (report['n_records_written'], report['wall_time_s'],
+                     report['records_per_s']))
+        for stage, stats in report['stages'].items():
+            logger.info("Stage %s: count %s total %.1f s mean %.3f ms \
+p50 %.3f ms p90 %.3f ms p99 %.3f ms max %.3f ms" %
+                        (stage, stats['count'], stats['total_s'],
+                         stats['mean_ms'], stats['p50_ms'], stats['p90_ms'],
+                         stats['p99_ms'], stats['max_ms']))
+
+    def write_timing_report(self, json_path=None, csv_path=None):
+        """ Write the timing report to a json and / or csv file """
+        report = self.timing_report()
+        if json_path is not None:
+            self.timings.write_json(
+                json_path,
+                **{k: v for k, v in report.items() if k != 'stages'})
+            logger.info("Timing report saved to %s" % json_path)
+        if csv_path is not None:
+            self.timings.write_csv(csv_path)
+            logger.info("Timing report saved to %s" % csv_path)
+
+    def _log_image_stats(self):
+        """ Log how many images were processed in which way, the stats of
+            the image cache and the codec count the same images and are
+            logged relative to their own totals
+        """
+        self.image_stats.update(self._pop_image_stats())
+        groups = dict()
+        for stat, count in self.image_stats.items():
+            group = 'cache' if stat.startswith('cache_') else 'codec'
+            groups.setdefault(group, dict())[stat] = count
+        for _, stats in sorted(groups.items()):
+            n_total = sum(stats.values())
+            for stat, count in sorted(stats.items()):
+                logger.info("Image Stats %s: %s: %s / %s images" %
+                            (self.file_prefix, stat, count, n_total))
+        self.image_stats = Counter()
+
+    def _shuffle_record_ids(self, record_ids):
+        """ Randomly shuffle records before saving, this is better for
+            model training
+        """
+        if self.random_shuffle_before_save:
+            random.seed(123)
+            random.shuffle(record_ids)
+        return record_ids
+
+    def _open_file(self, output_file, n_records, log_every=1000):
+        """ Open a TFR File to write 'n_records' to """
+        return _TFRecordFile(
+            output_file, n_records,
+            log_every=log_every,
+            checkpoint_every=self.checkpoint_every,
+            resume=self.resume,
+            compression_type=self.compression_type,
+            timings=self.timings)
+
+    def _serialize_record_batch(self, record_batch):
+        """ Serialize a list of records, returns a list with the serialized
+            records and their infos (see _serialize_record)
+        """
+        return [self._serialize_record(record_data)
+                for record_data in record_batch]
 
     def _read_image_from_disk(self, image_path_full):
         """ Read Image from Disk """
@@ -130,24 +648,56 @@ class DatasetWriter(object):
                 image_path_full
             image_raw = self.image_pre_processing_fun(
                  **self.image_pre_processing_args)
+        elif self.image_cache is not None:
+            image_raw = self.image_cache.get_or_create(
+                image_path_full, self.image_codec)
         else:
-            image_raw = \
-                read_image_from_disk_and_convert_to_jpeg(image_path_full)
+            image_raw = self.image_codec.read_and_encode(image_path_full)
         return image_raw
 
+    def _encode_image(self, image_path_full, file_bytes):
+        """ Process the prefetched raw bytes of an image (None for images
+            that were not read because they are cached)
+        """
+        # reading the image failed
+        if isinstance(file_bytes, Exception):
+            raise file_bytes
+        if self.image_cache is not None:
+            return self.image_cache.get_or_create(
+                image_path_full, self.image_codec, file_bytes=file_bytes)
+        return self.image_codec.encode(file_bytes)
+
+    def _read_image_bytes(self, image_path):
+        """ Read the raw bytes of an image path of a record, returns None
+            for cached images which don't need to be read
+        """
+        image_path_full = full_image_path(image_path, self.image_root_path)
+        if self.image_cache is not None and \
+                self.image_cache.contains(image_path_full, self.image_codec):
+            return None
+        return self.image_codec.read_file(image_path_full)
+
     def _serialize_record(self, record_data):
-        """ Serialize a single record """
+        """ Serialize a single record
+            Returns: serialized record, dict with the number of images
+                and the labels of the record (None, None for records
+                without any readable image)
+        """
+        # raw bytes of the images if they were read ahead
+        image_bytes = record_data.pop('image_bytes', None)
+
         # Process all images in a record
         raw_images = list()
-        for image_path in record_data['image_paths']:
+        for i, image_path in enumerate(record_data['image_paths']):
             # Create image path
-            if self.image_root_path is not None:
-                image_path_full = os.path.join(self.image_root_path,
-                                               image_path.lstrip(os.sep))
-            else:
-                image_path_full = image_path
+            image_path_full = full_image_path(image_path,
+                                              self.image_root_path)
             try:
-                image_raw = self._read_image_from_disk(image_path_full)
+                if image_bytes is None:
+                    image_raw = self._read_image_from_disk(image_path_full)
+                else:
+                    image_raw = self._encode_image(
+                        image_path_full, image_bytes[i])
             except Exception as e:
                 logger.debug("Failed to read image: %s , error %s" %
                              (image_path_full, str(e)))
@@ -157,133 +707,269 @@ class DatasetWriter(object):
 
         # check if at least one image is available
         if len(raw_images) == 0:
-            return None
+            return None, None
 
-        record_data['images'] = raw_images
+        # don't store the images in 'record_data' to not keep them in memory
+        with self.timings.time('serialize'):
+            serialized_record = self.tfr_encoder(
+                {**record_data, 'images': raw_images})
 
-        serialized_record = self.tfr_encoder(record_data)
+        record_info = {
+            'n_images': len(raw_images),
+            'labels': {k[len('label/'):]: v for k, v in record_data.items()
+                       if k.startswith('label/')}}
 
-        return serialized_record
+        return serialized_record, record_info
 
     def _write_to_file(self, output_file, record_ids):
         """ Write a TFR File """
 
         # Create and Write Records to TFRecord file
-        logger.info("Start Writing %s" % output_file)
-        n_records = len(record_ids)
-        successfull_writes = 0
-        start_time = time.time()
+        record_ids = self._shuffle_record_ids(record_ids)
+        tfr_file = self._open_file(output_file, len(record_ids))
 
-        # Randomly shuffle records before saving, this is better for
-        # model training
-        if self.random_shuffle_before_save:
-            random.seed(123)
-            random.shuffle(record_ids)
-
-        # temporary filename for writing to avoid complications after
-        # a write is incomplete
-
-        output_temp = output_file + '_temp'
-        with tf.python_io.TFRecordWriter(output_temp) as writer:
-
-            for i, record_id in enumerate(record_ids):
-
-                if i % 1000 == 0:
-                    est_t = estimate_remaining_time(start_time, n_records, i)
-                    logger.debug(
-                        "Wrote %s / %s records (estimated time remaining: %s)"
-                        % (i, n_records, est_t))
-
-                record_data = self.tfrecord_dict[record_id]
-
-                serialized_record = self._serialize_record(record_data)
-
-                if serialized_record is None:
-                    logger.debug("Discarding record %s - no image avail" %
-                                 record_id)
-                    continue
-
-                # Write the serialized data to the TFRecords file.
-                writer.write(serialized_record)
-                successfull_writes += 1
-
-        # Rename temporary file
-        os.replace(output_temp, output_file)
-
-        logger.info(
-            "Finished Writing Records to %s - Wrote %s/%s" %
-            (output_file, successfull_writes, n_records))
-
-    def _write_to_file_parallel(self, output_file, record_ids):
-        """ Write a TFR File with parallel image processing """
-
-        # Create and Write Records to TFRecord file
-        logger.info("Start Writing %s" % output_file)
-        n_records = len(record_ids)
-        successfull_writes = 0
-        start_time = time.time()
-
-        # Randomly shuffle records before saving, this is better for
-        # model training
-        if self.random_shuffle_before_save:
-            random.seed(123)
-            random.shuffle(record_ids)
-
-        # divide writes into batches
-        max_batch_size = min(self.process_images_in_parallel_size, n_records)
-        n_batches = (n_records // max_batch_size) \
-            + min(n_records % max_batch_size, 1)
-        slices = slice_generator(n_records, n_batches)
-
-        # temporary filename for writing to avoid complications after
-        # a write is incomplete
-
-        output_temp = output_file + '_temp'
-        with tf.python_io.TFRecordWriter(output_temp) as writer:
-
-            for batch_i, (start_i, end_i) in enumerate(slices):
-
-                # Divide current batch to multiple processes
-                record_batch = [self.tfrecord_dict[x] for x in
-                                record_ids[start_i: end_i]]
-                n_records_in_batch = len(record_batch)
-
-                process_slices = slice_generator(
-                    n_records_in_batch,
-                    self.processes_images_in_parallel_n_processes)
-
-                manager = Manager()
-                serialized_records = manager.list()
+        # skip records processed in an interrupted run
+        if tfr_file.n_processed > 0:
+            processed = set(tfr_file.record_ids).union(tfr_file.failed)
+            record_ids = [x for x in record_ids if x not in processed]
 
-                processes_list = list()
+        for _, record_id, serialized_record, record_info in \
+                self._serialize_stream((None, x) for x in record_ids):
+            tfr_file.write(record_id, serialized_record, record_info)
 
-                for p_i, (batch_start_i, batch_end_i) in enumerate(process_slices):
+        tfr_file.close()
 
-                    process_batch = record_batch[batch_start_i: batch_end_i]
-                    pr = Process(target=self._serialize_record_batch,
-                                 args=(process_batch, serialized_records))
-                    pr.start()
-                    processes_list.append(pr)
-
-                for p in processes_list:
-                    p.join()
-
-                # Write the serialized data to the TFRecords file.
-                for serialized_record in serialized_records:
-                    writer.write(serialized_record)
-                    successfull_writes += 1
-                est_t = estimate_remaining_time(start_time, n_records,
-                                                successfull_writes)
-
-                msg = "Wrote %s / %s records - \
-                       estimated time remaining: %s - file: %s" % \
-                      (successfull_writes, n_records, est_t, output_file)
-
-                logger.debug(textwrap.shorten(msg, width=99))
-
-        # Rename temporary file
-        os.replace(output_temp, output_file)
-
-        logger.info(
-            "Finished Writing Records to %s - Wrote %s/%s" %
-            (output_file, successfull_writes, n_records))
+        if self.write_tfr_in_parallel:
+            self._log_image_stats()
+            self._collect_timings()
+            self.log_timing_report()
+
+    def _record_stream(self, tagged_record_ids):
+        """ Look up the records of a stream of (tag, record_id) and yield
+            (tag, record_id, record_data), with the raw image bytes read
+            ahead if 'image_read_threads' is set
+        """
+        tagged_records = (
+            (tag, record_id, self.tfrecord_dict[record_id])
+            for tag, record_id in tagged_record_ids)
+        if self.image_read_threads is None:
+            return tagged_records
+        prefetcher = ImagePrefetcher(
+            self._read_image_bytes,
+            n_threads=self.image_read_threads,
+            read_ahead=self.image_read_ahead,
+            timings=self.timings)
+        return prefetcher.prefetch(tagged_records)
+
+    def _serialize_stream(self, tagged_record_ids, pool=None):
+        """ Serialize a stream of (tag, record_id) and yield
+            (tag, record_id, serialized_record, record_info) in the same
+            order
+
+            With a 'pool' the records are sent in chunks to its worker
+            processes. At most 'max_records_in_flight' records are being
+            processed at any time and the oldest chunk is yielded as soon
+            as it is ready. This keeps the workers busy across file
+            boundaries and bounds the memory usage independent of the
+            number of records.
+
+            With 'image_read_threads' the raw bytes of the images are read
+            ahead in this process (see _record_stream) and sent to the
+            workers, which then only decode, resize and encode them.
+        """
+        tagged_records = self._record_stream(tagged_record_ids)
+
+        if pool is None:
+            for tag, record_id, record_data in tagged_records:
+                yield (tag, record_id, *self._serialize_record(record_data))
+            return
+
+        n_processes = self.processes_images_in_parallel_n_processes
+        chunk_size = max(
+            self.process_images_in_parallel_size // n_processes, 1)
+        max_chunks_in_flight = max(
+            self.max_records_in_flight // chunk_size, 1)
+
+        tagged_records = iter(tagged_records)
+        in_flight = deque()
+        chunks_exhausted = False
+
+        while True:
+
+            # submit chunks until the maximum is in flight
+            while not chunks_exhausted and \
+                    len(in_flight) < max_chunks_in_flight:
+                chunk = list(islice(tagged_records, chunk_size))
+                if len(chunk) == 0:
+                    chunks_exhausted = True
+                    break
+                record_batch = [x for _, _, x in chunk]
+                result = pool.apply_async(
+                    _serialize_record_batch_in_worker, (record_batch, ))
+                # don't keep the records (and their images) in memory
+                in_flight.append(([x[0:2] for x in chunk], result))
+
+            if len(in_flight) == 0:
+                break
+
+            # Return the serialized data of the oldest chunk
+            chunk, result = in_flight.popleft()
+            with self.timings.time('queue_wait'):
+                serialized_records, image_stats, timings = result.get()
+            self.image_stats.update(image_stats)
+            self.timings.merge(timings)
+
+            for (tag, record_id), (serialized_record, record_info) in zip(
+                    chunk, serialized_records):
+                yield tag, record_id, serialized_record, record_info
+
+    def _write_to_files_parallel(self, files_to_write, pool):
+        """ Write TFR Files with parallel image processing
+
+            'files_to_write' is a list of (output_file, record_ids). The
+            records of all files form one stream which is processed by
+            the worker processes of 'pool' (see _serialize_stream).
+        """
+        def generate_tagged_record_ids():
+            for file_i, (output_file, record_ids) in enumerate(files_to_write):
+                record_ids = self._shuffle_record_ids(record_ids)
+                if self.resume:
+                    processed = _TFRecordFile.read_processed_record_ids(
+                        output_file, self.compression_type)
+                    record_ids = [x for x in record_ids if x not in processed]
+                # ensure that each file is opened and closed
+                if len(record_ids) == 0:
+                    self._open_file(output_file, 0).close()
+                for record_id in record_ids:
+                    yield file_i, record_id
+
+        current_file_i = None
+        tfr_file = None
+
+        for file_i, record_id, serialized_record, record_info in \
+                self._serialize_stream(generate_tagged_record_ids(), pool):
+
+            if file_i != current_file_i:
+                if tfr_file is not None:
+                    tfr_file.close()
+                output_file, record_ids = files_to_write[file_i]
+                tfr_file = self._open_file(
+                    output_file, len(record_ids),
+                    log_every=self.process_images_in_parallel_size)
+                current_file_i = file_i
+
+            tfr_file.write(record_id, serialized_record, record_info)
+
+        if tfr_file is not None:
+            tfr_file.close()
+
+    def _shard_path(self, output_dir, shard_i):
+        """ Path of a file written with 'max_bytes_per_file' """
+        file_name = '%s_%03d.tfrecord' % (self.file_prefix, shard_i + 1)
+        return os.path.join(output_dir, file_name)
+
+    def _shards_progress_path(self, output_dir):
+        """ Path of the completed files of an interrupted run with
+            'max_bytes_per_file'
+        """
+        return os.path.join(
+            output_dir, '%s_shards_progress.json' % self.file_prefix)
+
+    def _find_shards(self, output_dir):
+        """ Sorted paths of all files written with 'max_bytes_per_file' """
+        pattern = re.compile(
+            r'^%s_(\d{3,})\.tfrecord$' % re.escape(self.file_prefix))
+        shards = [x for x in os.listdir(output_dir) if pattern.match(x)]
+        shards.sort(key=lambda x: int(pattern.match(x).group(1)))
+        return [os.path.join(output_dir, x) for x in shards]
+
+    def _read_shards_progress(self, shards_progress_file):
+        """ Read the completed files of an interrupted run """
+        if not os.path.exists(shards_progress_file):
+            return list()
+        with open(shards_progress_file, 'r') as f:
+            completed = json.load(f)
+        # only trust files which still exist
+        for i, shard in enumerate(completed):
+            if not os.path.exists(shard['output_file']):
+                return completed[0:i]
+        return completed
+
+    def _write_to_files_by_size(self, output_dir, record_ids,
+                                max_bytes_per_file, pool=None):
+        """ Write records to files of about 'max_bytes_per_file' bytes
+
+            The records are written in one stream and the current file is
+            closed as soon as it reaches 'max_bytes_per_file', hence files
+            exceed it by at most one record. The ids of completed files
+            are recorded to resume interrupted runs.
+        """
+        record_ids = self._shuffle_record_ids(record_ids)
+        shards_progress_file = self._shards_progress_path(output_dir)
+
+        completed = list()
+        if self.resume:
+            completed = self._read_shards_progress(shards_progress_file)
+
+        processed = set()
+        for shard in completed:
+            processed.update(shard['record_ids'])
+            self.files[self.file_prefix].append(shard['output_file'])
+        if len(completed) > 0:
+            logger.info("Resume Writing %s - found %s completed files" %
+                        (self.file_prefix, len(completed)))
+
+        # the file which was being written when the run was interrupted
+        next_shard = self._shard_path(output_dir, len(completed))
+        resume_next_shard = self.resume and _TFRecordFile.read_progress(
+            next_shard, self.compression_type) is not None
+        if resume_next_shard:
+            processed.update(_TFRecordFile.read_processed_record_ids(
+                next_shard, self.compression_type))
+
+        record_ids = [x for x in record_ids if x not in processed]
+        log_every = self.process_images_in_parallel_size \
+            if pool is not None else 1000
+
+        def open_next_shard():
+            output_file = self._shard_path(output_dir, len(completed))
+            self.files[self.file_prefix].append(output_file)
+            # the number of records of a file is not known in advance
+            return self._open_file(output_file, None, log_every=log_every)
+
+        def close_shard(tfr_file):
+            tfr_file.close()
+            completed.append({
+                'output_file': tfr_file.output_file,
+                'record_ids': tfr_file.record_ids + tfr_file.failed})
+            _write_json_atomic(completed, shards_progress_file)
+
+        tfr_file = None
+        if resume_next_shard:
+            tfr_file = open_next_shard()
+
+        for _, record_id, serialized_record, record_info in \
+                self._serialize_stream(
+                    ((None, x) for x in record_ids), pool):
+            if tfr_file is None:
+                tfr_file = open_next_shard()
+            # roll over to a new file (never for failed records to not
+            # create files without any records)
+            elif serialized_record is not None and \
+                    tfr_file.n_bytes >= max_bytes_per_file:
+                close_shard(tfr_file)
+                tfr_file = open_next_shard()
+            tfr_file.write(record_id, serialized_record, record_info)
+
+        if tfr_file is not None:
+            close_shard(tfr_file)
+
+        # remove files of previous runs with more files
+        for shard in self._find_shards(output_dir)[len(completed):]:
+            logger.info("Removing outdated file %s" % shard)
+            os.remove(shard)
+            if os.path.exists(tfr_index_path(shard)):
+                os.remove(tfr_index_path(shard))
+
+        if os.path.exists(shards_progress_file):
+            os.remove(shards_progress_file)
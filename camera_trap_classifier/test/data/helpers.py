@@ -0,0 +1,33 @@
+""" Fixtures Shared by the Tests of Writing and Reading TFRecord Files """
+from camera_trap_classifier.data.stage_timer import StageTimer
+
+
+class DummyCodec(object):
+    """ Codec that returns the path of an image as image """
+    def read_file(self, path_to_image):
+        if 'missing' in path_to_image:
+            raise FileNotFoundError(path_to_image)
+        return path_to_image.encode('utf-8')
+
+    def encode(self, file_bytes):
+        return file_bytes
+
+    def read_and_encode(self, path_to_image):
+        return self.encode(self.read_file(path_to_image))
+
+    def pop_stats(self):
+        return dict()
+
+    def pop_timings(self):
+        return StageTimer()
+
+
+def encode_record(record_data):
+    """ Serialize a record to the concatenation of its images """
+    return b''.join(record_data['images'])
+
+
+def encode_record_with_id(record_data):
+    """ Serialize a record to its id and images """
+    return b'|'.join([record_data['id'].encode('utf-8')] +
+                     record_data['images'])
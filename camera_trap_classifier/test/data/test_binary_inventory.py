@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from camera_trap_classifier.data.importer import DatasetImporter
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.label_filter import LabelFilter
+from camera_trap_classifier.data.binary_inventory import (
+    write_binary_inventory, read_binary_inventory, is_binary_inventory)
+
+
+class BinaryInventoryTests(unittest.TestCase):
+    """ Test Writing and Reading Binary Inventory Files """
+
+    def setUp(self):
+        params = {'path': './test/test_files/json_data_file.json'}
+        self.records = DatasetImporter.create(
+            'json', params).import_from_source()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'inventory.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testRoundTrip(self):
+        write_binary_inventory(self.records, self.path)
+        self.assertTrue(is_binary_inventory(self.path))
+        self.assertEqual(dict(read_binary_inventory(self.path).items()),
+                         self.records)
+
+    def testNotBinary(self):
+        self.assertFalse(
+            is_binary_inventory('./test/test_files/json_data_file.json'))
+
+    def testRemovedRecordsNotWritten(self):
+        dinv = DatasetInventoryMaster(columnar=True)
+        dinv.create_from_source(
+            'json', {'path': './test/test_files/json_data_file.json'})
+        dinv.remove_record('is_elephant')
+        dinv.export_to_binary(self.path)
+        self.records.pop('is_elephant')
+        self.assertEqual(dict(read_binary_inventory(self.path).items()),
+                         self.records)
+
+    def testModifyLoadedInventory(self):
+        write_binary_inventory(self.records, self.path)
+        dinv = DatasetInventoryMaster()
+        dinv.create_from_source('binary', {'path': self.path})
+        dinv.apply_label_filter(LabelFilter().keep_label('class', 'cat'))
+        self.assertNotIn('is_elephant', dinv.data_inventory)
+        new_record = {'labels': [{'class': 'zebra'}],
+                      'images': ['/images/zebra.jpg']}
+        dinv.data_inventory['new_record'] = new_record
+        self.assertEqual(dinv.data_inventory['new_record'], new_record)
+        self.assertEqual(dinv.data_inventory['counts_is_12'],
+                         self.records['counts_is_12'])
+
+    def testRemapLoadedInventory(self):
+        write_binary_inventory(self.records, self.path)
+        dinv = DatasetInventoryMaster()
+        dinv.create_from_source('binary', {'path': self.path})
+        n_cats = dinv._calc_label_stats()['class']['cat']
+        dinv.remap_labels({'class': {'cat': 'animal'}})
+        self.assertEqual(
+            dinv.data_inventory['counts_is_12']['labels'][0]['class'],
+            'animal')
+        dinv.data_inventory['new_record'] = {
+            'labels': [{'class': 'animal'}], 'images': []}
+        self.assertEqual(dinv._calc_label_stats()['class']['animal'],
+                         n_cats + 1)
+        self.assertEqual(
+            dinv.data_inventory['counts_is_12']['labels'][0]['class'],
+            'animal')
+
+    def testEmptyInventory(self):
+        write_binary_inventory(dict(), self.path)
+        self.assertEqual(len(read_binary_inventory(self.path)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
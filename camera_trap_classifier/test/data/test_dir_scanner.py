@@ -0,0 +1,95 @@
+""" Test Directory Scanner """
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from camera_trap_classifier.data.dir_scanner import DirectoryScanner
+
+
+class DirectoryScannerTests(unittest.TestCase):
+    """ Test listing directory trees """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image_dir = os.path.join(self.tmp_dir, 'images')
+        self.cache_path = os.path.join(self.tmp_dir, 'listing.json')
+        for site in ['site_a', 'site_b']:
+            for camera in ['cam_1', 'cam_2']:
+                camera_dir = os.path.join(self.image_dir, site, camera)
+                os.makedirs(camera_dir)
+                for i in range(0, 3):
+                    self._create_file(
+                        os.path.join(camera_dir, 'img%s.JPG' % i))
+                self._create_file(os.path.join(camera_dir, 'notes.txt'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_file(self, path):
+        open(path, 'w').close()
+
+    def _age_directories(self, seconds=60):
+        """ Set the modification time of all directories into the past """
+        past = time.time() - seconds
+        for root, _, _ in os.walk(self.image_dir):
+            os.utime(root, (past, past))
+
+    def testListFiles(self):
+        scanner = DirectoryScanner(n_threads=4)
+        files = scanner.list_files(self.image_dir, ext=('.jpg', ))
+        expected = sorted(
+            os.path.join(root, f)
+            for root, _, fs in os.walk(self.image_dir)
+            for f in fs if f.endswith('.JPG'))
+        self.assertEqual(files, expected)
+        self.assertEqual(len(files), 12)
+
+    def testPathsAsOsWalk(self):
+        # '-' sorts before '/'
+        os.makedirs(os.path.join(self.image_dir, 'site_a-b'))
+        self._create_file(os.path.join(self.image_dir, 'site_a-b', 'x.jpg'))
+        directory = os.path.join(
+            os.curdir, os.path.relpath(self.image_dir), '')
+        files = DirectoryScanner(n_threads=4).list_files(directory)
+        expected = sorted(
+            os.path.join(root, f)
+            for root, _, fs in os.walk(directory) for f in fs)
+        self.assertEqual(files, expected)
+        self.assertTrue(files[0].startswith(directory))
+
+    def testMaxDepth(self):
+        scanner = DirectoryScanner(n_threads=4)
+        listings = scanner.scan(self.image_dir, max_depth=1)
+        self.assertEqual(len(listings), 3)
+        self.assertEqual(listings[self.image_dir]['dirs'],
+                         ['site_a', 'site_b'])
+
+    def testRescanUsesCache(self):
+        self._age_directories()
+        DirectoryScanner(cache_path=self.cache_path).scan(self.image_dir)
+        # add a file to a directory and re-scan
+        changed_dir = os.path.join(self.image_dir, 'site_b', 'cam_1')
+        new_file = os.path.join(changed_dir, 'new.jpg')
+        self._create_file(new_file)
+        os.utime(changed_dir, (time.time() - 30, time.time() - 30))
+        scanner = DirectoryScanner(cache_path=self.cache_path)
+        n_listed = list()
+        list_dir = scanner._list_dir
+
+        def count_listed(dir_path):
+            listing, is_cached = list_dir(dir_path)
+            if not is_cached:
+                n_listed.append(dir_path)
+            return listing, is_cached
+
+        scanner._list_dir = count_listed
+        files = scanner.list_files(self.image_dir)
+        self.assertIn(new_file, files)
+        self.assertEqual(n_listed, [changed_dir])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -4,7 +4,11 @@ import tensorflow as tf
 from camera_trap_classifier.data.image import (
     _mean_image_subtraction,
     _image_standardize,
-    gaussian_kernel_2D
+    gaussian_kernel_2D,
+    preprocess_batch,
+    distort_color_batch,
+    distort_color_fast_batch,
+    decode_jpeg_dct_scaled
     )
 
 
@@ -65,6 +69,83 @@ class ImageStandardizationTests(tf.test.TestCase):
                 self.assertAllEqual(actual.eval(), e)
 
 
+class BatchPreprocessingTests(tf.test.TestCase):
+
+    def setUp(self):
+        self.images = tf.stack([create_rgb_image([0, 100, 200]),
+                                create_rgb_image([50, 150, 250])])
+
+    def testStandardizeBatch(self):
+        means = [0.5, 0.5, 0.5]
+        stdevs = [0.1, 0.2, 0.3]
+        with self.test_session():
+            expected = tf.stack([
+                _image_standardize(self.images[i] / 255.0, means, stdevs)
+                for i in range(0, 2)])
+            actual = preprocess_batch(
+                self.images, is_training=False,
+                image_means=means, image_stdevs=stdevs)
+            self.assertAllClose(actual.eval(), expected.eval())
+
+    def testPreprocessBatchTraining(self):
+        with self.test_session():
+            for color_augmentation in [None, 'little', 'full_fast',
+                                       'full_randomized']:
+                actual = preprocess_batch(
+                    self.images, is_training=True,
+                    color_augmentation=color_augmentation).eval()
+                self.assertEqual(actual.shape, (2, 2, 2, 3))
+                self.assertTrue((actual >= 0).all() and (actual <= 1).all())
+
+    def testDistortColorBatch(self):
+        images = self.images / 255.0
+        with self.test_session():
+            for ordering in range(0, 4):
+                for fast_mode in [True, False]:
+                    actual = distort_color_batch(
+                        images, ordering, fast_mode).eval()
+                    self.assertEqual(actual.shape, (2, 2, 2, 3))
+                    self.assertTrue(
+                        (actual >= 0).all() and (actual <= 1).all())
+            actual = distort_color_fast_batch(images).eval()
+            self.assertEqual(actual.shape, (2, 2, 2, 3))
+
+
+class DecodeJpegScaledTests(tf.test.TestCase):
+    """ cat0.jpg has 374 x 500 pixels """
+
+    def setUp(self):
+        with open('./test/test_images/Cats/cat0.jpg', 'rb') as f:
+            self.image_bytes = tf.constant(f.read())
+
+    def testDecodeScaled(self):
+        with self.test_session():
+            for min_size, expected_shape in [
+                    (300, (374, 500, 3)),
+                    (100, (187, 250, 3)),
+                    (40, (47, 63, 3))]:
+                image = decode_jpeg_dct_scaled(
+                    self.image_bytes, min_size, min_size)
+                self.assertEqual(image.eval().shape, expected_shape)
+
+    def testDecodeCroppedToAspectRatio(self):
+        with self.test_session():
+            for min_size, expected_shape in [
+                    (300, (374, 374, 3)),
+                    (100, (187, 187, 3))]:
+                image = decode_jpeg_dct_scaled(
+                    self.image_bytes, min_size, min_size,
+                    crop_to_aspect_ratio=True)
+                self.assertEqual(image.eval().shape, expected_shape)
+
+    def testDecodeNonJpegAtFullSize(self):
+        png_bytes = tf.image.encode_png(
+            tf.zeros([50, 80, 3], dtype=tf.uint8))
+        with self.test_session():
+            image = decode_jpeg_dct_scaled(png_bytes, 10, 10, channels=3)
+            self.assertEqual(image.eval().shape, (50, 80, 3))
+
+
 class GaussianKernelTests(tf.test.TestCase):
 
     def testGaussianKernelWikiExample(self):
@@ -0,0 +1,115 @@
+""" Test Image Cache """
+import os
+import shutil
+import tempfile
+import unittest
+
+from camera_trap_classifier.data.image_cache import ImageCache
+
+
+class DummyCodec(object):
+    """ Codec that counts how many images it encodes """
+    def __init__(self, smallest_side):
+        self.smallest_side = smallest_side
+        self.n_encoded = 0
+
+    def cache_key(self):
+        return 'dummy:%s' % self.smallest_side
+
+    def read_file(self, path_to_image):
+        with open(path_to_image, 'rb') as f:
+            return f.read()
+
+    def stat_file(self, path_to_image):
+        if path_to_image.startswith('gs://'):
+            return 1, 10
+        stat = os.stat(path_to_image)
+        return stat.st_mtime_ns, stat.st_size
+
+    def encode(self, file_bytes):
+        self.n_encoded += 1
+        return file_bytes[::-1]
+
+
+class ImageCacheTests(unittest.TestCase):
+    """ Test caching of processed images """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.image_path = os.path.join(self.tmp_dir, 'image.jpg')
+        with open(self.image_path, 'wb') as f:
+            f.write(b'0123456789')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testHitAfterMiss(self):
+        cache = ImageCache(self.cache_dir)
+        codec = DummyCodec(100)
+        first = cache.get_or_create(self.image_path, codec)
+        second = cache.get_or_create(self.image_path, codec)
+        self.assertEqual(first, b'9876543210')
+        self.assertEqual(first, second)
+        self.assertEqual(codec.n_encoded, 1)
+        stats = cache.pop_stats()
+        self.assertEqual(stats['cache_miss'], 1)
+        self.assertEqual(stats['cache_hit'], 1)
+
+    def testContains(self):
+        cache = ImageCache(self.cache_dir)
+        codec = DummyCodec(100)
+        self.assertFalse(cache.contains(self.image_path, codec))
+        cache.get_or_create(self.image_path, codec)
+        self.assertTrue(cache.contains(self.image_path, codec))
+        self.assertFalse(cache.contains(self.image_path, DummyCodec(200)))
+        self.assertEqual(cache.pop_stats()['cache_hit'], 0)
+
+    def testRemotePaths(self):
+        cache = ImageCache(self.cache_dir)
+        self.assertEqual(
+            cache.source_key('gs://bucket/image.jpg', DummyCodec(100)),
+            'gs://bucket/image.jpg:1:10')
+
+    def testCodecSettingsAreKeyed(self):
+        cache = ImageCache(self.cache_dir)
+        cache.get_or_create(self.image_path, DummyCodec(100))
+        codec = DummyCodec(200)
+        cache.get_or_create(self.image_path, codec)
+        self.assertEqual(codec.n_encoded, 1)
+
+    def testContentHash(self):
+        cache = ImageCache(self.cache_dir, hash_content=True)
+        codec = DummyCodec(100)
+        cache.get_or_create(self.image_path, codec)
+        copy_path = os.path.join(self.tmp_dir, 'copy.jpg')
+        shutil.copyfile(self.image_path, copy_path)
+        cache.get_or_create(copy_path, codec)
+        self.assertEqual(codec.n_encoded, 1)
+
+    def testEviction(self):
+        cache = ImageCache(self.cache_dir, max_size_bytes=25)
+        codec = DummyCodec(100)
+        for i in range(0, 5):
+            path = os.path.join(self.tmp_dir, 'image_%s.jpg' % i)
+            with open(path, 'wb') as f:
+                f.write(b'0123456789')
+            cache.get_or_create(path, codec)
+        self.assertEqual(cache.size(), 50)
+        cache.evict()
+        self.assertLessEqual(cache.size(), 25)
+
+    def testEvictionEveryNEntries(self):
+        cache = ImageCache(self.cache_dir, max_size_bytes=25, evict_every=2)
+        codec = DummyCodec(100)
+        for i in range(0, 4):
+            path = os.path.join(self.tmp_dir, 'image_%s.jpg' % i)
+            with open(path, 'wb') as f:
+                f.write(b'0123456789')
+            cache.get_or_create(path, codec)
+        self.assertLessEqual(cache.size(), 25)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
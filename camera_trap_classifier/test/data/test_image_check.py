@@ -0,0 +1,90 @@
+""" Test Image Check """
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from camera_trap_classifier.data.image_check import (
+    ImageChecker, probe_image)
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.columnar_inventory import ColumnarInventory
+
+
+class ImageCheckTests(unittest.TestCase):
+    """ Test checking images before writing TFRecord files """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        shutil.copy('./test/test_images/Cats/cat0.jpg',
+                    os.path.join(self.tmp_dir, 'ok.jpg'))
+        open(os.path.join(self.tmp_dir, 'empty.jpg'), 'w').close()
+        with open(os.path.join(self.tmp_dir, 'text.jpg'), 'w') as f:
+            f.write('not an image')
+        # the frame header of cat0.jpg starts after 158 bytes
+        with open('./test/test_images/Cats/cat0.jpg', 'rb') as f:
+            jpeg_bytes = f.read()
+        with open(os.path.join(self.tmp_dir, 'truncated.jpg'), 'wb') as f:
+            f.write(jpeg_bytes[0:100])
+        # start of scan without a frame header
+        with open(os.path.join(self.tmp_dir, 'no_sof.jpg'), 'wb') as f:
+            f.write(jpeg_bytes[0:20] + b'\xff\xda\x00\x08' + b'\x00' * 50)
+        self.records = {
+            'all_ok': {'labels': [{'class': 'cat'}],
+                       'images': ['ok.jpg']},
+            'one_missing': {'labels': [{'class': 'cat'}],
+                            'images': ['ok.jpg', 'missing.jpg']},
+            'none_ok': {'labels': [{'class': 'dog'}],
+                        'images': ['empty.jpg', 'text.jpg']}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testProbeImage(self):
+        self.assertIsNone(probe_image(os.path.join(self.tmp_dir, 'ok.jpg')))
+        self.assertEqual(
+            probe_image(os.path.join(self.tmp_dir, 'missing.jpg')), 'missing')
+        self.assertEqual(
+            probe_image(os.path.join(self.tmp_dir, 'empty.jpg')), 'empty')
+        self.assertEqual(
+            probe_image(os.path.join(self.tmp_dir, 'text.jpg')),
+            'unknown image format')
+        for name in ['truncated.jpg', 'no_sof.jpg']:
+            self.assertEqual(
+                probe_image(os.path.join(self.tmp_dir, name)),
+                'invalid jpeg header')
+
+    def testCheckPaths(self):
+        checker = ImageChecker(n_threads=2, image_root_path=self.tmp_dir,
+                               batch_size=2)
+        failed = checker.check_paths(
+            ['ok.jpg', '/missing.jpg', 'empty.jpg', 'text.jpg', 'ok.jpg'])
+        self.assertEqual(set(failed.keys()),
+                         {'/missing.jpg', 'empty.jpg', 'text.jpg'})
+
+    def _check_pruned(self, data_inventory):
+        report_path = os.path.join(self.tmp_dir, 'report.json')
+        dinv = DatasetInventoryMaster()
+        dinv.data_inventory = data_inventory
+        report = dinv.remove_unreadable_images(
+            image_root_path=self.tmp_dir, n_threads=2,
+            report_path=report_path)
+        self.assertEqual(dict(dinv.data_inventory.items()), {
+            'all_ok': {'labels': [{'class': 'cat'}], 'images': ['ok.jpg']},
+            'one_missing': {'labels': [{'class': 'cat'}],
+                            'images': ['ok.jpg']}})
+        self.assertEqual(report['n_images_failed'], 3)
+        self.assertEqual(report['removed_records'], ['none_ok'])
+        self.assertEqual(report['n_records_modified'], 1)
+        with open(report_path, 'r') as f:
+            self.assertEqual(json.load(f), report)
+
+    def testPruneInventory(self):
+        self._check_pruned(self.records)
+
+    def testPruneColumnarInventory(self):
+        self._check_pruned(ColumnarInventory.from_dict(self.records))
+
+
+if __name__ == '__main__':
+    unittest.main()
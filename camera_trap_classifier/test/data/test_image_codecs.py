@@ -0,0 +1,68 @@
+""" Test Image Codecs """
+import unittest
+from io import BytesIO
+
+from camera_trap_classifier.data.image_codecs import (
+    ImageCodec, read_jpeg_header, smallest_size_at_least, Image)
+
+
+class JpegHeaderTests(unittest.TestCase):
+    """ Test reading jpeg headers """
+
+    def setUp(self):
+        path = './test/test_images/Cats/cat0.jpg'
+        with open(path, 'rb') as f:
+            self.jpeg_bytes = f.read()
+
+    def testReadDimensions(self):
+        header = read_jpeg_header(self.jpeg_bytes)
+        self.assertEqual(header.height, 374)
+        self.assertEqual(header.width, 500)
+        self.assertEqual(header.n_components, 3)
+
+    def testInvalidJpeg(self):
+        self.assertIsNone(read_jpeg_header(b'not a jpeg'))
+        self.assertIsNone(read_jpeg_header(b''))
+        self.assertIsNone(read_jpeg_header(self.jpeg_bytes[0:20]))
+
+
+class SmallestSizeTests(unittest.TestCase):
+    """ Test aspect preserving size calculation """
+
+    def testSmallestSize(self):
+        self.assertEqual(smallest_size_at_least(374, 500, 187), (187, 250))
+        self.assertEqual(smallest_size_at_least(500, 374, 187), (250, 187))
+        self.assertEqual(smallest_size_at_least(100, 100, 50), (50, 50))
+
+
+@unittest.skipIf(Image is None, "requires Pillow")
+class PillowCodecTests(unittest.TestCase):
+    """ Test the Pillow Codec """
+
+    def setUp(self):
+        self.path = './test/test_images/Cats/cat0.jpg'
+        with open(self.path, 'rb') as f:
+            self.jpeg_bytes = f.read()
+
+    def testResize(self):
+        codec = ImageCodec.create('pillow', {'smallest_side': 187})
+        image = Image.open(BytesIO(codec.read_and_encode(self.path)))
+        self.assertEqual(image.size, (250, 187))
+        self.assertEqual(codec.pop_stats()['re_encoded'], 1)
+
+    def testPassthroughSmallJpeg(self):
+        codec = ImageCodec.create('pillow', {'smallest_side': 374})
+        self.assertEqual(codec.read_and_encode(self.path), self.jpeg_bytes)
+        stats = codec.pop_stats()
+        self.assertEqual(stats['jpeg_passthrough'], 1)
+        self.assertEqual(stats['re_encoded'], 0)
+
+    def testDisablePassthrough(self):
+        codec = ImageCodec.create('pillow', {'smallest_side': 374,
+                                             'jpeg_passthrough': False})
+        self.assertNotEqual(codec.read_and_encode(self.path), self.jpeg_bytes)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
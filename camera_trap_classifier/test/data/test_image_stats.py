@@ -0,0 +1,80 @@
+""" Test Image Stats """
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from camera_trap_classifier.data.image_stats import (
+    RunningMoments, image_stats_cache_key, read_cached_image_stats,
+    write_cached_image_stats)
+
+
+class RunningMomentsTests(unittest.TestCase):
+    """ Test merging moments of batches """
+
+    def setUp(self):
+        random = np.random.RandomState(123)
+        self.images = random.uniform(
+            0, 1, size=(50, 8, 6, 3)) * [1.0, 0.5, 0.25] + [0, 0.1, 1000]
+
+    def testSameAsNumpy(self):
+        moments = RunningMoments()
+        for start, end in [(0, 1), (1, 20), (20, 21), (21, 50)]:
+            moments.update_from_images(self.images[start:end])
+        np.testing.assert_allclose(
+            moments.means, np.mean(self.images, axis=(0, 1, 2)))
+        np.testing.assert_allclose(
+            moments.stdevs, np.std(self.images, axis=(0, 1, 2)))
+        self.assertEqual(moments.count, 50 * 8 * 6)
+
+    def testMerge(self):
+        first = RunningMoments()
+        first.update_from_images(self.images[:10])
+        second = RunningMoments()
+        second.update_from_images(self.images[10:])
+        empty = RunningMoments()
+        first.merge(second)
+        first.merge(empty)
+        np.testing.assert_allclose(
+            first.stdevs, np.std(self.images, axis=(0, 1, 2)))
+
+
+class CachedImageStatsTests(unittest.TestCase):
+    """ Test caching image stats """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tfr_file = os.path.join(self.tmp_dir, 'train.tfrecord')
+        with open(self.tfr_file, 'wb') as f:
+            f.write(b'records')
+        self.path = os.path.join(self.tmp_dir, 'image_stats.json')
+        self.moments = RunningMoments()
+        self.moments.update_from_images(np.ones((2, 2, 2, 3)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testReadWrite(self):
+        key = image_stats_cache_key(
+            [self.tfr_file], output_height=224, sample_rate=1.0)
+        self.assertIsNone(read_cached_image_stats(self.path, key))
+        write_cached_image_stats(self.path, key, self.moments)
+        cached = read_cached_image_stats(self.path, key)
+        self.assertEqual(cached['image_means'], [1.0, 1.0, 1.0])
+        self.assertEqual(cached['image_stdevs'], [0.0, 0.0, 0.0])
+
+    def testOtherSettingsOrFiles(self):
+        key = image_stats_cache_key([self.tfr_file], output_height=224)
+        write_cached_image_stats(self.path, key, self.moments)
+        other_key = image_stats_cache_key([self.tfr_file], output_height=299)
+        self.assertIsNone(read_cached_image_stats(self.path, other_key))
+        with open(self.tfr_file, 'ab') as f:
+            f.write(b'more records')
+        key = image_stats_cache_key([self.tfr_file], output_height=224)
+        self.assertIsNone(read_cached_image_stats(self.path, key))
+
+
+if __name__ == '__main__':
+    unittest.main()
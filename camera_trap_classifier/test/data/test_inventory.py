@@ -1,6 +1,8 @@
 import unittest
 from camera_trap_classifier.data.inventory import (
     DatasetInventoryMaster)
+from camera_trap_classifier.data.importer import DatasetImporter
+from camera_trap_classifier.data.columnar_inventory import ColumnarInventory
 
 
 class DataInventoryTests(unittest.TestCase):
@@ -66,6 +68,63 @@ class DataInventoryTests(unittest.TestCase):
         self.assertNotIn("missing_counts_label",  self.inventory)
         self.assertIn("counts_is_12",  self.inventory)
 
+    def testRemapLabels(self):
+        n_cats = self.dinv._calc_label_stats()['class']['cat']
+        n_dogs = self.dinv._calc_label_stats()['class']['dog']
+        self.dinv.remap_labels({'class': {'cat': 'animal', 'dog': 'animal'},
+                                'not_a_label': {'cat': 'dog'}})
+        self.assertIs(self.dinv.data_inventory, self.inventory)
+        self.assertEqual(
+            self.inventory['multi_species_standard']['labels'],
+            [{"class": "animal", "color_brown": "1", "color_white": "0",
+              "counts": "1"},
+             {"class": "animal", "color_brown": "1", "color_white": "0",
+              "counts": "2"}])
+        self.assertEqual(self.inventory['is_elephant']['labels'][0]['class'],
+                         'elephant')
+        class_stats = self.dinv._calc_label_stats()['class']
+        self.assertEqual(class_stats['animal'], n_cats + n_dogs)
+        self.assertNotIn('cat', class_stats)
+
+
+class ColumnarDataInventoryTests(DataInventoryTests):
+    """ Test Dataset Inventory backed by a ColumnarInventory """
+
+    def setUp(self):
+        path = './test/test_files/json_data_file.json'
+        source_type = 'json'
+        params = {'path': path}
+        self.dinv = DatasetInventoryMaster(columnar=True)
+        self.dinv.create_from_source(source_type, params)
+        self.inventory = self.dinv.data_inventory
+        self.records = DatasetImporter.create(
+            source_type, params).import_from_source()
+
+    def testSameRecords(self):
+        self.assertIsInstance(self.inventory, ColumnarInventory)
+        self.assertEqual(dict(self.inventory.items()), self.records)
+
+    def testConsumeKeepsOrder(self):
+        records = dict(self.records)
+        consumed = ColumnarInventory.from_dict(records, consume=True)
+        self.assertEqual(len(records), 0)
+        self.assertEqual(
+            list(consumed.items()),
+            list(ColumnarInventory.from_dict(self.records).items()))
+        self.assertEqual(list(consumed.keys()), list(self.records.keys()))
+
+    def testSameLabelStats(self):
+        dict_dinv = DatasetInventoryMaster()
+        dict_dinv.data_inventory = self.records
+        self.assertEqual(self.dinv._calc_label_stats(),
+                         dict_dinv._calc_label_stats())
+        self.assertEqual(self.dinv._get_all_labels(),
+                         dict_dinv._get_all_labels())
+
+    def testStatsExcludeRemovedRecords(self):
+        self.dinv.remove_record('is_elephant')
+        self.assertNotIn('elephant', self.dinv._get_all_labels()['class'])
+
 #    def testTFRecordFormat(self):
 #         self.dinv._get_tfr_record_format('single_species_standard')
 #         self.dinv._get_tfr_record_format('single_species_multi_color')
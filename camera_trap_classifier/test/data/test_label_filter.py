@@ -0,0 +1,73 @@
+import unittest
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.label_filter import LabelFilter
+
+
+class LabelFilterTests(unittest.TestCase):
+    """ Test Batched Label Filtering """
+
+    columnar = False
+
+    def setUp(self):
+        params = {'path': './test/test_files/json_data_file.json'}
+        self.dinv = DatasetInventoryMaster(columnar=self.columnar)
+        self.dinv.create_from_source('json', params)
+        self.inventory = self.dinv.data_inventory
+
+    def testRemoveMultiLabel(self):
+        self.dinv.apply_label_filter(LabelFilter().remove_multi_label())
+        self.assertNotIn('multi_species_standard', self.inventory)
+        self.assertNotIn('multi_species_no_other_attr', self.inventory)
+        self.assertIn('single_species_standard', self.inventory)
+
+    def testExactMatch(self):
+        self.dinv.apply_label_filter(LabelFilter().remove_label('counts', '1'))
+        self.assertNotIn('single_species_standard', self.inventory)
+        self.assertIn('counts_is_12', self.inventory)
+        self.assertIn('no_meta_data', self.inventory)
+
+    def testCombinedFilters(self):
+        label_filter = LabelFilter()
+        label_filter.remove_multi_label()
+        label_filter.remove_label('class', 'elephant')
+        label_filter.remove_missing_label('-1')
+        label_filter.keep_label('class', 'cat')
+        label_filter.keep_label('class', 'elephant')
+        label_filter.keep_label('counts', '2')
+        self.dinv.apply_label_filter(label_filter)
+        self.assertNotIn('is_elephant', self.inventory)
+        self.assertNotIn('missing_counts_label', self.inventory)
+        self.assertNotIn('multi_species_standard', self.inventory)
+        self.assertIn('color_is_white', self.inventory)
+        self.assertIn('single_species_standard', self.inventory)
+        self.assertNotIn('empty_image', self.inventory)
+
+    def testStatsOfRemainingRecords(self):
+        label_filter = LabelFilter()
+        label_filter.remove_multi_label()
+        label_filter.keep_label('class', 'cat')
+        label_stats = self.dinv.apply_label_filter(label_filter)
+        self.assertEqual(label_stats, self.dinv._calc_label_stats())
+        self.assertEqual(list(label_stats['class'].keys()), ['cat'])
+
+    def testUnknownLabel(self):
+        n_records = self.dinv.get_number_of_records()
+        label_filter = LabelFilter()
+        label_filter.remove_label('class', 'not_a_class')
+        label_filter.remove_label('not_a_label', 'cat')
+        self.dinv.apply_label_filter(label_filter)
+        self.assertEqual(self.dinv.get_number_of_records(), n_records)
+
+
+class ColumnarLabelFilterTests(LabelFilterTests):
+    """ Test Batched Label Filtering of a ColumnarInventory """
+
+    columnar = True
+
+    def testFilterAfterRemove(self):
+        self.dinv.remove_record('single_species_standard')
+        label_stats = self.dinv.apply_label_filter(
+            LabelFilter().keep_label('class', 'dog'))
+        self.assertEqual(label_stats, self.dinv._calc_label_stats())
+        self.assertIn('multi_species_standard', self.inventory)
+        self.assertNotIn('single_species_multi_color', self.inventory)
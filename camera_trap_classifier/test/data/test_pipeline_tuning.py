@@ -0,0 +1,48 @@
+""" Test Tuning the Input Pipeline """
+import unittest
+
+from camera_trap_classifier.data.pipeline_tuning import (
+    calibrate, candidate_settings)
+
+
+class CalibrateTests(unittest.TestCase):
+    """ Test choosing the fastest settings """
+
+    def setUp(self):
+        self.candidates = {
+            'num_parallel_calls': [2, 4, 8],
+            'cycle_length': [1, 4],
+            'prefetch_batches': [1, 2]}
+        self.initial_settings = {
+            'num_parallel_calls': 4, 'cycle_length': 4,
+            'prefetch_batches': 1}
+
+    def testChoosesFastestSettings(self):
+        def measure(settings):
+            return settings['num_parallel_calls'] + \
+                   settings['prefetch_batches'] - settings['cycle_length']
+        best, results = calibrate(
+            measure, self.candidates, self.initial_settings)
+        self.assertEqual(best, {'num_parallel_calls': 8, 'cycle_length': 1,
+                                'prefetch_batches': 2})
+        # each combination is measured only once
+        measured = [tuple(sorted(x.items())) for x, _ in results]
+        self.assertEqual(len(measured), len(set(measured)))
+        self.assertEqual(len(results), 5)
+
+    def testKeepsInitialSettingsIfNotSlower(self):
+        best, _ = calibrate(
+            lambda settings: 1.0, self.candidates, self.initial_settings)
+        self.assertEqual(best, self.initial_settings)
+
+    def testCandidateSettings(self):
+        candidates = candidate_settings(n_cpus=4, n_files=3)
+        self.assertEqual(candidates['num_parallel_calls'], [2, 4, 8])
+        self.assertEqual(candidates['cycle_length'], [2, 3])
+        candidates = candidate_settings(n_cpus=1, n_files=1)
+        self.assertEqual(candidates['num_parallel_calls'], [1, 2])
+        self.assertEqual(candidates['cycle_length'], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
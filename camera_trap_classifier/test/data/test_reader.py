@@ -0,0 +1,58 @@
+""" Test Reading TFRecord Files """
+import shutil
+import tempfile
+import unittest
+
+import tensorflow as tf
+
+from camera_trap_classifier.data.writer import DatasetWriter
+from camera_trap_classifier.data.reader import RandomAccessReader
+from camera_trap_classifier.test.data.helpers import (
+    DummyCodec, encode_record_with_id)
+
+
+class RandomAccessReaderTests(unittest.TestCase):
+    """ Test reading records by id """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = {
+            str(i): {'id': str(i), 'image_paths': ['image_%s' % i] * (i % 3)}
+            for i in range(0, 30)}
+        writer = DatasetWriter(encode_record_with_id)
+        writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(),
+            max_records_per_file=10)
+        self.files = writer.files['train']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testReadById(self):
+        with RandomAccessReader(self.files) as reader:
+            # records without images are not written
+            self.assertEqual(len(reader), 20)
+            self.assertNotIn('3', reader)
+            self.assertEqual(reader.read('4'), b'4|image_4')
+            self.assertEqual(reader.read('5'), b'5|image_5|image_5')
+            self.assertRaises(KeyError, reader.read, '3')
+
+    def testReadMany(self):
+        record_ids = ['29', '1', '14']
+        with RandomAccessReader(self.files) as reader:
+            records = reader.read_many(record_ids)
+        self.assertEqual([x.split(b'|')[0] for x in records],
+                         [b'29', b'1', b'14'])
+
+    def testSameAsSequentialRead(self):
+        with RandomAccessReader(self.files) as reader:
+            for tfr_file in self.files:
+                for record in tf.python_io.tf_record_iterator(tfr_file):
+                    record_id = record.split(b'|')[0].decode('utf-8')
+                    self.assertEqual(reader.read(record_id), record)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,77 @@
+""" Test Stage Timer """
+import os
+import csv
+import json
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from camera_trap_classifier.data.stage_timer import StageTimer
+
+
+class StageTimerTests(unittest.TestCase):
+    """ Test collecting durations of processing stages """
+
+    def setUp(self):
+        self.timer = StageTimer()
+        for seconds in [0.001] * 90 + [0.1] * 10:
+            self.timer.add('read', seconds)
+        self.timer.add('write', 0.0000005)
+
+    def testSummary(self):
+        summary = self.timer.summary()
+        self.assertEqual(summary['read']['count'], 100)
+        self.assertAlmostEqual(summary['read']['total_s'], 1.09)
+        self.assertAlmostEqual(summary['read']['min_ms'], 1.0)
+        self.assertAlmostEqual(summary['read']['max_ms'], 100.0)
+        # percentiles are upper bounds of the histogram buckets
+        self.assertGreaterEqual(summary['read']['p50_ms'], 1.0)
+        self.assertLess(summary['read']['p50_ms'], 2.1)
+        self.assertAlmostEqual(summary['read']['p99_ms'], 100.0)
+        self.assertEqual(sum(summary['read']['histogram'].values()), 100)
+        self.assertEqual(summary['write']['histogram'], {'0.001': 1})
+
+    def testMergeAndPop(self):
+        other = StageTimer()
+        other.add('read', 0.5)
+        other.add('decode', 0.01)
+        self.timer.merge(other)
+        popped = self.timer.pop()
+        self.assertEqual(self.timer.summary(), dict())
+        summary = popped.summary()
+        self.assertEqual(summary['read']['count'], 101)
+        self.assertAlmostEqual(summary['read']['max_ms'], 500.0)
+        self.assertEqual(summary['decode']['count'], 1)
+
+    def testTime(self):
+        with self.timer.time('decode'):
+            pass
+        self.assertEqual(self.timer.summary()['decode']['count'], 1)
+
+    def testPickle(self):
+        timer = pickle.loads(pickle.dumps(self.timer))
+        self.assertEqual(timer.summary(), self.timer.summary())
+        timer.add('read', 0.001)
+
+    def testReports(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            json_path = os.path.join(tmp_dir, 'timings.json')
+            csv_path = os.path.join(tmp_dir, 'timings.csv')
+            self.timer.write_json(json_path, wall_time_s=2.0)
+            self.timer.write_csv(csv_path)
+            with open(json_path, 'r') as f:
+                report = json.load(f)
+            self.assertEqual(report['wall_time_s'], 2.0)
+            self.assertEqual(report['stages']['read']['count'], 100)
+            with open(csv_path, 'r') as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual([x['stage'] for x in rows], ['read', 'write'])
+            self.assertEqual(rows[0]['count'], '100')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
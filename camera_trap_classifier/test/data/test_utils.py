@@ -6,6 +6,10 @@ from camera_trap_classifier.data.utils import (
     calc_n_batches_per_epoch,
     clean_input_path,
     randomly_split_dataset,
+    id_to_zero_one,
+    ids_to_zero_one,
+    _assign_zero_one_to_split,
+    _balanced_sampling,
     generate_synthetic_data,
     generate_synthetic_batch
 )
@@ -53,6 +57,50 @@ class RandomSplitterTest(unittest.TestCase):
         self.assertEqual(n_val, 2)
 
 
+class SplitAssignmentTests(unittest.TestCase):
+    """ Test Vectorized Split Assignment """
+
+    def setUp(self):
+        self.ids = [str(i) for i in range(0, 5000)] + \
+                   ['capture_%s' % i for i in range(0, 5000)]
+        self.split_names = ['train', 'test', 'val']
+        self.split_percent = [0.5, 0.3, 0.2]
+
+    def testIdenticalHashValues(self):
+        expected = [id_to_zero_one(x) for x in self.ids]
+        self.assertEqual(ids_to_zero_one(self.ids).tolist(), expected)
+
+    def testIdenticalSplits(self):
+        for split_percent in ([0.5, 0.3, 0.2], [0.1, 0.1, 0.8],
+                              [0, 0.5, 0.5], [0.25, 0.25, 0.5]):
+            expected = {x: _assign_zero_one_to_split(
+                            id_to_zero_one(x), split_percent,
+                            self.split_names)
+                        for x in self.ids}
+            splits = randomly_split_dataset(
+                self.ids, self.split_names, split_percent)
+            self.assertEqual(splits, expected)
+
+    def testBalancedSamplingKeepsGlobalRandomState(self):
+        id_to_label = {x: 'blank' if i % 10 else 'species'
+                       for i, x in enumerate(self.ids)}
+        random.seed(1)
+        expected = random.random()
+        random.seed(1)
+        remaining = _balanced_sampling(id_to_label)
+        self.assertEqual(random.random(), expected)
+        self.assertEqual(len(remaining), 2 * len(self.ids) // 10)
+
+    def testBalancedSplitsOnlyRemainingIds(self):
+        id_to_label = {x: 'blank' if i % 10 else 'species'
+                       for i, x in enumerate(self.ids)}
+        remaining = _balanced_sampling(id_to_label)
+        splits = randomly_split_dataset(
+            self.ids, self.split_names, self.split_percent, True,
+            id_to_label)
+        self.assertEqual(set(splits.keys()), remaining)
+
+
 class IdHasherTests(unittest.TestCase):
     """ Test Hash Function """
     def setUp(self):
@@ -0,0 +1,397 @@
+""" Test Writing TFRecord Files """
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+import tensorflow as tf
+
+from camera_trap_classifier.data.writer import DatasetWriter, _TFRecordFile
+from camera_trap_classifier.data.tfr_index import (
+    read_tfr_index, tfr_index_path)
+from camera_trap_classifier.data.utils import n_records_in_tfr
+from camera_trap_classifier.data.image_cache import ImageCache
+from camera_trap_classifier.test.data.helpers import (
+    DummyCodec, encode_record)
+
+
+class Interrupt(BaseException):
+    """ Interrupts a run like a KeyboardInterrupt """
+
+
+class InterruptingCodec(DummyCodec):
+    """ Codec that interrupts the run when reading the n-th image """
+    def __init__(self, n_reads):
+        self.n_reads = n_reads
+
+    def read_file(self, path_to_image):
+        self.n_reads -= 1
+        if self.n_reads == 0:
+            raise Interrupt()
+        return super(InterruptingCodec, self).read_file(path_to_image)
+
+
+class CountingCodec(DummyCodec):
+    """ Codec that counts how many images it reads """
+    def __init__(self):
+        self.n_reads = 0
+
+    def cache_key(self):
+        return 'counting'
+
+    def stat_file(self, path_to_image):
+        stat = os.stat(path_to_image)
+        return stat.st_mtime_ns, stat.st_size
+
+    def read_file(self, path_to_image):
+        self.n_reads += 1
+        return super(CountingCodec, self).read_file(path_to_image)
+
+
+class StatsCodec(CountingCodec):
+    """ Codec that counts the images it encodes in its stats """
+    def __init__(self):
+        super(StatsCodec, self).__init__()
+        self.stats = Counter()
+
+    def encode(self, file_bytes):
+        self.stats['re_encoded'] += 1
+        return file_bytes
+
+    def pop_stats(self):
+        stats = self.stats
+        self.stats = Counter()
+        return stats
+
+
+class WriteBySizeTests(unittest.TestCase):
+    """ Test splitting records into files by size """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # records with one to four images of 10 bytes each
+        self.records = {
+            str(i): {'image_paths': ['image_%04d' % i] * (1 + i % 4)}
+            for i in range(0, 50)}
+        self.writer = DatasetWriter(encode_record)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read_files(self):
+        files = self.writer.files['train']
+        records = [r for f in files
+                   for r in tf.python_io.tf_record_iterator(f)]
+        return files, records
+
+    def testFilesAreSplitBySize(self):
+        self.writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(),
+            max_bytes_per_file=200)
+        files, records = self._read_files()
+        self.assertEqual(len(records), 50)
+        self.assertGreater(len(files), 1)
+        # files exceed the max by at most one record (4 images + header)
+        for f in files:
+            self.assertLessEqual(os.path.getsize(f), 200 + 40 + 16)
+        self.assertEqual(os.path.basename(files[0]), 'train_001.tfrecord')
+
+    def testProgressOfEachFile(self):
+        with self.assertLogs('camera_trap_classifier.data.writer') as logs:
+            self.writer.encode_to_tfr(
+                self.records, self.tmp_dir, 'train',
+                image_codec=DummyCodec(),
+                max_bytes_per_file=200)
+        finished = [x.split(' - ')[-1] for x in logs.output
+                    if 'Finished Writing' in x]
+        self.assertEqual(
+            sum(int(x[len('Wrote '):]) for x in finished), 50)
+
+    def testOutdatedFilesAreRemoved(self):
+        outdated = os.path.join(self.tmp_dir, 'train_999.tfrecord')
+        open(outdated, 'w').close()
+        self.writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(),
+            max_bytes_per_file=200)
+        self.assertFalse(os.path.exists(outdated))
+
+    def testResumeInterruptedRun(self):
+        with self.assertRaises(Interrupt):
+            self.writer.encode_to_tfr(
+                self.records, self.tmp_dir, 'train',
+                image_codec=InterruptingCodec(n_reads=60),
+                max_bytes_per_file=200,
+                checkpoint_every=2)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp_dir, 'train_001.tfrecord')))
+        self.writer = DatasetWriter(encode_record)
+        self.writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(),
+            max_bytes_per_file=200,
+            checkpoint_every=2,
+            resume=True,
+            overwrite_existing_files=False)
+        _, records = self._read_files()
+        self.assertEqual(len(records), 50)
+        self.assertEqual(len(set(records)), 50)
+
+
+class IndexTests(unittest.TestCase):
+    """ Test the index files written with each TFRecord file """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = {
+            str(i): {'image_paths': ['image_%04d' % i] * (1 + i % 2),
+                     'label/species': ['cat' if i < 4 else 'dog']}
+            for i in range(0, 10)}
+        self.writer = DatasetWriter(encode_record)
+        self.writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(),
+            max_records_per_file=5)
+        self.files = self.writer.files['train']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testIndexContents(self):
+        n_images = 0
+        label_counts = dict()
+        for f in self.files:
+            index = read_tfr_index(f)
+            self.assertEqual(index['n_records'], 5)
+            records = list(tf.python_io.tf_record_iterator(f))
+            for record, offset in zip(records, index['offsets']):
+                with open(f, 'rb') as fh:
+                    fh.seek(offset + 12)
+                    self.assertEqual(fh.read(len(record)), record)
+            n_images += index['n_images']
+            for value, count in index['label_counts']['species'].items():
+                label_counts[value] = label_counts.get(value, 0) + count
+        self.assertEqual(n_images, 15)
+        self.assertEqual(label_counts, {'cat': 4, 'dog': 6})
+
+    def testReadCountsOnly(self):
+        index = read_tfr_index(self.files[0], with_records=False)
+        self.assertEqual(index['n_records'], 5)
+        self.assertNotIn('offsets', index)
+
+    def testCountWithIndex(self):
+        self.assertEqual(n_records_in_tfr(self.files), 10)
+
+    def testStaleIndexIsIgnored(self):
+        with open(self.files[0], 'ab') as f:
+            f.write(b'0')
+        self.assertIsNone(read_tfr_index(self.files[0]))
+        self.assertIsNotNone(read_tfr_index(self.files[1]))
+
+
+class CompressionTests(unittest.TestCase):
+    """ Test writing compressed TFRecord files """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = {
+            str(i): {'image_paths': ['image_%04d' % i]}
+            for i in range(0, 20)}
+        self.writer = DatasetWriter(encode_record)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testGzipFiles(self):
+        self.writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(),
+            max_records_per_file=10,
+            compression_type='GZIP')
+        files = self.writer.files['train']
+        options = tf.python_io.TFRecordOptions('GZIP')
+        for f in files:
+            with open(f, 'rb') as fh:
+                self.assertEqual(fh.read(2), b'\x1f\x8b')
+            records = list(tf.python_io.tf_record_iterator(
+                f, options=options))
+            self.assertEqual(len(records), 10)
+            self.assertEqual(read_tfr_index(f)['compression_type'], 'GZIP')
+        # count by reading the files
+        for f in files:
+            os.remove(tfr_index_path(f))
+        self.assertEqual(
+            n_records_in_tfr(files, compression_type='GZIP'), 20)
+
+
+class CheckpointTests(unittest.TestCase):
+    """ Test checkpointing and resuming interrupted writes """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = {
+            '%02d' % i: {'image_paths': ['image_%04d' % i]}
+            for i in range(0, 20)}
+        self.output_file = os.path.join(
+            self.tmp_dir, 'train_001-of-001.tfrecord')
+        # interrupt while reading the 11th record, the 10th record is
+        # written after the last checkpoint
+        with self.assertRaises(Interrupt):
+            DatasetWriter(encode_record).encode_to_tfr(
+                self.records, self.tmp_dir, 'train',
+                image_codec=InterruptingCodec(n_reads=11),
+                random_shuffle_before_save=False,
+                checkpoint_every=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _resume(self):
+        writer = DatasetWriter(encode_record)
+        writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(),
+            random_shuffle_before_save=False,
+            checkpoint_every=3,
+            resume=True)
+        return list(tf.python_io.tf_record_iterator(self.output_file))
+
+    def testCheckpoints(self):
+        progress_file = _TFRecordFile.progress_path(self.output_file)
+        with open(progress_file, 'r') as f:
+            lines = f.readlines()
+        # a header and only the new records with each checkpoint
+        self.assertEqual(len(lines), 4)
+        for line in lines[1:]:
+            self.assertEqual(len(json.loads(line)['record_ids']), 3)
+        progress = _TFRecordFile.read_progress(self.output_file)
+        self.assertEqual(progress['record_ids'],
+                         ['%02d' % i for i in range(0, 9)])
+        self.assertEqual(progress['offsets'],
+                         [i * 26 for i in range(0, 9)])
+        self.assertEqual(progress['n_bytes'], 9 * 26)
+
+    def testResume(self):
+        records = self._resume()
+        self.assertEqual(
+            records, [('image_%04d' % i).encode('utf-8')
+                      for i in range(0, 20)])
+        self.assertEqual(
+            read_tfr_index(self.output_file)['offsets'],
+            [i * 26 for i in range(0, 20)])
+        self.assertFalse(os.path.exists(
+            _TFRecordFile.progress_path(self.output_file)))
+
+    def testTruncateToLastCheckpoint(self):
+        # partially written record and checkpoint
+        with open(self.output_file + '_temp', 'ab') as f:
+            f.write(b'\x00' * 7)
+        with open(_TFRecordFile.progress_path(self.output_file), 'a') as f:
+            f.write('{"record_ids": ["9"')
+        self.assertEqual(
+            len(_TFRecordFile.read_progress(self.output_file)['record_ids']),
+            9)
+        records = self._resume()
+        self.assertEqual(len(records), 20)
+        self.assertEqual(len(set(records)), 20)
+
+
+class ImagePrefetchTests(unittest.TestCase):
+    """ Test reading images ahead with a pool of threads """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = {
+            str(i): {'image_paths': ['image_%04d' % i, 'missing_%04d' % i]
+                     if i % 3 else ['missing_%04d' % i]}
+            for i in range(0, 30)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, prefix, **kwargs):
+        writer = DatasetWriter(encode_record)
+        writer.encode_to_tfr(
+            self.records, self.tmp_dir, prefix,
+            **{'image_codec': DummyCodec(), **kwargs})
+        return [r for f in writer.files[prefix]
+                for r in tf.python_io.tf_record_iterator(f)]
+
+    def testSameRecords(self):
+        expected = self._write('expected')
+        self.assertEqual(len(expected), 20)
+        self.assertEqual(
+            self._write('prefetched', image_read_threads=4,
+                        image_read_ahead=3),
+            expected)
+
+    def testSameRecordsInParallel(self):
+        expected = self._write('expected')
+        self.assertEqual(
+            self._write('prefetched', image_read_threads=4,
+                        process_images_in_parallel=True,
+                        process_images_in_parallel_size=4,
+                        processes_images_in_parallel_n_processes=2),
+            expected)
+
+    def testTimingReport(self):
+        writer = DatasetWriter(encode_record)
+        writer.encode_to_tfr(
+            self.records, self.tmp_dir, 'train',
+            image_codec=DummyCodec(), image_read_threads=2)
+        report = writer.timing_report()
+        self.assertEqual(report['n_records_written'], 20)
+        self.assertEqual(report['stages']['serialize']['count'], 20)
+        self.assertEqual(report['stages']['read_wait']['count'], 30)
+
+    def testTimingReportOfSeveralCallsInParallel(self):
+        writer = DatasetWriter(encode_record)
+        for prefix in ['train', 'val']:
+            writer.encode_to_tfr(
+                self.records, self.tmp_dir, prefix,
+                image_codec=DummyCodec(),
+                process_images_in_parallel=True,
+                process_images_in_parallel_size=4,
+                processes_images_in_parallel_n_processes=2)
+        report = writer.timing_report()
+        self.assertEqual(report['n_records_written'], 40)
+        self.assertEqual(report['stages']['serialize']['count'], 40)
+
+    def testCachedImagesAreNotRead(self):
+        image_dir = os.path.join(self.tmp_dir, 'images')
+        os.makedirs(image_dir)
+        for i in range(0, 30):
+            open(os.path.join(image_dir, 'image_%04d' % i), 'w').close()
+        image_cache = ImageCache(os.path.join(self.tmp_dir, 'cache'))
+        results = list()
+        for prefix in ['train', 'cached']:
+            codec = CountingCodec()
+            results.append(self._write(
+                prefix, image_codec=codec, image_root_path=image_dir,
+                image_cache=image_cache, image_read_threads=2))
+            results.append(codec.n_reads)
+        self.assertEqual(results[2], results[0])
+        self.assertEqual(results[1], 20)
+        self.assertEqual(results[3], 0)
+
+    def testImageStatsOfCacheAndCodec(self):
+        image_dir = os.path.join(self.tmp_dir, 'images')
+        os.makedirs(image_dir)
+        for i in range(0, 30):
+            open(os.path.join(image_dir, 'image_%04d' % i), 'w').close()
+        with self.assertLogs('camera_trap_classifier.data.writer') as logs:
+            self._write(
+                'train', image_codec=StatsCodec(), image_root_path=image_dir,
+                image_cache=ImageCache(os.path.join(self.tmp_dir, 'cache')))
+        stats = [x.split('Image Stats train: ')[1] for x in logs.output
+                 if 'Image Stats' in x]
+        self.assertEqual(stats, ['cache_miss: 20 / 20 images',
+                                 're_encoded: 20 / 20 images'])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
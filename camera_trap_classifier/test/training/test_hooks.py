@@ -0,0 +1,55 @@
+""" Test Training Hooks """
+import os
+import json
+import time
+import shutil
+import tempfile
+
+import tensorflow as tf
+
+from camera_trap_classifier.training.hooks import EpochTimer
+
+
+class EpochTimerTests(tf.test.TestCase):
+    """ Test measuring the time of epochs """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testReport(self):
+        report_path = os.path.join(self.tmp_dir, 'epoch_times.json')
+        timer = EpochTimer(report_path=report_path)
+        for epoch in range(0, 3):
+            timer.on_epoch_begin(epoch)
+            for batch in range(0, 2):
+                timer.on_batch_end(batch)
+            timer.on_epoch_end(epoch)
+        report = timer.report()
+        self.assertEqual([x['epoch'] for x in report['epochs']], [0, 1, 2])
+        self.assertIsNotNone(report['val_s_saved_per_epoch'])
+        with open(report_path, 'r') as f:
+            self.assertEqual(json.load(f)['epochs'], report['epochs'])
+
+    def testValidationTimeWithTestHooks(self):
+        timer = EpochTimer()
+        timer.on_epoch_begin(0)
+        timer.on_batch_end(0)
+        timer.on_test_begin()
+        timer.on_test_end()
+        # the epoch end of other callbacks is not measured
+        time.sleep(0.05)
+        timer.on_epoch_end(0)
+        self.assertLess(timer.report()['epochs'][0]['val_s'], 0.05)
+
+    def testNoSavingsAfterOneEpoch(self):
+        timer = EpochTimer()
+        timer.on_epoch_begin(0)
+        timer.on_epoch_end(0)
+        self.assertIsNone(timer.report()['val_s_saved_per_epoch'])
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -23,17 +23,17 @@ ctc.train \
 -optimizer sgd
 """
 import argparse
+import glob
 import logging
 import os
 import textwrap
 
 import tensorflow as tf
-import numpy as np
 from tensorflow.python.keras.callbacks import (
     TensorBoard, EarlyStopping, CSVLogger, ReduceLROnPlateau)
 
 from camera_trap_classifier.training.hooks import (
-    TableInitializerCallback, ModelCheckpoint)
+    TableInitializerCallback, ModelCheckpoint, EpochTimer)
 from camera_trap_classifier.config.config import ConfigLoader
 from camera_trap_classifier.config.logging import setup_logging
 from camera_trap_classifier.training.utils import copy_models_and_config_files
@@ -42,7 +42,14 @@ from camera_trap_classifier.predicting.predictor import Predictor
 from camera_trap_classifier.data.tfr_encoder_decoder import (
     DefaultTFRecordEncoderDecoder)
 from camera_trap_classifier.data.reader import DatasetReader
-from camera_trap_classifier.data.image import preprocess_image
+from camera_trap_classifier.data.pipeline_tuning import (
+    fixed_settings, autotune_settings, calibrate_input_pipeline)
+from camera_trap_classifier.data.tfr_index import label_counts_from_tfr_index
+from camera_trap_classifier.data.image import (
+    preprocess_image, preprocess_batch)
+from camera_trap_classifier.data.image_stats import (
+    compute_image_stats, image_stats_cache_key, read_cached_image_stats,
+    write_cached_image_stats)
 from camera_trap_classifier.data.utils import (
     calc_n_batches_per_epoch, export_dict_to_json, read_json,
     n_records_in_tfr_dataset, find_files_with_ending,
@@ -120,6 +127,54 @@ def main():
         "-n_parallel_file_reads", type=int, default=50,
         help='How many files to read in parallel when counting the number of \
               records in tfr files.')
+    parser.add_argument(
+        "-compression_type", type=str, default=None,
+        choices=['GZIP', 'ZLIB'],
+        help="The compression of the tfr files if they were created with \
+              compression (default: not compressed)")
+    parser.add_argument(
+        "-input_pipeline_tuning", type=str, default='none',
+        choices=['none', 'autotune', 'calibrate'],
+        help="How to choose the parallelism of the input pipeline: \
+              'none': read 24 files and decode n_cpus records in parallel \
+              (default), 'autotune': let tf.data tune the parallelism and \
+              the prefetching of batches, 'calibrate': measure the \
+              throughput of a few settings before training and use the \
+              fastest.")
+    parser.add_argument(
+        "-input_pipeline_calibration_batches", type=int, default=20,
+        help="Number of batches to time per setting if \
+              input_pipeline_tuning is 'calibrate' (default 20)")
+    parser.add_argument(
+        "-batch_augmentation", default=False,
+        action='store_true', required=False,
+        help="Decode and resize images per record but flip, color-augment \
+              and standardize whole batches at once. This reduces the \
+              pre-processing time on CPUs.")
+    parser.add_argument(
+        "-cache_val", type=str, default='none',
+        choices=['none', 'memory', 'disk'],
+        help="Cache the decoded and resized validation images (as uint8) \
+              during the first epoch such that later epochs don't read \
+              and decode them again: 'memory' (falls back to 'disk' if \
+              larger than cache_val_max_memory_gb) or 'disk' (files in \
+              run_outputs_dir)")
+    parser.add_argument(
+        "-cache_val_max_memory_gb", type=float, default=4.0,
+        help="Max size of the validation cache in memory (default 4 GB)")
+    parser.add_argument(
+        "-image_stats_sample_rate", type=float, default=1.0,
+        help="Fraction of the training records to calculate the image \
+              means and stdevs from (default 1.0 - all records)")
+    parser.add_argument(
+        "-image_stats_batch_size", type=int, default=256,
+        help="Number of images processed at once when calculating the \
+              image means and stdevs (default 256)")
+    parser.add_argument(
+        "-recompute_image_stats", default=False,
+        action='store_true', required=False,
+        help="Recalculate the image means and stdevs even if they are \
+              cached in train_tfr_path/image_stats.json")
     parser.add_argument(
         "-max_epochs", type=int, default=70,
         help="The max number of epochs to train the model")
@@ -248,6 +303,12 @@ def main():
               individual images to grayscale. Note that grayscale_stacking is \
               an experimental feature and is not yet supported when using \
               the predictor on new images. ")
+    parser.add_argument(
+        "-decode_jpeg_scaled", action='store_true', default=None,
+        help="Decode jpegs at 1/2, 1/4 or 1/8 of their resolution if they \
+              are still larger than the output size (and the crops of the \
+              augmentation) at that resolution. This reduces the decoding \
+              time of images that are much larger than the model input.")
     parser.add_argument(
         "-output_width", type=int, default=None,
         help="The output width in pixels of the image after pre-processing, \
@@ -300,7 +361,7 @@ def main():
     to_overwrite = ['color_augmentation', 'preserve_aspect_ratio',
                     'crop_factor', 'zoom_factor', 'rotate_by_angle',
                     'randomly_flip_horizontally', 'image_choice_for_sets',
-                    'output_width', 'output_height']
+                    'decode_jpeg_scaled', 'output_width', 'output_height']
     for overwrite in to_overwrite:
         if args[overwrite] is not None:
             image_processing[overwrite] = args[overwrite]
@@ -369,37 +430,65 @@ def main():
     tfr_encoder_decoder = DefaultTFRecordEncoderDecoder()
     data_reader = DatasetReader(tfr_encoder_decoder.decode_record)
 
-    # Calculate Dataset Image Means and Stdevs for a dummy batch
-    logger.info("Get Dataset Reader for calculating dataset stats")
+    # Calculate Dataset Image Means and Stdevs of (a sample of) all
+    # training images - or read them from the cache next to the tfr files
     n_records_train = n_records_in_tfr_dataset(
                         tfr_train,
-                        n_parallel_file_reads=args['n_parallel_file_reads'])
-    dataset = data_reader.get_iterator(
-            tfr_files=tfr_train,
-            batch_size=min([4096, n_records_train]),
-            is_train=True,
-            n_repeats=1,
-            output_labels=output_labels,
-            image_pre_processing_fun=preprocess_image,
-            image_pre_processing_args={**image_processing,
-                                       'is_training': False},
-            buffer_size=min([args['buffer_size'], 128]),
-            num_parallel_calls=args['n_cpus'])
-    iterator = dataset.make_one_shot_iterator()
-    batch_data = iterator.get_next()
-
-    logger.info("Calculating image means and stdevs")
-    with tf.Session() as sess:
-        features, labels = sess.run(batch_data)
-
-    # calculate and save image means and stdvs of each color channel
-    # for pre processing purposes
-    image_means = [round(float(x), 4) for x in
-                   list(np.mean(features['images'],
-                                axis=(0, 1, 2), dtype=np.float64))]
-    image_stdevs = [round(float(x), 4) for x in
-                    list(np.std(features['images'],
-                                axis=(0, 1, 2), dtype=np.float64))]
+                        n_parallel_file_reads=args['n_parallel_file_reads'],
+                        compression_type=args['compression_type'])
+
+    image_stats_path = os.path.join(args['train_tfr_path'],
+                                    'image_stats.json')
+    image_stats_key = image_stats_cache_key(
+        tfr_train,
+        sample_rate=args['image_stats_sample_rate'],
+        **{k: image_processing.get(k) for k in
+           ['output_height', 'output_width', 'preserve_aspect_ratio',
+            'image_choice_for_sets', 'decode_jpeg_scaled']})
+
+    if args['recompute_image_stats']:
+        image_stats = None
+    else:
+        image_stats = read_cached_image_stats(
+            image_stats_path, image_stats_key)
+
+    if image_stats is not None:
+        logger.info("Using cached image stats from %s" % image_stats_path)
+        image_means = image_stats['image_means']
+        image_stdevs = image_stats['image_stdevs']
+    else:
+        logger.info("Get Dataset Reader for calculating dataset stats")
+        if args['image_stats_sample_rate'] < 1:
+            sample_rate = args['image_stats_sample_rate']
+        else:
+            sample_rate = None
+        dataset = data_reader.get_iterator(
+                tfr_files=tfr_train,
+                batch_size=min([args['image_stats_batch_size'],
+                                n_records_train]),
+                is_train=False,
+                n_repeats=1,
+                output_labels=output_labels,
+                image_pre_processing_fun=preprocess_image,
+                image_pre_processing_args={**image_processing,
+                                           'is_training': False},
+                num_parallel_calls=args['n_cpus'],
+                drop_batch_remainder=False,
+                compression_type=args['compression_type'],
+                sample_rate=sample_rate)
+
+        logger.info("Calculating image means and stdevs of %s records \
+(sample rate %s)" % (n_records_train, args['image_stats_sample_rate']))
+        moments = compute_image_stats(
+            dataset, num_parallel_calls=args['n_cpus'])
+        write_cached_image_stats(image_stats_path, image_stats_key, moments)
+        image_means = moments.means
+        image_stdevs = moments.stdevs
+
+    # round means and stdvs of each color channel for pre processing
+    # purposes
+    image_means = [round(float(x), 4) for x in image_means]
+    image_stdevs = [round(float(x), 4) for x in image_stdevs]
 
     image_processing['image_means'] = image_means
     image_processing['image_stdevs'] = image_stdevs
@@ -419,7 +508,28 @@ def main():
 
     logger.info("Preparing Data Feeders")
 
-    def input_feeder_train():
+    def pre_processing(is_training,
+                       batch_augmentation=args['batch_augmentation']):
+        """ Arguments of get_iterator to pre-process images per record
+            or to defer flipping, color augmentation and standardization
+            to batches """
+        pre_processing_args = {
+            'image_pre_processing_fun': preprocess_image,
+            'image_pre_processing_args': {
+                **image_processing,
+                'is_training': is_training}}
+        if batch_augmentation:
+            pre_processing_args['image_pre_processing_args'][
+                'batch_augmentation'] = True
+            pre_processing_args['batch_pre_processing_fun'] = \
+                preprocess_batch
+            pre_processing_args['batch_pre_processing_args'] = {
+                **image_processing,
+                'is_training': is_training}
+        return pre_processing_args
+
+    def input_feeder_train(pipeline_settings,
+                           buffer_size=args['buffer_size']):
         return data_reader.get_iterator(
                     tfr_files=tfr_train,
                     batch_size=args['batch_size'],
@@ -427,12 +537,10 @@ def main():
                     n_repeats=None,
                     output_labels=output_labels,
                     label_to_numeric_mapping=class_mapping,
-                    image_pre_processing_fun=preprocess_image,
-                    image_pre_processing_args={
-                        **image_processing,
-                        'is_training': True},
-                    buffer_size=args['buffer_size'],
-                    num_parallel_calls=args['n_cpus'])
+                    buffer_size=buffer_size,
+                    compression_type=args['compression_type'],
+                    **pre_processing(is_training=True),
+                    **pipeline_settings)
 
     def input_feeder_val():
         return data_reader.get_iterator(
@@ -442,12 +550,36 @@ def main():
                     n_repeats=None,
                     output_labels=output_labels,
                     label_to_numeric_mapping=class_mapping,
-                    image_pre_processing_fun=preprocess_image,
-                    image_pre_processing_args={
-                        **image_processing,
-                        'is_training': False},
                     buffer_size=args['buffer_size'],
-                    num_parallel_calls=args['n_cpus'])
+                    compression_type=args['compression_type'],
+                    cache=val_cache,
+                    # cached images are standardized after the cache
+                    **pre_processing(
+                        is_training=False,
+                        batch_augmentation=(args['batch_augmentation'] or
+                                            val_cache is not None)),
+                    **pipeline_settings)
+
+    # Choose the parallelism of the input pipeline
+    if args['input_pipeline_tuning'] == 'autotune':
+        pipeline_settings = autotune_settings(len(tfr_train))
+    elif args['input_pipeline_tuning'] == 'calibrate':
+        # use a small shuffle buffer to not spend the calibration on
+        # filling the buffer
+        pipeline_settings, _ = calibrate_input_pipeline(
+            lambda settings: input_feeder_train(
+                settings, buffer_size=min(args['buffer_size'],
+                                          4 * args['batch_size'])),
+            n_cpus=args['n_cpus'],
+            n_files=len(tfr_train),
+            n_batches=args['input_pipeline_calibration_batches'])
+    else:
+        pipeline_settings = fixed_settings(args['n_cpus'])
+
+    logger.info("Input pipeline settings: %s" % pipeline_settings)
+    export_dict_to_json(
+        pipeline_settings,
+        os.path.join(args['run_outputs_dir'], 'input_pipeline.json'))
 
     logger.info("Calculating batches per epoch")
     if args['n_batches_per_epoch_train'] is None:
@@ -457,7 +589,8 @@ def main():
         n_batches_per_epoch_train = args['n_batches_per_epoch_train']
 
     n_records_val = n_records_in_tfr_dataset(
-        tfr_val, n_parallel_file_reads=args['n_parallel_file_reads'])
+        tfr_val, n_parallel_file_reads=args['n_parallel_file_reads'],
+        compression_type=args['compression_type'])
     n_batches_per_epoch_val = calc_n_batches_per_epoch(
         n_records_val, args['batch_size'])
 
@@ -468,6 +601,37 @@ def main():
     logger.debug("Using %s batches/epoch for the validation set" %
                  n_batches_per_epoch_val)
 
+    # Cache the validation set after decoding and resizing
+    val_cache = None
+    if args['cache_val'] != 'none':
+        cache_size_gb = n_records_val * \
+            input_shape[0] * input_shape[1] * input_shape[2] / 1e9
+        if args['cache_val'] == 'memory' and \
+           cache_size_gb <= args['cache_val_max_memory_gb']:
+            val_cache = ''
+        else:
+            if args['cache_val'] == 'memory':
+                logger.warning(
+                    "Validation cache of %.1f GB exceeds %.1f GB - caching \
+on disk instead" % (cache_size_gb, args['cache_val_max_memory_gb']))
+            val_cache = os.path.join(args['run_outputs_dir'], 'val_cache')
+            # remove caches of previous runs (possibly with other settings)
+            for cache_file in glob.glob(val_cache + '*'):
+                os.remove(cache_file)
+        logger.info("Caching %.1f GB of validation images in %s" %
+                    (cache_size_gb, 'memory' if val_cache == '' else
+                     val_cache))
+
+    # Log the label distributions if the tfr files are indexed
+    for set_name, tfr_files in [('training', tfr_train),
+                                ('validation', tfr_val)]:
+        label_counts = label_counts_from_tfr_index(tfr_files)
+        if label_counts is None:
+            continue
+        for label_name, counts in label_counts.items():
+            logger.info("Label counts of %s in the %s set: %s" %
+                        (label_name, set_name, counts))
+
     ###########################################
     # CREATE MODEL ###########
     ###########################################
@@ -543,8 +707,14 @@ def main():
     # Initialize tables (lookup tables)
     table_init = TableInitializerCallback()
 
-    callbacks_list = [early_stopping, reduce_lr_on_plateau, csv_logger,
-                      checkpointer, checkpointer_best, table_init, tensorboard]
+    # log the training and validation time of each epoch, the timer comes
+    # first to not measure the epoch end of the other callbacks
+    epoch_timer = EpochTimer(
+        report_path=os.path.join(args['run_outputs_dir'], 'epoch_times.json'))
+
+    callbacks_list = [epoch_timer, early_stopping, reduce_lr_on_plateau,
+                      csv_logger, checkpointer, checkpointer_best, table_init,
+                      tensorboard]
 
     ###########################################
     # MODEL TRAINING  ###########
@@ -553,7 +723,7 @@ def main():
     logger.info("Start Model Training")
 
     model.fit(
-        input_feeder_train(),
+        input_feeder_train(pipeline_settings),
         epochs=args['max_epochs'],
         steps_per_epoch=n_batches_per_epoch_train,
         validation_data=input_feeder_val(),
@@ -609,8 +779,9 @@ def main():
                             **image_processing,
                             'is_training': False},
                         buffer_size=args['buffer_size'],
-                        num_parallel_calls=args['n_cpus'],
-                        drop_batch_remainder=False)
+                        drop_batch_remainder=False,
+                        compression_type=args['compression_type'],
+                        **pipeline_settings)
 
         pred = Predictor(
                 model_path=best_model_save_path,
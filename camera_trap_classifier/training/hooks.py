@@ -1,6 +1,8 @@
 """ Hooks / Callbacks that run during model training """
 import csv
 import os
+import json
+import time
 import logging
 import warnings
 
@@ -238,6 +240,69 @@ class TableInitializerCallback(Callback):
         K.get_session().run(tf.tables_initializer())
 
 
+class EpochTimer(Callback):
+    """ Measure the training and the validation time of each epoch
+
+        The validation time is measured between on_test_begin and
+        on_test_end. Keras versions which don't call these during fit
+        (e.g. TF 1.12) are measured from the end of the last training
+        batch to the end of the epoch, which includes the epoch end of
+        callbacks before this one - hence it should be the first callback.
+    """
+    def __init__(self, report_path=None):
+        super(EpochTimer, self).__init__()
+        self.report_path = report_path
+        self.epochs = list()
+        self.val_s = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start_time = time.time()
+        self.last_batch_end_time = self.epoch_start_time
+        self.val_s = None
+
+    def on_batch_end(self, batch, logs=None):
+        self.last_batch_end_time = time.time()
+
+    def on_test_begin(self, logs=None):
+        self.test_start_time = time.time()
+
+    def on_test_end(self, logs=None):
+        if self.val_s is None:
+            self.val_s = 0.0
+        self.val_s += time.time() - self.test_start_time
+
+    def on_epoch_end(self, epoch, logs=None):
+        val_s = self.val_s
+        if val_s is None:
+            val_s = time.time() - self.last_batch_end_time
+        self.epochs.append({
+            'epoch': epoch,
+            'train_s': round(
+                self.last_batch_end_time - self.epoch_start_time, 3),
+            'val_s': round(val_s, 3)})
+        report = self.report()
+        logging.info("Epoch %s: training %.1f s validation %.1f s" %
+                     (epoch, self.epochs[-1]['train_s'],
+                      self.epochs[-1]['val_s']))
+        if report['val_s_saved_per_epoch'] is not None:
+            logging.info("Validation time saved per epoch compared to the \
+first epoch: %.1f s" % report['val_s_saved_per_epoch'])
+        if self.report_path is not None:
+            with open(self.report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def report(self):
+        """ Times of all epochs and the mean validation time saved by the
+            epochs after the first one (e.g. due to a cached validation
+            set) """
+        if len(self.epochs) < 2:
+            saved = None
+        else:
+            later = [x['val_s'] for x in self.epochs[1:]]
+            saved = round(self.epochs[0]['val_s'] - np.mean(later), 3)
+        return {'epochs': self.epochs, 'val_s_saved_per_epoch': saved}
+
+
 class ModelCheckpointer(Callback):
     """ Save model after each epoch """
     def __init__(self, model, path, save_model=True, save_weights=True):
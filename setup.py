@@ -13,7 +13,8 @@ setup(
     ],
     extras_require={
         'tf': ['tensorflow==1.12'],
-        'tf-gpu': ['tensorflow-gpu==1.12']
+        'tf-gpu': ['tensorflow-gpu==1.12'],
+        'pillow': ['Pillow']
     },
     entry_points={
         'console_scripts': [